@@ -1,47 +1,171 @@
+import datetime
 import logging
+import re
+from collections import namedtuple
+from sqlalchemy import String, any_, case, cast, delete, func, literal_column, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from ckan.logic import auth_audit_exempt
 from ckan.plugins import toolkit
 from ckan import model
-from ckanext.dashboard.models import DatasetDashboard
+from ckanext.dashboard import cache, changes, counters, db, fragments, metrics, tokens, urls
+from ckanext.dashboard.auth.dashboard_dataset import editable_package_ids, viewable_package_ids
+from ckanext.dashboard.models import (
+    CONFIG_FIELDS, DashboardChange, DashboardDefinition, DashboardRevision, DatasetDashboard,
+)
 
 log = logging.getLogger(__name__)
 
+DEFAULT_LIST_LIMIT = 100
+MAX_LIST_LIMIT = 1000
+DEFAULT_BULK_CHUNK_SIZE = 500
+DEFAULT_POPULAR_DAYS = 7
+MAX_POPULAR_DAYS = 366
+DEFAULT_POPULAR_LIMIT = 10
+MAX_POPULAR_LIMIT = 100
+DEFAULT_CHANGES_LIMIT = 100
+
+# Columns a bulk upsert record can set, with their maximum length
+UPSERT_FIELDS = {
+    'dashboard_type': 20,
+    'embeded_url': 2000,
+    'report_url': 2000,
+    'report_title': 200,
+}
+
+HOST_RE = re.compile(r'^[a-z0-9]([a-z0-9.-]*[a-z0-9])?(:\d+)?$', re.IGNORECASE)
+
+UpsertResult = namedtuple('UpsertResult', ['id', 'created', 'version'])
+
+
+def _int_param(data_dict, key, default=None):
+    value = data_dict.get(key, default)
+    if value in (None, ''):
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise toolkit.ValidationError({key: ['Must be an integer']})
+
+
+def _definition(session, definition_id):
+    """Loads a DashboardDefinition or raises a ValidationError"""
+    definition = session.query(DashboardDefinition).filter_by(id=definition_id).first()
+    if not definition:
+        raise toolkit.ValidationError({'definition_id': ['Definition not found']})
+    return definition
+
+
+def _use_definition(dashboard, definition):
+    """Makes a dashboard use a shared definition, or its own copy of the
+    current one if ``definition`` is None"""
+    if definition is None and dashboard.definition:
+        for field in CONFIG_FIELDS:
+            setattr(dashboard, field, getattr(dashboard.definition, field))
+    elif definition is not None:
+        for field in CONFIG_FIELDS:
+            setattr(dashboard, field, None)
+    dashboard.definition = definition
+
+
+def show_dict(dashboard):
+    """Dictionary returned for a dashboard by the read actions, from a
+    DashboardRecord or a DatasetDashboard"""
+    data = dashboard._asdict() if hasattr(dashboard, '_asdict') else dashboard.dictize()
+    data['report_title'] = data['report_title'] or 'View full report'
+    return data
+
 
 @toolkit.side_effect_free
+@auth_audit_exempt
+@metrics.instrument('action')
 def dataset_dashboard_show(context, data_dict):
     """
     Returns details of a specific dashboard for the given dataset (by pkg_id).
 
+    The dashboard is loaded together with the visibility of its dataset in
+    a single query. Dashboards of public active datasets are returned
+    straight away; the full auth check only runs for the rest.
+
     :param context: Dictionary with action context information.
     :param data_dict: Dictionary with input data, must include 'pkg_id'.
     :return: Dictionary with dashboard details.
     """
     log.info("Executing dataset_dashboard_show")
-    toolkit.check_access('dataset_dashboard_show', context, data_dict)
 
-    pkg_id = toolkit.get_or_bust(data_dict, 'pkg_id')
+    row = None
+    if data_dict.get('pkg_id'):
+        row = db.read(lambda session: session.query(
+            DatasetDashboard, model.Package.private, model.Package.state
+        ).join(
+            model.Package, model.Package.id == cast(DatasetDashboard.package_id, String)
+        ).filter(
+            DatasetDashboard.package_id == data_dict['pkg_id']
+        ).first())
 
-    session = model.Session
-    dashboard = session.query(DatasetDashboard).filter_by(package_id=pkg_id).first()
+    dashboard, private, state = row or (None, None, None)
+    if not (dashboard and not private and state == 'active'):
+        toolkit.check_access('dataset_dashboard_show', context, data_dict)
+
+    toolkit.get_or_bust(data_dict, 'pkg_id')
 
     if not dashboard:
         raise toolkit.ObjectNotFound("Dashboard not found.")
 
-    return {
-        'id': dashboard.id,
-        'package_id': dashboard.package_id,
-        'embeded_url': dashboard.embeded_url,
-        'report_url': dashboard.report_url,
-        'dashboard_type': dashboard.dashboard_type,
-        'report_title': dashboard.report_title or 'View full report',
+    return show_dict(dashboard)
+
+
+@toolkit.side_effect_free
+@metrics.instrument('action')
+def dataset_dashboard_show_many(context, data_dict):
+    """
+    Returns the dashboards of many datasets at once.
+
+    Dashboards are loaded with a single query (cached lookups aside) and
+    only the ones of datasets the user can see are returned.
+
+    :param context: Dictionary with action context information.
+    :param data_dict: Dictionary with 'package_ids', a list of dataset ids.
+    :return: List with the details of the dashboards found, in the order of
+        'package_ids'.
+    """
+    toolkit.check_access('dataset_dashboard_show_many', context, data_dict)
+
+    package_ids = toolkit.get_or_bust(data_dict, 'package_ids')
+    if isinstance(package_ids, str):
+        package_ids = package_ids.split(',')
+    if not isinstance(package_ids, list) or len(package_ids) > MAX_LIST_LIMIT:
+        raise toolkit.ValidationError({'package_ids': [f'Must be a list of up to {MAX_LIST_LIMIT} ids']})
+    package_ids = [str(package_id) for package_id in package_ids]
+
+    dashboards = {
+        package_id: record
+        for package_id, record in cache.get_dashboards(package_ids).items() if record
     }
+    if not dashboards:
+        return []
+
+    packages = db.read(lambda session: {
+        pkg_id: (private, state, owner_org)
+        for pkg_id, private, state, owner_org in session.query(
+            model.Package.id, model.Package.private, model.Package.state, model.Package.owner_org
+        ).filter(model.Package.id.in_(list(dashboards)))
+    })
+    visible = viewable_package_ids(context, packages)
+
+    return [
+        show_dict(dashboards[package_id])
+        for package_id in dict.fromkeys(package_ids) if package_id in dashboards and package_id in visible
+    ]
 
 
+@metrics.instrument('action')
 def dataset_dashboard_create(context, data_dict):
     """
     Creates a new dashboard for a dataset.
 
     Expected keys in `data_dict` include 'package_id' and 'dashboard_type',
-    ut you can add other fields as needed.
+    ut you can add other fields as needed. With 'definition_id' the dashboard
+    uses that shared definition instead of a configuration of its own.
 
     :param context: Dictionary with action context information.
     :param data_dict: Dictionary with input data for creating the dashboard.
@@ -50,52 +174,85 @@ def dataset_dashboard_create(context, data_dict):
     log.info("Executing dataset_dashboard_create")
     toolkit.check_access('dataset_dashboard_create', context, data_dict)
 
-    # Validate required fields
-    package_id, dashboard_type = toolkit.get_or_bust(
-        data_dict, ['package_id', 'dashboard_type']
-    )
-
-    new_dashboard = DatasetDashboard(
-        package_id=package_id,
-        dashboard_type=dashboard_type,
-        embeded_url=data_dict.get('embeded_url', ''),
-        report_url=data_dict.get('report_url', ''),
-        report_title=data_dict.get('report_title', 'View full report'),
-    )
-
     session = model.Session
+    definition_id = _int_param(data_dict, 'definition_id')
+    if definition_id is not None:
+        package_id = toolkit.get_or_bust(data_dict, 'package_id')
+        new_dashboard = DatasetDashboard(package_id=package_id)
+        _use_definition(new_dashboard, _definition(session, definition_id))
+    else:
+        # Validate required fields
+        package_id, dashboard_type = toolkit.get_or_bust(
+            data_dict, ['package_id', 'dashboard_type']
+        )
+
+        new_dashboard = DatasetDashboard(
+            package_id=package_id,
+            dashboard_type=dashboard_type,
+            embeded_url=data_dict.get('embeded_url', ''),
+            report_url=data_dict.get('report_url', ''),
+            report_title=data_dict.get('report_title', 'View full report'),
+        )
+
+    revision = changes.lock(session, [package_id])
     session.add(new_dashboard)
     session.commit()
+    changes.after_commit([package_id], revision, exists=True)
 
-    return {
-        'id': new_dashboard.id,
-        'package_id': new_dashboard.package_id,
-        'dashboard_type': dashboard_type,
-        'embeded_url': new_dashboard.embeded_url,
-        'report_url': new_dashboard.report_url,
-        'report_title': new_dashboard.report_title
-    }
+    return new_dashboard.dictize()
 
 
+@metrics.instrument('action')
 def dataset_dashboard_update(context, data_dict):
     """
     Updates a specific dashboard.
 
     :param context: Dictionary with action context information.
     :param data_dict: Dictionary with input data, must include the package ID.
+        If 'expected_version' is given the update only goes ahead when the
+        dashboard is still at that version, so concurrent edits can't
+        silently overwrite each other. 'definition_id' switches the dashboard
+        to a shared definition, or to its own copy of the current one when
+        empty. Changing any other field of a dashboard that uses a shared
+        definition also gives it its own copy first, so the change only
+        applies to this dataset.
     :return: Dictionary with the updated dashboard details.
     """
     log.info("Executing dataset_dashboard_update")
     toolkit.check_access('dataset_dashboard_update', context, data_dict)
 
     package_id = toolkit.get_or_bust(data_dict, 'package_id')
+    expected_version = _int_param(data_dict, 'expected_version')
 
     session = model.Session
+    if 'definition_id' in data_dict:
+        definition_id = _int_param(data_dict, 'definition_id')
+        if definition_id is not None and any(field in data_dict for field in UPSERT_FIELDS):
+            raise toolkit.ValidationError({'definition_id': [
+                'A dashboard using a shared definition has no fields of its own'
+            ]})
+        definition = _definition(session, definition_id) if definition_id is not None else None
+
+    # Writes to the dashboard wait for the revision lock, so the version
+    # can't move between the check and the write
+    revision = changes.lock(session, [package_id])
     dashboard = session.query(DatasetDashboard).filter_by(package_id=package_id).first()
 
     if not dashboard:
+        session.rollback()
         raise toolkit.ObjectNotFound("Dashboard not found.")
 
+    if expected_version is not None and dashboard.version != expected_version:
+        session.rollback()
+        raise toolkit.ValidationError({'expected_version': [
+            f'The dashboard was changed by someone else (now at version {dashboard.version})'
+        ]})
+
+    if 'definition_id' in data_dict:
+        _use_definition(dashboard, definition)
+    elif dashboard.definition and any(field in data_dict for field in UPSERT_FIELDS):
+        _use_definition(dashboard, None)
+
     if 'dashboard_type' in data_dict:
         dashboard.dashboard_type = data_dict['dashboard_type']
     if 'embeded_url' in data_dict:
@@ -104,20 +261,16 @@ def dataset_dashboard_update(context, data_dict):
         dashboard.report_url = data_dict['report_url']
     if 'report_title' in data_dict:
         dashboard.report_title = data_dict['report_title'] or 'View full report'
+    dashboard.version = DatasetDashboard.version + 1
 
     session.add(dashboard)
     session.commit()
+    changes.after_commit([package_id], revision)
 
-    return {
-        'id': dashboard.id,
-        'package_id': dashboard.package_id,
-        'dashboard_type': dashboard.dashboard_type,
-        'embeded_url': dashboard.embeded_url,
-        'report_url': dashboard.report_url,
-        'report_title': dashboard.report_title or 'View full report',
-    }
+    return show_dict(dashboard)
 
 
+@metrics.instrument('action')
 def dataset_dashboard_delete(context, data_dict):
     """
     Deletes a specific dashboard.
@@ -140,7 +293,724 @@ def dataset_dashboard_delete(context, data_dict):
     data_dict['package_id'] = dashboard.package_id
     toolkit.check_access('dataset_dashboard_delete', context, data_dict)
 
+    revision = changes.lock(session, [data_dict['package_id']], deleted=True)
     session.delete(dashboard)
     session.commit()
+    changes.after_commit([data_dict['package_id']], revision, exists=False)
 
     return {'success': True, 'message': 'Dashboard successfully deleted.'}
+
+
+def delete_package_dashboards(session, package_ids):
+    """Deletes the dashboards of the given datasets in the session's
+    transaction.
+
+    Returns the revision of the write and the ids of the datasets that had
+    a dashboard, or (None, []) if none had.
+    """
+    table = DatasetDashboard.__table__
+    # A plain read takes no lock, most datasets have no dashboard to delete
+    existing = session.execute(
+        select(table.c.package_id).where(table.c.package_id.in_(package_ids))
+    ).scalars().all()
+    if not existing:
+        return None, []
+    revision = changes.lock(session, existing, deleted=True)
+    deleted = session.execute(
+        delete(table).where(table.c.package_id.in_(existing)).returning(table.c.package_id)
+    ).scalars().all()
+    return revision, [str(package_id) for package_id in deleted]
+
+
+@toolkit.chained_action
+def dataset_purge(original_action, context, data_dict):
+    """Purges the dashboard of a dataset along with it"""
+    pkg = model.Package.get(data_dict['id']) if data_dict.get('id') else None
+    package_id = pkg.id if pkg else None
+
+    result = original_action(context, data_dict)
+
+    if package_id:
+        session = model.Session
+        revision, deleted = delete_package_dashboards(session, [package_id])
+        session.commit()
+        if deleted:
+            log.info(f"Purged the dashboard of dataset {package_id}")
+            changes.after_commit(deleted, revision, exists=False, reindex=False)
+    return result
+
+
+def _upsert_row(record):
+    """Validates a bulk upsert record, returns (row, error)"""
+    if not isinstance(record, dict):
+        return None, 'Record must be an object'
+    if not record.get('package_id') or not record.get('dashboard_type'):
+        return None, 'Missing value: package_id and dashboard_type are required'
+
+    row = {'package_id': str(record['package_id']), 'version': 1}
+    for field, length in UPSERT_FIELDS.items():
+        value = record.get(field)
+        if field == 'report_title' and field in record:
+            value = value or 'View full report'
+        if value is not None and len(str(value)) > length:
+            return None, f'{field} is longer than {length} characters'
+        row[field] = value
+    row.update(urls.identifiers(row['embeded_url'], row['report_url']))
+    return row, None
+
+
+def _upsert_chunk(session, rows):
+    """Writes rows with a single INSERT ... ON CONFLICT (package_id) DO UPDATE.
+
+    Fields missing from a record (None) keep their current value on update.
+    The identifiers parsed from the URLs are replaced when the record has an
+    embed URL. Dashboards using a shared definition get their own copy of it.
+    """
+    table = DatasetDashboard.__table__
+    now = datetime.datetime.utcnow()
+    stmt = insert(table).values([dict(row, updated_at=now) for row in rows])
+
+    def current(field):
+        # Written out so that it refers to the conflicting row
+        shared = literal_column(
+            f'(SELECT dashboard_definition.{field} FROM dashboard_definition '
+            f'WHERE dashboard_definition.id = dashboard_dashboard.definition_id)'
+        )
+        return func.coalesce(table.c[field], shared)
+
+    set_ = {
+        field: func.coalesce(stmt.excluded[field], current(field))
+        for field in UPSERT_FIELDS
+    }
+    set_.update({
+        field: case((stmt.excluded.embeded_url.is_(None), current(field)), else_=stmt.excluded[field])
+        for field in urls.URL_FIELDS
+    })
+    set_.update(updated_at=stmt.excluded.updated_at, version=table.c.version + 1, definition_id=None)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.package_id],
+        set_=set_,
+    ).returning(
+        table.c.id,
+        table.c.package_id,
+        table.c.version,
+        # xmax is only set on rows that already existed
+        literal_column('xmax = 0').label('created'),
+    )
+    return {str(row.package_id): row for row in session.execute(stmt)}
+
+
+def _preview_chunk(session, rows):
+    """Same result as _upsert_chunk, without writing anything"""
+    existing = {
+        str(package_id): (dashboard_id, version)
+        for package_id, dashboard_id, version in session.query(
+            DatasetDashboard.package_id, DatasetDashboard.id, DatasetDashboard.version
+        ).filter(DatasetDashboard.package_id.in_([row['package_id'] for row in rows]))
+    }
+    results = {}
+    for row in rows:
+        dashboard_id, version = existing.get(row['package_id'], (None, 0))
+        results[row['package_id']] = UpsertResult(dashboard_id, dashboard_id is None, version + 1)
+    return results
+
+
+@metrics.instrument('action')
+def dataset_dashboard_bulk_upsert(context, data_dict):
+    """
+    Creates or updates the dashboards of many datasets in one transaction.
+
+    Records are authorized as a batch and written in chunks, each one a
+    single INSERT ... ON CONFLICT (package_id) DO UPDATE, which also makes
+    concurrent submissions for the same dataset safe.
+
+    :param context: Dictionary with action context information.
+    :param data_dict: Dictionary with 'records', a list of dictionaries with
+        'package_id' and 'dashboard_type' and optionally 'embeded_url',
+        'report_url' and 'report_title'. Fields left out keep their current
+        value when the dashboard already exists, dashboards using a shared
+        definition get their own copy of it. With 'dry_run' set the
+        records are validated and authorized but nothing is written.
+    :return: Dictionary with per-record 'results' (in input order, each with
+        'package_id', 'success' and either 'id', 'created' and 'version' or
+        'error') and
+        the 'created', 'updated' and 'failed' counts.
+    """
+    log.info("Executing dataset_dashboard_bulk_upsert")
+    toolkit.check_access('dataset_dashboard_bulk_upsert', context, data_dict)
+
+    records = toolkit.get_or_bust(data_dict, 'records')
+    if not isinstance(records, list):
+        raise toolkit.ValidationError({'records': ['Must be a list']})
+
+    results = [None] * len(records)
+    rows = {}
+    for position, record in enumerate(records):
+        row, error = _upsert_row(record)
+        if error:
+            package_id = record.get('package_id') if isinstance(record, dict) else None
+            results[position] = {'package_id': package_id, 'success': False, 'error': error}
+            continue
+        previous = rows.get(row['package_id'])
+        if previous:
+            results[previous[0]] = {
+                'package_id': row['package_id'], 'success': False,
+                'error': 'Superseded by a later record for the same dataset',
+            }
+        rows[row['package_id']] = (position, row)
+
+    dry_run = toolkit.asbool(data_dict.get('dry_run', False))
+    session = model.Session
+    chunk_size = toolkit.asint(
+        toolkit.config.get('ckanext.dashboard.bulk_upsert.chunk_size', DEFAULT_BULK_CHUNK_SIZE)
+    )
+    package_ids = list(rows)
+    chunks = []
+    for start in range(0, len(package_ids), chunk_size):
+        chunk = package_ids[start:start + chunk_size]
+        owners = dict(
+            session.query(model.Package.id, model.Package.owner_org)
+            .filter(model.Package.id.in_(chunk))
+        )
+        allowed = editable_package_ids(context, owners)
+        writable = []
+        for package_id in chunk:
+            position, row = rows[package_id]
+            if package_id not in owners:
+                results[position] = {'package_id': package_id, 'success': False, 'error': 'Dataset not found'}
+            elif package_id not in allowed:
+                results[position] = {'package_id': package_id, 'success': False, 'error': 'Not authorized'}
+            else:
+                writable.append(row)
+        if writable:
+            chunks.append(writable)
+
+    # Every dashboard write of the site waits on the lock, so it is only
+    # taken once all the records are authorized
+    revision = changes.lock(session) if chunks and not dry_run else None
+    written = {}
+    for writable in chunks:
+        write = _preview_chunk if dry_run else _upsert_chunk
+        written.update(write(session, writable))
+
+    if dry_run:
+        session.rollback()
+    else:
+        if written:
+            changes.record(session, list(written), revision)
+        session.commit()
+
+    for package_id, row in written.items():
+        results[rows[package_id][0]] = {
+            'package_id': package_id, 'success': True, 'id': row.id, 'created': bool(row.created),
+            'version': row.version,
+        }
+    if written and not dry_run:
+        changes.after_commit(list(written), revision, exists=True)
+
+    created = sum(1 for r in results if r['success'] and r['created'])
+    failed = sum(1 for r in results if not r['success'])
+    return {
+        'results': results,
+        'created': created,
+        'updated': len(results) - created - failed,
+        'failed': failed,
+    }
+
+
+# Filters of dataset_dashboard_list on the identifiers parsed from the URLs
+URL_FILTERS = ('tableau_site', 'tableau_workbook', 'tableau_view', 'powerbi_group_id', 'powerbi_report_id')
+
+
+def _config_filter(field, value):
+    """Condition on a configuration field of the dashboards, their own or the
+    one of their shared definition. Both sides can use an index."""
+    shared = select(DashboardDefinition.id).where(getattr(DashboardDefinition, field) == value).correlate(None)
+    # = ANY(ARRAY(...)) is computed once, unlike IN (...) it can be combined
+    # with the other index in a BitmapOr
+    return or_(
+        getattr(DatasetDashboard, field) == value,
+        DatasetDashboard.definition_id == any_(func.array(shared.scalar_subquery())),
+    )
+
+
+def _filter_dashboards(query, data_dict):
+    """Applies the filters of dataset_dashboard_list to a query on
+    DatasetDashboard"""
+    if data_dict.get('dashboard_type'):
+        query = query.filter(_config_filter('dashboard_type', data_dict['dashboard_type']))
+
+    definition_id = _int_param(data_dict, 'definition_id')
+    if definition_id is not None:
+        query = query.filter(DatasetDashboard.definition_id == definition_id)
+
+    if data_dict.get('organization'):
+        org = model.Group.get(data_dict['organization'])
+        if not org or not org.is_organization:
+            raise toolkit.ObjectNotFound("Organization not found.")
+        query = query.join(
+            model.Package, model.Package.id == cast(DatasetDashboard.package_id, String)
+        ).filter(model.Package.owner_org == org.id)
+
+    if data_dict.get('embed_host'):
+        query = query.filter(_config_filter('embed_host', data_dict['embed_host'].strip().lower()))
+
+    for field in URL_FILTERS:
+        value = data_dict.get(field)
+        if value is None:
+            continue
+        if field.startswith('powerbi_'):
+            # Power BI ids are GUIDs, stored in lower case
+            value = value.lower()
+        query = query.filter(_config_filter(field, value))
+
+    return query
+
+
+@toolkit.side_effect_free
+@metrics.instrument('action')
+def dataset_dashboard_list(context, data_dict):
+    """
+    Lists dashboards ordered by id, one page at a time.
+
+    Pagination is keyset based: pass the 'next_marker' of a page as 'marker'
+    to get the next one, which costs the same at any depth.
+
+    :param context: Dictionary with action context information.
+    :param data_dict: Dictionary with the optional filters 'dashboard_type',
+        'organization' (id or name), 'embed_host' (e.g. 'public.tableau.com'),
+        'tableau_site' ('' for the default site), 'tableau_workbook',
+        'tableau_view', 'powerbi_group_id', 'powerbi_report_id' and
+        'definition_id', plus 'marker' (the last id already seen), 'limit'
+        (default 100, max 1000) and 'totals' (default False). The filters on
+        the configuration match dashboards using a shared definition too.
+    :return: Dictionary with the 'results' and the 'next_marker', which is
+        None on the last page. With 'totals', also the number of dashboards
+        matching the filters per dashboard type under 'totals' and their sum
+        under 'count', counted with a single aggregate query.
+    """
+    toolkit.check_access('dataset_dashboard_list', context, data_dict)
+
+    marker = _int_param(data_dict, 'marker')
+    limit = _int_param(data_dict, 'limit', DEFAULT_LIST_LIMIT)
+    if not 0 < limit <= MAX_LIST_LIMIT:
+        raise toolkit.ValidationError({'limit': [f'Must be between 1 and {MAX_LIST_LIMIT}']})
+
+    query = _filter_dashboards(model.Session.query(DatasetDashboard), data_dict)
+
+    if marker is not None:
+        query = query.filter(DatasetDashboard.id > marker)
+
+    query = query.order_by(DatasetDashboard.id).limit(limit + 1)
+    dashboards = db.read(lambda session: query.with_session(session).all())
+    next_marker = dashboards[limit - 1].id if len(dashboards) > limit else None
+
+    result = {
+        'results': [dashboard.dictize() for dashboard in dashboards[:limit]],
+        'next_marker': next_marker,
+    }
+
+    if toolkit.asbool(data_dict.get('totals', False)):
+        dashboard_type = func.coalesce(DatasetDashboard.dashboard_type, DashboardDefinition.dashboard_type)
+        totals_query = _filter_dashboards(
+            model.Session.query(dashboard_type, func.count()).select_from(DatasetDashboard).outerjoin(
+                DashboardDefinition, DashboardDefinition.id == DatasetDashboard.definition_id
+            ), data_dict
+        ).group_by(dashboard_type)
+        totals = dict(db.read(lambda session: totals_query.with_session(session).all()))
+        result['totals'] = totals
+        result['count'] = sum(totals.values())
+
+    return result
+
+
+def _bulk_ids(data_dict):
+    ids = data_dict.get('ids')
+    if isinstance(ids, str):
+        ids = ids.split(',')
+    if not ids:
+        raise toolkit.ValidationError({'ids': ['Missing value']})
+    if len(ids) > MAX_LIST_LIMIT:
+        raise toolkit.ValidationError({'ids': [f'At most {MAX_LIST_LIMIT} dashboards at a time']})
+    try:
+        return [int(dashboard_id) for dashboard_id in ids]
+    except (TypeError, ValueError):
+        raise toolkit.ValidationError({'ids': ['Must be a list of dashboard ids']})
+
+
+def _bulk_write(session, statement, exists=None):
+    """Runs an UPDATE or DELETE on the dashboard table that returns the
+    package_id of the affected rows, commits it and propagates it to the
+    caches. Returns the number of affected dashboards."""
+    revision = changes.lock(session)
+    package_ids = session.execute(statement).scalars().all()
+    if not package_ids:
+        session.rollback()
+        return 0
+    changes.record(session, package_ids, revision, deleted=exists is False)
+    session.commit()
+    changes.after_commit(package_ids, revision, exists=exists)
+    return len(package_ids)
+
+
+@metrics.instrument('action')
+def dataset_dashboard_bulk_update(context, data_dict):
+    """
+    Changes many dashboards with a single UPDATE statement.
+
+    :param context: Dictionary with action context information.
+    :param data_dict: Dictionary with the 'ids' of the dashboards (a list, or
+        a comma separated string, of up to 1000 ids) and what to change:
+        'dashboard_type' to set their type, and/or 'from_host' and 'to_host'
+        to move the embed URLs on 'from_host' to 'to_host'. Dashboards
+        embedded from other hosts keep their URL. Dashboards using a shared
+        definition are left alone, change the definition instead.
+    :return: Dictionary with the number of dashboards 'updated'.
+    """
+    toolkit.check_access('dataset_dashboard_bulk_update', context, data_dict)
+    ids = _bulk_ids(data_dict)
+
+    table = DatasetDashboard.__table__
+    values = {}
+    conditions = [table.c.id.in_(ids), table.c.definition_id.is_(None)]
+    errors = {}
+
+    dashboard_type = data_dict.get('dashboard_type')
+    if dashboard_type:
+        if len(dashboard_type) > UPSERT_FIELDS['dashboard_type']:
+            errors['dashboard_type'] = [f"Must be at most {UPSERT_FIELDS['dashboard_type']} characters"]
+        values['dashboard_type'] = dashboard_type
+
+    from_host, to_host = data_dict.get('from_host'), data_dict.get('to_host')
+    if from_host or to_host:
+        for key, host in (('from_host', from_host), ('to_host', to_host)):
+            if not host or not HOST_RE.match(host.strip()):
+                errors[key] = ['Must be a host name, e.g. public.tableau.com']
+        if not errors:
+            to_host = to_host.strip().lower()
+            conditions.append(table.c.embed_host == from_host.strip().lower().split(':')[0])
+            values['embeded_url'] = func.regexp_replace(
+                table.c.embeded_url, '^(https?://)[^/?#]+', '\\1' + to_host
+            )
+            values['embed_host'] = to_host.split(':')[0]
+
+    if errors:
+        raise toolkit.ValidationError(errors)
+    if not values:
+        raise toolkit.ValidationError({'dashboard_type': ['Nothing to change']})
+
+    values['version'] = table.c.version + 1
+    values['updated_at'] = datetime.datetime.utcnow()
+    statement = update(table).where(*conditions).values(**values).returning(table.c.package_id)
+    updated = _bulk_write(model.Session, statement)
+    log.info(f"Bulk updated {updated} dashboards: {sorted(values)}")
+    return {'updated': updated}
+
+
+@metrics.instrument('action')
+def dataset_dashboard_bulk_delete(context, data_dict):
+    """
+    Deletes many dashboards with a single DELETE statement.
+
+    :param context: Dictionary with action context information.
+    :param data_dict: Dictionary with the 'ids' of the dashboards, a list, or
+        a comma separated string, of up to 1000 ids.
+    :return: Dictionary with the number of dashboards 'deleted'.
+    """
+    toolkit.check_access('dataset_dashboard_bulk_delete', context, data_dict)
+    ids = _bulk_ids(data_dict)
+
+    table = DatasetDashboard.__table__
+    statement = delete(table).where(table.c.id.in_(ids)).returning(table.c.package_id)
+    deleted = _bulk_write(model.Session, statement, exists=False)
+    log.info(f"Bulk deleted {deleted} dashboards")
+    return {'deleted': deleted}
+
+
+def _definition_values(data_dict, required=False):
+    """Validated configuration fields of a definition"""
+    if required:
+        toolkit.get_or_bust(data_dict, ['dashboard_type', 'embeded_url'])
+    values = {}
+    errors = {}
+    for field, length in UPSERT_FIELDS.items():
+        if field not in data_dict:
+            continue
+        value = data_dict[field]
+        if field == 'report_title':
+            value = value or 'View full report'
+        if value is not None and len(str(value)) > length:
+            errors[field] = [f'Must be at most {length} characters']
+        values[field] = value
+    if errors:
+        raise toolkit.ValidationError(errors)
+    return values
+
+
+def _definition_dict(definition, dashboards):
+    data = definition.dictize()
+    data['dashboards'] = dashboards
+    return data
+
+
+@metrics.instrument('action')
+def dataset_dashboard_definition_create(context, data_dict):
+    """
+    Creates a dashboard definition that many datasets can share.
+
+    Dashboards use it when created or updated with its 'definition_id'.
+
+    :param context: Dictionary with action context information.
+    :param data_dict: Dictionary with 'dashboard_type' and 'embeded_url', and
+        optionally 'report_url' and 'report_title'.
+    :return: Dictionary with the details of the new definition.
+    """
+    toolkit.check_access('dataset_dashboard_definition_create', context, data_dict)
+    values = _definition_values(data_dict, required=True)
+    values.setdefault('report_title', 'View full report')
+
+    definition = DashboardDefinition(**values)
+    session = model.Session
+    session.add(definition)
+    session.commit()
+    return _definition_dict(definition, 0)
+
+
+@toolkit.side_effect_free
+@metrics.instrument('action')
+def dataset_dashboard_definition_show(context, data_dict):
+    """
+    Returns a dashboard definition.
+
+    :param context: Dictionary with action context information.
+    :param data_dict: Dictionary with the 'id' of the definition.
+    :return: Dictionary with the details of the definition and the number of
+        'dashboards' using it. Use the 'definition_id' filter of
+        dataset_dashboard_list to get them.
+    """
+    toolkit.check_access('dataset_dashboard_definition_show', context, data_dict)
+    definition_id = _int_param(data_dict, 'id')
+    if definition_id is None:
+        raise toolkit.ValidationError({'id': ['Missing value']})
+
+    def load(session):
+        definition = session.query(DashboardDefinition).filter_by(id=definition_id).first()
+        dashboards = session.query(func.count(DatasetDashboard.id)).filter(
+            DatasetDashboard.definition_id == definition_id
+        ).scalar() if definition else 0
+        return definition, dashboards
+
+    definition, dashboards = db.read(load)
+    if not definition:
+        raise toolkit.ObjectNotFound("Definition not found.")
+    return _definition_dict(definition, dashboards)
+
+
+@metrics.instrument('action')
+def dataset_dashboard_definition_update(context, data_dict):
+    """
+    Updates a dashboard definition, and so the dashboards of all the
+    datasets using it.
+
+    The change is a single row write whatever the number of datasets, which
+    then see it on their next read.
+
+    :param context: Dictionary with action context information.
+    :param data_dict: Dictionary with the 'id' of the definition and the
+        fields to change: 'dashboard_type', 'embeded_url', 'report_url'
+        and/or 'report_title'. If 'expected_version' is given the update
+        only goes ahead when the definition is still at that version.
+    :return: Dictionary with the updated definition and the number of
+        'dashboards' using it.
+    """
+    toolkit.check_access('dataset_dashboard_definition_update', context, data_dict)
+    definition_id = _int_param(data_dict, 'id')
+    if definition_id is None:
+        raise toolkit.ValidationError({'id': ['Missing value']})
+    expected_version = _int_param(data_dict, 'expected_version')
+    values = _definition_values(data_dict)
+    if not values:
+        raise toolkit.ValidationError({'embeded_url': ['Nothing to change']})
+
+    session = model.Session
+    revision = changes.lock(session)
+    definition = session.query(DashboardDefinition).filter_by(id=definition_id).with_for_update().first()
+    if not definition:
+        session.rollback()
+        raise toolkit.ObjectNotFound("Definition not found.")
+    if expected_version is not None and definition.version != expected_version:
+        session.rollback()
+        raise toolkit.ValidationError({'expected_version': [
+            f'The definition was changed by someone else (now at version {definition.version})'
+        ]})
+
+    for field, value in values.items():
+        setattr(definition, field, value)
+    # The row is locked, so the version can be computed here
+    definition.version += 1
+    session.flush()
+
+    package_ids = session.execute(
+        select(DatasetDashboard.package_id).where(DatasetDashboard.definition_id == definition_id)
+    ).scalars().all()
+    changes.record(session, package_ids, revision)
+    session.commit()
+    changes.after_commit(package_ids, revision)
+    log.info(f"Updated dashboard definition {definition_id}, used by {len(package_ids)} datasets")
+
+    return _definition_dict(definition, len(package_ids))
+
+
+@metrics.instrument('action')
+def dataset_dashboard_definition_delete(context, data_dict):
+    """
+    Deletes a dashboard definition no dashboard uses any more.
+
+    :param context: Dictionary with action context information.
+    :param data_dict: Dictionary with the 'id' of the definition.
+    :return: Dictionary confirming the deletion.
+    """
+    toolkit.check_access('dataset_dashboard_definition_delete', context, data_dict)
+    definition_id = _int_param(data_dict, 'id')
+    if definition_id is None:
+        raise toolkit.ValidationError({'id': ['Missing value']})
+
+    session = model.Session
+    definition = session.query(DashboardDefinition).filter_by(id=definition_id).with_for_update().first()
+    if not definition:
+        session.rollback()
+        raise toolkit.ObjectNotFound("Definition not found.")
+    dashboards = session.query(func.count(DatasetDashboard.id)).filter(
+        DatasetDashboard.definition_id == definition_id
+    ).scalar()
+    if dashboards:
+        session.rollback()
+        raise toolkit.ValidationError({'id': [f'The definition is used by {dashboards} dashboards']})
+
+    session.delete(definition)
+    session.commit()
+    return {'success': True, 'message': 'Definition successfully deleted.'}
+
+
+@toolkit.side_effect_free
+@metrics.instrument('action')
+def dataset_dashboard_popular(context, data_dict):
+    """
+    Returns the public datasets whose dashboard was viewed the most.
+
+    Views are counted in memory by each worker and added to daily totals in
+    batches, so the last few seconds of views may be missing. The result is
+    read from the daily totals and cached for
+    ckanext.dashboard.views.popular_cache_ttl seconds.
+
+    :param context: Dictionary with action context information.
+    :param data_dict: Dictionary with the optional 'days' to look back,
+        today included (default 7, max 366), and 'limit' (default 10, max
+        100).
+    :return: List of dictionaries with 'package_id', 'name', 'title' and
+        'views', most viewed first.
+    """
+    toolkit.check_access('dataset_dashboard_popular', context, data_dict)
+
+    days = _int_param(data_dict, 'days', DEFAULT_POPULAR_DAYS)
+    if not 0 < days <= MAX_POPULAR_DAYS:
+        raise toolkit.ValidationError({'days': [f'Must be between 1 and {MAX_POPULAR_DAYS}']})
+    limit = _int_param(data_dict, 'limit', DEFAULT_POPULAR_LIMIT)
+    if not 0 < limit <= MAX_POPULAR_LIMIT:
+        raise toolkit.ValidationError({'limit': [f'Must be between 1 and {MAX_POPULAR_LIMIT}']})
+
+    return counters.popular(days, limit)
+
+
+@toolkit.side_effect_free
+@metrics.instrument('action')
+def dataset_dashboard_changes_since(context, data_dict):
+    """
+    Returns the dashboard writes after a given sequence number, oldest
+    first, so other systems can follow the dashboards without rescanning
+    them.
+
+    Every write records a change per dataset it touched, deletes included,
+    with a sequence number that only grows in commit order. Start with
+    'seq' 0 and pass the 'next_seq' of each page to get the next one. A
+    dataset changed several times is listed once per change, always with
+    its current dashboard, so applying the changes in order is enough.
+
+    :param context: Dictionary with action context information.
+    :param data_dict: Dictionary with the optional 'seq' (the last seq
+        already seen, default 0) and 'limit' (default 100, max 1000).
+    :return: Dictionary with the 'changes', 'next_seq' to pass next time
+        and 'has_more'. Each change has its 'seq', 'package_id', 'revision',
+        'changed_at', 'deleted' (True when the write deleted the dashboard)
+        and the current 'dashboard' of the dataset, None if it has none any
+        more. Raises a ValidationError with the 'pruned_seq' when changes
+        after 'seq' were already pruned. The consumer then syncs fully with
+        dataset_dashboard_list and continues from 'pruned_seq'.
+    """
+    toolkit.check_access('dataset_dashboard_changes_since', context, data_dict)
+
+    seq = _int_param(data_dict, 'seq', 0)
+    if seq < 0:
+        raise toolkit.ValidationError({'seq': ['Must be 0 or more']})
+    limit = _int_param(data_dict, 'limit', DEFAULT_CHANGES_LIMIT)
+    if not 0 < limit <= MAX_LIST_LIMIT:
+        raise toolkit.ValidationError({'limit': [f'Must be between 1 and {MAX_LIST_LIMIT}']})
+
+    def load(session):
+        pruned = DashboardRevision.pruned(session)
+        rows = session.query(DashboardChange, DatasetDashboard).outerjoin(
+            DatasetDashboard, DatasetDashboard.package_id == DashboardChange.package_id
+        ).filter(
+            DashboardChange.seq > seq
+        ).order_by(DashboardChange.seq).limit(limit + 1).all()
+        return pruned, rows
+
+    pruned, rows = db.read(load)
+    if seq < pruned:
+        raise toolkit.ValidationError({
+            'seq': [f'Changes up to seq {pruned} were pruned, sync fully and continue from there'],
+            'pruned_seq': [pruned],
+        })
+
+    result = [
+        {
+            'seq': change.seq,
+            'package_id': str(change.package_id),
+            'revision': change.revision,
+            'changed_at': change.changed_at.isoformat(),
+            'deleted': change.deleted,
+            'dashboard': show_dict(dashboard) if dashboard else None,
+        }
+        for change, dashboard in rows[:limit]
+    ]
+    return {
+        'changes': result,
+        'next_seq': result[-1]['seq'] if result else seq,
+        'has_more': len(rows) > limit,
+    }
+
+
+@toolkit.side_effect_free
+@metrics.instrument('action')
+def dataset_dashboard_cache_stats(context, data_dict):
+    """
+    Returns the counters of this worker's dashboard lookup cache.
+
+    :param context: Dictionary with action context information.
+    :param data_dict: Not used.
+    :return: Dictionary with size, maxsize, ttl, hits, misses and evictions,
+        plus the state of the index of datasets with dashboards under 'index'
+        and of the cross-worker revision check under 'revision'. The hit
+        ratio and render time of the rendered fragment cache are under
+        'fragments'. How many reads went to the read replica and how often
+        it failed over to the primary are under 'replica'. The embed tokens
+        cached and minted are under 'tokens', the dashboard views counted
+        and written are under 'views'.
+    """
+    toolkit.check_access('dataset_dashboard_cache_stats', context, data_dict)
+    stats = cache.stats()
+    stats['fragments'] = fragments.stats()
+    stats['replica'] = db.stats()
+    stats['tokens'] = tokens.stats()
+    stats['views'] = counters.stats()
+    return stats
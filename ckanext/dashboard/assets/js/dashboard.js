@@ -1,3 +1,184 @@
-$(document).ready(function() {
-    
-});
\ No newline at end of file
+/* Lazily embeds a Tableau or Power BI dashboard.
+ *
+ * The page only renders a placeholder. The vendor script and the embed
+ * itself are injected when the placeholder gets close to the viewport or
+ * when the user clicks on "Load dashboard", whatever happens first.
+ *
+ * type        - "tableau" or "powerbi"
+ * src         - the embed URL of the dashboard
+ * height      - height of the embed, in pixels
+ * root-margin - how close to the viewport the embed starts loading
+ * token-url   - set for secured dashboards, where to get their embed token
+ * view-url    - set when the browser reports the views, where to send them
+ */
+ckan.module("dashboard-embed", function ($) {
+  "use strict";
+
+  var TABLEAU_API = "https://public.tableau.com/javascripts/api/tableau.embedding.3.latest.min.js";
+  var TABLEAU_SERVER_API = "/javascripts/api/tableau.embedding.3.latest.min.js";
+  var POWERBI_API = "https://cdn.jsdelivr.net/npm/powerbi-client@2.23.1/dist/powerbi.min.js";
+  // Get a new Power BI token this long before the current one expires
+  var TOKEN_REFRESH_MARGIN = 60 * 1000;
+  var loadedScripts = {};
+
+  function loadScript(src, type) {
+    if (!loadedScripts[src]) {
+      var script = document.createElement("script");
+      var loaded = $.Deferred();
+      if (type) {
+        script.type = type;
+      }
+      script.onload = loaded.resolve;
+      script.onerror = loaded.reject;
+      script.src = src;
+      document.head.appendChild(script);
+      loadedScripts[src] = loaded.promise();
+    }
+    return loadedScripts[src];
+  }
+
+  return {
+    options: {
+      type: null,
+      src: null,
+      height: 600,
+      rootMargin: "200px",
+      tokenUrl: null,
+      viewUrl: null,
+    },
+
+    initialize: function () {
+      $.proxyAll(this, /_on/);
+      this.loaded = false;
+      this.el.find("[data-dashboard-load]").on("click", this._onLoad);
+
+      if ("IntersectionObserver" in window) {
+        this.observer = new IntersectionObserver(this._onIntersect, {
+          rootMargin: this.options.rootMargin,
+        });
+        this.observer.observe(this.el[0]);
+      }
+    },
+
+    teardown: function () {
+      if (this.observer) {
+        this.observer.disconnect();
+      }
+      clearTimeout(this.refreshTimer);
+    },
+
+    _onIntersect: function (entries) {
+      for (var i = 0; i < entries.length; i++) {
+        if (entries[i].isIntersecting) {
+          this._onLoad();
+          return;
+        }
+      }
+    },
+
+    _onLoad: function (event) {
+      if (event) {
+        event.preventDefault();
+      }
+      if (this.loaded) {
+        return;
+      }
+      this.loaded = true;
+      this.teardown();
+
+      if (this.options.tokenUrl) {
+        $.getJSON(this.options.tokenUrl).done(this._onToken).fail(this._onTokenError);
+        return;
+      }
+      this._replacePlaceholder(this._createEmbed());
+    },
+
+    _replacePlaceholder: function (embed) {
+      if (embed) {
+        this.el.find(".dashboard-embed-placeholder").replaceWith(embed);
+        this.sandbox.publish("dashboard-embed:loaded", this.options.type, this.options.src);
+        this._sendView();
+      }
+    },
+
+    _sendView: function () {
+      if (!this.options.viewUrl || !navigator.sendBeacon) {
+        return;
+      }
+      // The page's CSRF token, sendBeacon can't set headers
+      var data = new FormData();
+      var field = $("meta[name=csrf_field_name]").attr("content");
+      if (field) {
+        data.append(field, $('meta[name="' + field + '"]').attr("content"));
+      }
+      navigator.sendBeacon(this.options.viewUrl, data);
+    },
+
+    _onToken: function (data) {
+      if (data.type === "tableau") {
+        loadScript(new URL(data.embed_url).origin + TABLEAU_SERVER_API, "module");
+        this._replacePlaceholder($("<tableau-viz>", {
+          id: "viz",
+          src: data.embed_url,
+          token: data.token,
+          toolbar: "bottom",
+          "hide-tabs": "",
+        }));
+      } else if (data.type === "powerbi") {
+        var container = $("<div>", { "class": "dashboard-embed-powerbi" }).css("height", this.options.height);
+        this._replacePlaceholder(container);
+        loadScript(POWERBI_API).done(function () {
+          this.report = window.powerbi.embed(container[0], {
+            type: "report",
+            id: data.report_id,
+            embedUrl: data.embed_url,
+            accessToken: data.token,
+            tokenType: window["powerbi-client"].models.TokenType.Embed,
+          });
+          this._scheduleRefresh(data.expires_at);
+        }.bind(this));
+      }
+    },
+
+    _onTokenError: function () {
+      this.loaded = false;
+      this.el.find(".dashboard-embed-placeholder p").text(this._("Could not load the dashboard, try again later."));
+    },
+
+    _scheduleRefresh: function (expiresAt) {
+      var delay = Math.max(new Date(expiresAt).getTime() - Date.now() - TOKEN_REFRESH_MARGIN, 0);
+      this.refreshTimer = setTimeout(this._onRefresh, delay);
+    },
+
+    _onRefresh: function () {
+      $.getJSON(this.options.tokenUrl).done(function (data) {
+        this.report.setAccessToken(data.token);
+        this._scheduleRefresh(data.expires_at);
+      }.bind(this));
+    },
+
+    _createEmbed: function () {
+      var options = this.options;
+      if (options.type === "tableau") {
+        // The element upgrades itself once the embedding API is loaded
+        loadScript(TABLEAU_API, "module");
+        return $("<tableau-viz>", {
+          id: "viz",
+          src: options.src,
+          toolbar: "bottom",
+          "hide-tabs": "",
+        });
+      }
+      if (options.type === "powerbi") {
+        return $("<iframe>", {
+          width: "100%",
+          height: options.height,
+          src: options.src,
+          frameborder: "0",
+          allowfullscreen: "true",
+        });
+      }
+      return null;
+    },
+  };
+});
@@ -2,6 +2,9 @@
 Dashboard auth functions
 """
 
+from flask import has_request_context, request
+
+from ckan import authz
 from ckan.plugins import toolkit
 
 
@@ -14,15 +17,34 @@ def _pkg_id_from(data_dict):
     )
 
 
+def _check_package(context, permission, pkg_id):
+    """Runs a package auth check, at most once per request.
+
+    A dataset page asks for the same permission several times (nav icon,
+    views, helpers), so results are memoized in the request environ by
+    (user, permission, dataset) and go away with the request.
+    """
+    memo = None
+    if has_request_context():
+        memo = request.environ.setdefault('ckanext.dashboard.auth_memo', {})
+        key = (context.get('user'), permission, pkg_id)
+        if key in memo:
+            return dict(memo[key])
+    try:
+        toolkit.check_access(permission, context, {'id': pkg_id})
+        result = {"success": True}
+    except toolkit.NotAuthorized:
+        result = {"success": False}
+    if memo is not None:
+        memo[key] = dict(result)
+    return result
+
+
 def _can_edit_pkg(context, data_dict):
     pkg_id = _pkg_id_from(data_dict)
     if not pkg_id:
         return {"success": False}
-    try:
-        toolkit.check_access('package_update', context, {'id': pkg_id})
-        return {"success": True}
-    except toolkit.NotAuthorized:
-        return {"success": False}
+    return _check_package(context, 'package_update', pkg_id)
 
 
 def _can_view_pkg(context, data_dict):
@@ -30,11 +52,7 @@ def _can_view_pkg(context, data_dict):
     pkg_id = _pkg_id_from(data_dict)
     if not pkg_id:
         return {"success": False}
-    try:
-        toolkit.check_access('package_show', context, {'id': pkg_id})
-        return {"success": True}
-    except toolkit.NotAuthorized:
-        return {"success": False}
+    return _check_package(context, 'package_show', pkg_id)
 
 
 def dashboard_dataset_create(context, data_dict):
@@ -52,7 +70,134 @@ def dashboard_dataset_delete(context, data_dict):
     return _can_edit_pkg(context, data_dict)
 
 
+def editable_package_ids(context, packages):
+    """Returns the ids of the datasets the context user can edit.
+
+    ``packages`` maps dataset ids to their ``owner_org``. The organizations
+    where the user can update datasets are resolved once for the whole
+    batch; only datasets outside of them (no organization, collaborators)
+    go through a package_update check of their own.
+    """
+    user = context.get('user')
+    if context.get('ignore_auth') or authz.is_sysadmin(user):
+        return set(packages)
+    if not user:
+        return set()
+
+    orgs = toolkit.get_action('organization_list_for_user')(
+        {'user': user}, {'permission': 'update_dataset'}
+    )
+    org_ids = {org['id'] for org in orgs}
+
+    allowed = set()
+    for pkg_id, owner_org in packages.items():
+        if owner_org in org_ids or _can_edit_pkg(context, {'id': pkg_id})['success']:
+            allowed.add(pkg_id)
+    return allowed
+
+
+def viewable_package_ids(context, packages):
+    """Returns the ids of the datasets the context user can see.
+
+    ``packages`` maps dataset ids to their ``(private, state, owner_org)``.
+    Public active datasets are visible to everyone and the organizations
+    the user can read are resolved once for the whole batch; anything else
+    goes through a package_show check of its own.
+    """
+    user = context.get('user')
+    if context.get('ignore_auth') or authz.is_sysadmin(user):
+        return set(packages)
+
+    allowed = set()
+    pending = {}
+    for pkg_id, (private, state, owner_org) in packages.items():
+        if not private and state == 'active':
+            allowed.add(pkg_id)
+        else:
+            pending[pkg_id] = (state, owner_org)
+    if not pending:
+        return allowed
+
+    org_ids = set()
+    if user:
+        orgs = toolkit.get_action('organization_list_for_user')(
+            {'user': user}, {'permission': 'read'}
+        )
+        org_ids = {org['id'] for org in orgs}
+
+    for pkg_id, (state, owner_org) in pending.items():
+        if (state == 'active' and owner_org in org_ids) or _can_view_pkg(context, {'id': pkg_id})['success']:
+            allowed.add(pkg_id)
+    return allowed
+
+
+@toolkit.auth_disallow_anonymous_access
+def dashboard_dataset_bulk_upsert(context, data_dict):
+    """Any logged in user can call it, each record is then authorized
+    against its dataset (see editable_package_ids)."""
+    return {"success": True}
+
+
 @toolkit.auth_allow_anonymous_access
 def dashboard_dataset_show(context, data_dict):
     """Viewing the dashboard requires permission to view the dataset."""
     return _can_view_pkg(context, data_dict)
+
+
+@toolkit.auth_allow_anonymous_access
+def dashboard_dataset_show_many(context, data_dict):
+    """Anyone can call it, only the dashboards of the datasets the user
+    can see are returned (see viewable_package_ids)."""
+    return {"success": True}
+
+
+def dashboard_dataset_list(context, data_dict):
+    """Only sysadmins can list all the dashboards."""
+    return {"success": False}
+
+
+def dashboard_dataset_bulk_update(context, data_dict):
+    """Only sysadmins can change dashboards across datasets."""
+    return {"success": False}
+
+
+def dashboard_dataset_bulk_delete(context, data_dict):
+    """Only sysadmins can delete dashboards across datasets."""
+    return {"success": False}
+
+
+def dashboard_definition_create(context, data_dict):
+    """Only sysadmins can manage the definitions shared across datasets."""
+    return {"success": False}
+
+
+def dashboard_definition_show(context, data_dict):
+    """Only sysadmins can manage the definitions shared across datasets."""
+    return {"success": False}
+
+
+def dashboard_definition_update(context, data_dict):
+    """Only sysadmins can change the dashboards of many datasets at once."""
+    return {"success": False}
+
+
+def dashboard_definition_delete(context, data_dict):
+    """Only sysadmins can manage the definitions shared across datasets."""
+    return {"success": False}
+
+
+@toolkit.auth_allow_anonymous_access
+def dashboard_dataset_popular(context, data_dict):
+    """Anyone can see the most viewed dashboards, only public datasets are
+    listed."""
+    return {"success": True}
+
+
+def dashboard_dataset_changes_since(context, data_dict):
+    """Only sysadmins can follow the changes of all the dashboards."""
+    return {"success": False}
+
+
+def dashboard_cache_stats(context, data_dict):
+    """Only sysadmins can read the cache counters."""
+    return {"success": False}
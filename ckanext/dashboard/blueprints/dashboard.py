@@ -1,12 +1,16 @@
+import datetime
 import logging
+import uuid
 from ckan import model
 import ckan.plugins as p
-from flask import Blueprint, request, redirect, url_for
+from flask import Blueprint, Response, jsonify, make_response, request, redirect, url_for
+from werkzeug.http import is_resource_modified
 from ckan.plugins import toolkit
 from ckan.lib.helpers import helper_functions as h
 
 # Import or define the decorator to restrict access to sysadmins.
 # You can define it in your extension or import it if you already have it.
+from ckanext.dashboard import cache, counters, db, metrics, tokens
 from ckanext.dashboard.decorators import require_sysadmin_user
 
 log = logging.getLogger(__name__)
@@ -14,7 +18,119 @@ log = logging.getLogger(__name__)
 dashboard_bp = Blueprint('embeded_dashboard', __name__)
 
 
+def _validators(dashboard):
+    """ETag and Last-Modified of a dashboard dictionary"""
+    etag = f"{dashboard['id']}-{dashboard['version']}"
+    if dashboard.get('definition_id'):
+        etag += f"-{dashboard['definition_id']}.{dashboard['definition_version']}"
+    last_modified = datetime.datetime.fromisoformat(dashboard['updated_at']).replace(
+        tzinfo=datetime.timezone.utc
+    )
+    return etag, last_modified
+
+
+@dashboard_bp.after_app_request
+def dashboard_show_validators(response):
+    """Adds ETag and Last-Modified to the dataset_dashboard_show API
+    responses and answers conditional requests that match with a 304"""
+    if (request.method not in ('GET', 'HEAD') or response.status_code != 200
+            or (request.view_args or {}).get('logic_function') != 'dataset_dashboard_show'):
+        return response
+    result = (response.get_json(silent=True) or {}).get('result') or {}
+    if not result.get('version'):
+        return response
+    etag, last_modified = _validators(result)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return response.make_conditional(request)
+
+
+# Read-your-writes when dashboard reads go to a replica
+dashboard_bp.after_app_request(db.set_sticky_cookie)
+
+
+@dashboard_bp.route('/dataset/dashboard/<package_id>/embed', endpoint='embed')
+@metrics.instrument('view')
+def dashboard_embed(package_id):
+    """The dashboard snippet of a dataset on its own, with validators so
+    clients and proxies can revalidate it instead of downloading it again"""
+    context = {'model': model, 'user': p.toolkit.c.user}
+    try:
+        dashboard = toolkit.get_action('dataset_dashboard_show')(context, {'pkg_id': package_id})
+    except toolkit.ObjectNotFound:
+        toolkit.abort(404, 'Dashboard not found')
+    except toolkit.NotAuthorized:
+        toolkit.abort(403, 'Not authorized to view this dashboard')
+
+    etag, last_modified = _validators(dashboard)
+    # The snippet is translated
+    etag = f"{etag}-{h.lang()}"
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response('', 304)
+    else:
+        response = make_response(toolkit.render('dashboard/snippet.html', {'dashboard': dashboard}))
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+@dashboard_bp.route('/dataset/dashboard/<package_id>/token', endpoint='token')
+@metrics.instrument('view')
+def dashboard_token(package_id):
+    """Embed token of a secured dashboard, fetched by the dashboard-embed
+    module before it loads the dashboard"""
+    context = {'model': model, 'user': p.toolkit.c.user}
+    try:
+        dashboard = toolkit.get_action('dataset_dashboard_show')(context, {'pkg_id': package_id})
+    except toolkit.ObjectNotFound:
+        toolkit.abort(404, 'Dashboard not found')
+    except toolkit.NotAuthorized:
+        toolkit.abort(403, 'Not authorized to view this dashboard')
+
+    record = cache.DashboardRecord.from_dict(dashboard)
+    try:
+        result = tokens.get_token(record, p.toolkit.c.user)
+    except toolkit.NotAuthorized as e:
+        toolkit.abort(403, str(e))
+    except tokens.TokenError:
+        toolkit.abort(502, 'Could not get an embed token for this dashboard')
+    if not result:
+        toolkit.abort(404, 'This dashboard is not embedded with a token')
+
+    provider, token = result
+    response = jsonify(dict(
+        provider.embed_config(record),
+        type=record.dashboard_type,
+        embed_url=record.embeded_url,
+        token=token.value,
+        expires_at=datetime.datetime.fromtimestamp(token.expires_at, datetime.timezone.utc).isoformat(),
+    ))
+    response.cache_control.no_store = True
+    response.cache_control.private = True
+    return response
+
+
+@dashboard_bp.route('/dataset/dashboard/<package_id>/view', methods=['POST'], endpoint='view')
+@metrics.instrument('view')
+def dashboard_view_beacon(package_id):
+    """Counts a view of a dashboard, reported by the dashboard-embed module
+    once it is loaded. Only counted in memory, see counters.ViewCounter."""
+    if not counters.beacon_enabled():
+        toolkit.abort(404, 'Dashboard views are not reported by the browser')
+    try:
+        uuid.UUID(package_id)
+    except ValueError:
+        toolkit.abort(400, 'Invalid dataset id')
+    if not cache.get_dashboard(package_id):
+        toolkit.abort(404, 'Dashboard not found')
+    counters.counter.record(package_id)
+    return Response(status=204)
+
+
 @dashboard_bp.route('/dataset/dashboard/<package_id>', methods=['GET', 'POST'], endpoint='create')
+@metrics.instrument('view')
 def dashboard_create(package_id):
     """Create a new dashboard (view and logic for creation)"""
 
@@ -48,21 +164,59 @@ def dashboard_create(package_id):
             'report_title': request.form.get('report_title', 'View full report'),
         }
         context = {'model': model, 'user': p.toolkit.c.user}
-        action = 'dataset_dashboard_create' if not dashboard_dict else 'dataset_dashboard_update'
+        if dashboard_dict and request.form.get('version'):
+            return _dashboard_update(context, data, request.form['version'], pkg_dict, dashboard_dict)
+
+        # A single upsert, so concurrent submits can't both try to create it
         try:
-            dashboard_dict = p.toolkit.get_action(action)(context, data)
+            result = p.toolkit.get_action('dataset_dashboard_bulk_upsert')(context, {'records': [data]})
         except toolkit.NotAuthorized:
             toolkit.abort(403, 'Not authorized to create/update this dashboard')
 
-        h.flash_success(f'Dashboard {action.split("_")[-1]}d successfully', 'success')
-        log.info(f"Dashboard {action.split('_')[-1]}d")
+        result = result['results'][0]
+        if not result['success']:
+            if result['error'] == 'Not authorized':
+                toolkit.abort(403, 'Not authorized to create/update this dashboard')
+            h.flash_error(f'Error: {result["error"]}', 'error')
+            return toolkit.render('dashboard/form.html', {"pkg_dict": pkg_dict, "dashboard": dashboard_dict})
+
+        action = 'create' if result['created'] else 'update'
+        h.flash_success(f'Dashboard {action}d successfully', 'success')
+        log.info(f"Dashboard {action}d")
 
         return redirect(url_for('dataset.read', id=pkg_dict['id']))
     return toolkit.render('dashboard/form.html', {"pkg_dict": pkg_dict, "dashboard": dashboard_dict})
 
 
+def _dashboard_update(context, data, version, pkg_dict, dashboard_dict):
+    """Saves the edit form, as long as nobody changed the dashboard since
+    the form was loaded"""
+    data['expected_version'] = version
+    try:
+        p.toolkit.get_action('dataset_dashboard_update')(context, data)
+    except toolkit.NotAuthorized:
+        toolkit.abort(403, 'Not authorized to create/update this dashboard')
+    except toolkit.ObjectNotFound:
+        h.flash_error('Error: The dashboard was deleted by someone else', 'error')
+        return toolkit.render('dashboard/form.html', {"pkg_dict": pkg_dict, "dashboard": {}})
+    except toolkit.ValidationError as e:
+        errors = e.error_dict.get('expected_version') or [str(e)]
+        h.flash_error(f'Error: {errors[0]}', 'error')
+        # Reload the form with the current values
+        try:
+            dashboard_dict = toolkit.get_action('dataset_dashboard_show')({}, {'pkg_id': pkg_dict['id']})
+        except toolkit.ObjectNotFound:
+            dashboard_dict = {}
+        return toolkit.render('dashboard/form.html', {"pkg_dict": pkg_dict, "dashboard": dashboard_dict})
+
+    h.flash_success('Dashboard updated successfully', 'success')
+    log.info("Dashboard updated")
+    return redirect(url_for('dataset.read', id=pkg_dict['id']))
+
+
 @dashboard_bp.route('/delete/<package_id>/<dashboard_id>', methods=['POST'], endpoint='dashboard_delete')
 @require_sysadmin_user
+@metrics.instrument('view')
 def dashboard_delete(package_id, dashboard_id):
     """Delete the configuration of a dashboard using its unique ID"""
     log.debug("Deleting dashboard for dashboard_id: %s", dashboard_id)
@@ -75,3 +229,79 @@ def dashboard_delete(package_id, dashboard_id):
         h.flash_error(f'Error: {e}', 'error')
         log.error("Error deleting dashboard for dashboard_id %s: %s", dashboard_id, e)
     return redirect(url_for('dataset.read', id=package_id))
+
+
+CONSOLE_PAGE_SIZE = 50
+CONSOLE_FILTERS = ('dashboard_type', 'organization', 'embed_host')
+
+
+@dashboard_bp.route('/ckan-admin/dashboards', methods=['GET', 'POST'], endpoint='console')
+@require_sysadmin_user
+@metrics.instrument('view')
+def dashboard_console():
+    """All the dashboards, filtered and paged, with bulk changes to the
+    selected ones"""
+    filters = {key: request.args[key] for key in CONSOLE_FILTERS if request.args.get(key)}
+    context = {'model': model, 'user': p.toolkit.c.user}
+
+    if request.method == 'POST':
+        _console_bulk_action(context, request.form)
+        return redirect(url_for('embeded_dashboard.console', **filters))
+
+    try:
+        page = toolkit.get_action('dataset_dashboard_list')(context, dict(
+            filters, totals=True, marker=request.args.get('marker'), limit=CONSOLE_PAGE_SIZE,
+        ))
+    except (toolkit.ObjectNotFound, toolkit.ValidationError) as e:
+        h.flash_error(f'Error: {e}', 'error')
+        return redirect(url_for('embeded_dashboard.console'))
+
+    package_ids = [dashboard['package_id'] for dashboard in page['results']]
+    datasets = {
+        package_id: (name, title) for package_id, name, title in db.read(
+            lambda session: session.query(model.Package.id, model.Package.name, model.Package.title)
+            .filter(model.Package.id.in_(package_ids)).all()
+        )
+    } if package_ids else {}
+
+    return toolkit.render('admin/dashboards.html', {
+        'page': page,
+        'datasets': datasets,
+        'filters': filters,
+        'next_url': url_for(
+            'embeded_dashboard.console', marker=page['next_marker'], **filters
+        ) if page['next_marker'] else None,
+    })
+
+
+def _console_bulk_action(context, form):
+    ids = form.getlist('ids')
+    if not ids:
+        h.flash_error('Select at least one dashboard', 'error')
+        return
+    operation = form.get('operation')
+    try:
+        if operation == 'delete':
+            result = toolkit.get_action('dataset_dashboard_bulk_delete')(context, {'ids': ids})
+            h.flash_success(f"{result['deleted']} dashboards deleted", 'success')
+        elif operation == 'retarget':
+            result = toolkit.get_action('dataset_dashboard_bulk_update')(context, {
+                'ids': ids, 'from_host': form.get('from_host'), 'to_host': form.get('to_host'),
+            })
+            h.flash_success(f"{result['updated']} dashboards moved to {form.get('to_host')}", 'success')
+        elif operation == 'set_type':
+            result = toolkit.get_action('dataset_dashboard_bulk_update')(context, {
+                'ids': ids, 'dashboard_type': form.get('dashboard_type'),
+            })
+            h.flash_success(f"{result['updated']} dashboards changed to {form.get('dashboard_type')}", 'success')
+        else:
+            h.flash_error(f'Unknown operation: {operation}', 'error')
+    except toolkit.ValidationError as e:
+        h.flash_error(f'Error: {e.error_summary}', 'error')
+
+
+@dashboard_bp.route('/ckan-admin/dashboard/metrics', endpoint='metrics')
+@require_sysadmin_user
+def dashboard_metrics():
+    """This worker's dashboard metrics in the Prometheus text format"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
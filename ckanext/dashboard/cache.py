@@ -0,0 +1,448 @@
+"""
+In-process caching of dashboard lookups
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from ckan.plugins import toolkit
+
+from sqlalchemy import func, select
+
+from ckanext.dashboard import db
+from ckanext.dashboard.models import DashboardChange, DashboardRevision, DatasetDashboard
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 1000
+DEFAULT_CACHE_TTL = 60
+DEFAULT_INDEX_REFRESH_INTERVAL = 60
+DEFAULT_REVISION_CHECK_INTERVAL = 5
+# Past this many changes since the last check, dropping the caches is cheaper
+MAX_CHANGES_APPLIED = 10000
+
+_MISSING = object()
+
+
+class DashboardRecord(namedtuple('DashboardRecord', [
+    'id', 'package_id', 'dashboard_type', 'embeded_url', 'report_url', 'report_title',
+    'version', 'updated_at', 'embed_host', 'tableau_site', 'tableau_workbook', 'tableau_view',
+    'powerbi_group_id', 'powerbi_report_id', 'definition_id', 'definition_version',
+])):
+    """Immutable snapshot of a dashboard row, with the configuration of its
+    definition if it has one, safe to share between requests"""
+    __slots__ = ()
+
+    @classmethod
+    def from_model(cls, dashboard):
+        return cls.from_dict(dashboard.dictize())
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{field: data[field] for field in cls._fields})
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a per-entry time to live.
+
+    ``None`` is a valid cached value, so lookups for datasets without a
+    dashboard are cached too.
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so that a value loaded before an
+        # invalidation is never stored after it
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=_MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, generation=None):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        value = self.get(key)
+        if value is not _MISSING:
+            return value
+        generation = self._generation
+        value = loader(key)
+        self.set(key, value, generation)
+        return value
+
+    def get_many_or_load(self, keys, loader):
+        """Like get_or_load, for many keys with a single call to
+        ``loader(missing_keys)``, which returns a dict of the found ones"""
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.get(key)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing:
+            generation = self._generation
+            loaded = loader(missing)
+            for key in missing:
+                found[key] = loaded.get(key)
+                self.set(key, found[key], generation)
+        return found
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def resize(self, maxsize, ttl):
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._generation += 1
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class PackageIdIndex:
+    """Set of the ids of all datasets that have a dashboard.
+
+    The set is loaded on the first lookup of the worker and reloaded once it
+    is older than ``refresh_interval`` seconds, which bounds how long a
+    dashboard written by another worker can stay invisible. Writes made by
+    this worker are applied straight away, including those that happen while
+    a reload is running.
+    """
+
+    def __init__(self, loader, refresh_interval=DEFAULT_INDEX_REFRESH_INTERVAL, enabled=True):
+        self.loader = loader
+        self.refresh_interval = refresh_interval
+        self.enabled = enabled
+        self._ids = None
+        self._loaded_at = 0
+        self._changes = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.skipped = 0
+        self.reloads = 0
+
+    def _is_stale(self):
+        return self._ids is None or time.monotonic() - self._loaded_at > self.refresh_interval
+
+    def _refresh(self):
+        with self._load_lock:
+            if not self._is_stale():
+                return
+            with self._lock:
+                self._changes = []
+            try:
+                ids = set(self.loader())
+            except Exception:
+                with self._lock:
+                    self._changes = None
+                raise
+            with self._lock:
+                for package_id, exists in self._changes:
+                    if exists:
+                        ids.add(package_id)
+                    else:
+                        ids.discard(package_id)
+                self._changes = None
+                self._ids = ids
+                self._loaded_at = time.monotonic()
+                self.reloads += 1
+
+    def might_have(self, package_id):
+        """False only if the dataset is known not to have a dashboard"""
+        if not self.enabled:
+            return True
+        if self._is_stale():
+            self._refresh()
+        ids = self._ids
+        if ids is None or package_id in ids:
+            return True
+        self.skipped += 1
+        return False
+
+    def set_exists(self, package_id, exists):
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append((package_id, exists))
+            if self._ids is None:
+                return
+            if exists:
+                self._ids.add(package_id)
+            else:
+                self._ids.discard(package_id)
+
+    def clear(self):
+        with self._lock:
+            self._ids = None
+            self._loaded_at = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'size': len(self._ids) if self._ids is not None else None,
+                'refresh_interval': self.refresh_interval,
+                'skipped': self.skipped,
+                'reloads': self.reloads,
+            }
+
+
+class RevisionWatcher:
+    """Updates the worker caches when another process wrote a dashboard.
+
+    Every write bumps ``DashboardRevision`` in its own transaction. The
+    watcher reads it, with the last seq of the change feed, at most once
+    every ``check_interval`` seconds, so cached lookups are at most that
+    stale. When it moved it calls ``on_change(previous, current)`` with the
+    (revision, seq) seen before, None if unknown or pruned since, and the
+    one just read.
+    """
+
+    def __init__(self, loader, on_change, check_interval=DEFAULT_REVISION_CHECK_INTERVAL):
+        self.loader = loader
+        self.on_change = on_change
+        self.check_interval = check_interval
+        self._revision = None
+        self._seq = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.changes = 0
+
+    def check(self):
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.check_interval:
+                return
+            revision, seq, pruned_seq = self.loader()
+            self.checks += 1
+            self._checked_at = time.monotonic()
+            if revision == self._revision:
+                return
+            previous = None
+            if self._revision is not None:
+                self.changes += 1
+                if self._seq >= pruned_seq:
+                    previous = (self._revision, self._seq)
+            self.on_change(previous, (revision, seq))
+            self._revision = revision
+            self._seq = seq
+
+    def seen(self, revision):
+        """Records a revision produced by this worker.
+
+        When it directly follows the last known one nobody else wrote in
+        between and the (already invalidated) caches can be kept.
+        """
+        with self._lock:
+            if self._revision is not None and revision == self._revision + 1:
+                self._revision = revision
+
+    def reset(self):
+        with self._lock:
+            self._revision = None
+            self._seq = None
+            self._checked_at = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'revision': self._revision,
+                'check_interval': self.check_interval,
+                'checks': self.checks,
+                'changes': self.changes,
+            }
+
+
+def _load_dashboard(package_id):
+    dashboard = db.read(lambda session: session.query(DatasetDashboard).filter_by(package_id=package_id).first())
+    return DashboardRecord.from_model(dashboard) if dashboard else None
+
+
+def _load_dashboards(package_ids):
+    dashboards = db.read(
+        lambda session: session.query(DatasetDashboard).filter(DatasetDashboard.package_id.in_(package_ids)).all()
+    )
+    return {str(dashboard.package_id): DashboardRecord.from_model(dashboard) for dashboard in dashboards}
+
+
+def _load_package_ids():
+    return db.read(
+        lambda session: [str(package_id) for (package_id,) in session.query(DatasetDashboard.package_id)]
+    )
+
+
+def _load_revision():
+    """The revision, the last seq of the change feed and up to where it was
+    pruned, with a single query"""
+    revision = DashboardRevision.__table__
+    last_seq = select(func.coalesce(func.max(DashboardChange.seq), 0)).scalar_subquery()
+    # From the same database as the dashboards, so a revision is never
+    # seen before the data it stands for
+    return tuple(db.read(lambda session: session.execute(
+        select(revision.c.revision, last_seq, revision.c.pruned_seq).where(revision.c.id == 1)
+    ).one()))
+
+
+def _load_changes(since_seq, until_seq):
+    """(package_id, revision, has a dashboard now) of the changes after
+    ``since_seq``, up to MAX_CHANGES_APPLIED + 1 of them"""
+    return db.read(lambda session: session.query(
+        DashboardChange.package_id, DashboardChange.revision, DatasetDashboard.id.isnot(None),
+    ).outerjoin(
+        DatasetDashboard, DatasetDashboard.package_id == DashboardChange.package_id
+    ).filter(
+        DashboardChange.seq > since_seq, DashboardChange.seq <= until_seq
+    ).limit(MAX_CHANGES_APPLIED + 1).all())
+
+
+def _drop_cached():
+    dashboard_cache.clear()
+    dashboard_index.clear()
+
+
+def _apply_changes(previous, current):
+    """Forgets the datasets other processes changed since ``previous``.
+
+    The index of datasets with dashboards is kept and updated in place.
+    Everything is dropped when the changes are not all known: on the first
+    check, after pruning, after too many changes, or after revisions that
+    recorded none, like those of migrations.
+    """
+    if previous is None:
+        _drop_cached()
+        return
+    (revision, seq), (new_revision, new_seq) = previous, current
+    changes = _load_changes(seq, new_seq)
+    revisions = {change_revision for _, change_revision, _ in changes}
+    if len(changes) > MAX_CHANGES_APPLIED or len(revisions) < new_revision - revision:
+        _drop_cached()
+        return
+    for package_id, _, exists in changes:
+        package_id = str(package_id)
+        dashboard_index.set_exists(package_id, exists)
+        dashboard_cache.invalidate(package_id)
+
+
+dashboard_cache = LRUCache()
+dashboard_index = PackageIdIndex(_load_package_ids)
+revision_watcher = RevisionWatcher(_load_revision, _apply_changes)
+
+
+def configure(config):
+    """Sizes the caches from the ``ckanext.dashboard.cache.*`` and
+    ``ckanext.dashboard.index.*`` settings"""
+    maxsize = toolkit.asint(config.get('ckanext.dashboard.cache.size', DEFAULT_CACHE_SIZE))
+    ttl = toolkit.asint(config.get('ckanext.dashboard.cache.ttl', DEFAULT_CACHE_TTL))
+    log.debug(f"Dashboard cache size: {maxsize}, ttl: {ttl}s")
+    dashboard_cache.resize(maxsize, ttl)
+
+    dashboard_index.enabled = toolkit.asbool(config.get('ckanext.dashboard.index.enabled', True))
+    dashboard_index.refresh_interval = toolkit.asint(
+        config.get('ckanext.dashboard.index.refresh_interval', DEFAULT_INDEX_REFRESH_INTERVAL)
+    )
+    dashboard_index.clear()
+
+    revision_watcher.check_interval = toolkit.asint(
+        config.get('ckanext.dashboard.cache.revision_check_interval', DEFAULT_REVISION_CHECK_INTERVAL)
+    )
+    revision_watcher.reset()
+
+
+def get_dashboard(package_id):
+    """Returns the DashboardRecord for a dataset, or None if it has no dashboard"""
+    package_id = str(package_id)
+    if db.bypass_caches():
+        return _load_dashboard(package_id)
+    revision_watcher.check()
+    if not dashboard_index.might_have(package_id):
+        return None
+    return dashboard_cache.get_or_load(package_id, _load_dashboard)
+
+
+def get_dashboards(package_ids):
+    """Returns a dict of package id to DashboardRecord (or None) for many
+    datasets, loading all the ones not cached with a single query"""
+    package_ids = [str(package_id) for package_id in package_ids]
+    found = dict.fromkeys(package_ids)
+    if db.bypass_caches():
+        found.update(_load_dashboards(package_ids))
+        return found
+    revision_watcher.check()
+    candidates = [package_id for package_id in package_ids if dashboard_index.might_have(package_id)]
+    found.update(dashboard_cache.get_many_or_load(candidates, _load_dashboards))
+    return found
+
+
+def invalidate(package_id, exists=None, revision=None):
+    """Drops the cached lookup of a dataset after its dashboard was written.
+
+    Pass ``exists`` when the write created (True) or deleted (False) the
+    dashboard so the index of datasets with dashboards follows it, and the
+    ``revision`` returned by ``changes.lock`` for the write.
+    """
+    package_id = str(package_id)
+    if exists is not None:
+        dashboard_index.set_exists(package_id, exists)
+    dashboard_cache.invalidate(package_id)
+    if revision is not None:
+        revision_watcher.seen(revision)
+
+
+def clear():
+    _drop_cached()
+    revision_watcher.reset()
+
+
+def stats():
+    return dict(
+        dashboard_cache.stats(),
+        index=dashboard_index.stats(),
+        revision=revision_watcher.stats(),
+    )
@@ -0,0 +1,58 @@
+"""
+Bookkeeping shared by every code path that writes dashboards
+"""
+
+from sqlalchemy import event
+
+from ckanext.dashboard import cache, db, fragments, search
+from ckanext.dashboard.models import DashboardChange
+
+
+def lock(session, package_ids=(), deleted=False):
+    """Takes the dashboard write lock, returns the revision of the write.
+
+    Every transaction writing dashboards must call it before its first
+    statement that writes or locks rows of ``dashboard_dashboard``. The
+    revision row is then always the first lock taken, so concurrent writes
+    queue on it instead of deadlocking on each other's rows. It is held
+    until the transaction ends.
+
+    Pass the ``package_ids`` when they are known before the write, to
+    record their changes in the same statement, otherwise pass them to
+    ``record`` once written. Pass ``deleted=True`` when the write deletes
+    the dashboards, so the change feed gets tombstones for them.
+    """
+    return DashboardChange.bump(session, package_ids, deleted)
+
+
+def record(session, package_ids, revision, deleted=False):
+    """Records the changes of a write whose datasets were only known once
+    written, under the ``revision`` returned by ``lock``"""
+    DashboardChange.add(session, package_ids, revision, deleted)
+
+
+def after_commit(package_ids, revision, exists=None, reindex=True):
+    """Propagates a committed write to the caches and the search index.
+
+    ``exists`` is True when the write created or upserted the dashboards,
+    False when it deleted them and None for plain updates. Pass
+    ``reindex=False`` when CKAN already reindexes (or unindexes) the
+    datasets itself.
+    """
+    package_ids = [str(package_id) for package_id in package_ids]
+    db.wrote()
+    for package_id in package_ids:
+        cache.invalidate(package_id, exists=exists, revision=revision)
+        fragments.invalidate(package_id)
+    if reindex:
+        search.reindex(package_ids)
+
+
+def on_commit(session, package_ids, revision, exists=None, reindex=True):
+    """Calls after_commit once ``session`` commits, for writes made inside
+    a transaction that CKAN commits, like the one of package_delete"""
+    event.listen(
+        session, 'after_commit',
+        lambda committed: after_commit(package_ids, revision, exists=exists, reindex=reindex),
+        once=True,
+    )
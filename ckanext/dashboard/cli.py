@@ -0,0 +1,333 @@
+import csv
+import datetime
+import json
+import logging
+import os
+import time
+
+import click
+from sqlalchemy import String, bindparam, cast, delete, func, or_, select, update
+
+from ckan import model
+from ckan.plugins import toolkit
+
+from ckanext.dashboard import changes, urls
+from ckanext.dashboard.models import DashboardChange, DashboardDefinition, DashboardRevision, DatasetDashboard
+
+log = logging.getLogger(__name__)
+
+EXPORT_FIELDS = ['id', 'package_id', 'dashboard_type', 'embeded_url', 'report_url', 'report_title']
+IMPORT_FIELDS = ['package_id', 'dashboard_type', 'embeded_url', 'report_url', 'report_title']
+FORMATS = ['jsonl', 'csv']
+
+
+def get_commands():
+    return [dashboard]
+
+
+@click.group(short_help="Dashboard management commands")
+def dashboard():
+    """Dashboard management commands"""
+    pass
+
+
+def _guess_format(fmt, file):
+    if fmt:
+        return fmt
+    _, ext = os.path.splitext(getattr(file, 'name', ''))
+    return 'csv' if ext.lower() == '.csv' else 'jsonl'
+
+
+@dashboard.command()
+@click.argument('output', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the output file extension, or jsonl')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows fetched per round trip')
+def export(output, fmt, batch_size):
+    """Streams all dashboards to OUTPUT (stdout by default) as JSONL or CSV.
+
+    Rows are read through a server-side cursor, so memory use does not
+    depend on the size of the table. Dashboards using a shared definition
+    are exported with its configuration.
+    """
+    fmt = _guess_format(fmt, output)
+    table = DatasetDashboard.__table__
+    definitions = DashboardDefinition.__table__
+    columns = [
+        func.coalesce(table.c[field], definitions.c[field]).label(field)
+        if field in definitions.c and field != 'id' else table.c[field]
+        for field in EXPORT_FIELDS
+    ]
+    stmt = select(*columns).select_from(
+        table.outerjoin(definitions, definitions.c.id == table.c.definition_id)
+    ).order_by(table.c.id).execution_options(yield_per=batch_size)
+
+    if fmt == 'csv':
+        writer = csv.DictWriter(output, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+
+    count = 0
+    for row in model.Session.execute(stmt):
+        record = dict(row._mapping)
+        record['package_id'] = str(record['package_id'])
+        if fmt == 'csv':
+            writer.writerow(record)
+        else:
+            output.write(json.dumps(record) + '\n')
+        count += 1
+
+    model.Session.rollback()
+    click.secho(f'Exported {count} dashboards', fg='green', err=True)
+
+
+def _read_records(input, fmt):
+    """Yields (line number, record) lazily from a JSONL or CSV file"""
+    if fmt == 'csv':
+        for line, row in enumerate(csv.DictReader(input), start=2):
+            # Empty cells keep the current value, like missing JSON keys
+            yield line, {k: v for k, v in row.items() if k in IMPORT_FIELDS and v != ''}
+        return
+    for line, text in enumerate(input, start=1):
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+        except ValueError as e:
+            yield line, {'__error__': f'Invalid JSON: {e}'}
+            continue
+        if isinstance(record, dict):
+            record = {k: v for k, v in record.items() if k in IMPORT_FIELDS}
+        yield line, record
+
+
+def _chunks(records, size):
+    chunk = []
+    for item in records:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+@dashboard.command('import')
+@click.argument('input', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the input file extension, or jsonl')
+@click.option('--chunk-size', default=500, show_default=True, help='Records written per transaction')
+@click.option('--dry-run', is_flag=True, help='Validate and authorize the records without writing them')
+def import_(input, fmt, chunk_size, dry_run):
+    """Creates or updates dashboards from a JSONL or CSV file.
+
+    The file is read in chunks and each chunk is written with
+    dataset_dashboard_bulk_upsert, so files of any size can be imported.
+    """
+    fmt = _guess_format(fmt, input)
+    site_user = toolkit.get_action('get_site_user')({'ignore_auth': True}, {})
+    upsert = toolkit.get_action('dataset_dashboard_bulk_upsert')
+
+    totals = {'created': 0, 'updated': 0, 'failed': 0}
+    for chunk in _chunks(_read_records(input, fmt), chunk_size):
+        lines = []
+        records = []
+        for line, record in chunk:
+            if isinstance(record, dict) and '__error__' in record:
+                totals['failed'] += 1
+                toolkit.error_shout(f'Line {line}: {record["__error__"]}')
+                continue
+            lines.append(line)
+            records.append(record)
+
+        if not records:
+            continue
+        context = {'user': site_user['name'], 'ignore_auth': True}
+        out = upsert(context, {'records': records, 'dry_run': dry_run})
+        for line, result in zip(lines, out['results']):
+            if not result['success']:
+                toolkit.error_shout(f'Line {line}: {result["package_id"]}: {result["error"]}')
+        for key in totals:
+            totals[key] += out[key]
+
+        click.echo(
+            f'{"Checked" if dry_run else "Imported"} {sum(totals.values())} records '
+            f'(created: {totals["created"]}, updated: {totals["updated"]}, failed: {totals["failed"]})',
+            err=True,
+        )
+
+    click.secho('Dry run, nothing was written' if dry_run else 'Done', fg='green', err=True)
+
+
+@dashboard.command()
+@click.option('--batch-size', default=1000, show_default=True, help='Dashboards deleted per transaction')
+@click.option('--deleted-datasets', is_flag=True, help='Also delete the dashboards of deleted datasets')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to wait between batches')
+@click.option('--dry-run', is_flag=True, help='Only count the dashboards that would be deleted')
+def gc(batch_size, deleted_datasets, pause, dry_run):
+    """Deletes the dashboards of datasets that no longer exist.
+
+    Orphans are found with an anti-join against the package table and
+    deleted in batches, each one a short transaction, so a large cleanup
+    neither locks the table for long nor produces one huge WAL burst.
+    """
+    table = DatasetDashboard.__table__
+    package = model.Package.__table__
+    orphan = package.c.id.is_(None)
+    if deleted_datasets:
+        orphan = or_(orphan, package.c.state == 'deleted')
+    orphan_ids = select(table.c.id).select_from(
+        table.outerjoin(package, package.c.id == cast(table.c.package_id, String))
+    ).where(orphan)
+    orphans = orphan_ids.add_columns(table.c.package_id)
+
+    session = model.Session
+    if dry_run:
+        count = session.execute(select(func.count()).select_from(orphans.subquery())).scalar()
+        click.secho(f'{count} dashboards would be deleted', fg='green')
+        return
+
+    total = 0
+    while True:
+        batch = session.execute(orphans.order_by(table.c.id).limit(batch_size)).all()
+        if not batch:
+            session.rollback()
+            break
+        # The revision lock comes before the row locks of the DELETE
+        revision = changes.lock(session, [row.package_id for row in batch], deleted=True)
+        deleted = session.execute(
+            delete(table).where(
+                table.c.id.in_([row.id for row in batch]),
+                # Still orphans, a dataset may have been restored meanwhile
+                table.c.id.in_(orphan_ids.scalar_subquery()),
+            ).returning(table.c.package_id)
+        ).scalars().all()
+        session.commit()
+        changes.after_commit(deleted, revision, exists=False, reindex=deleted_datasets)
+
+        total += len(deleted)
+        click.echo(f'Deleted {total} dashboards', err=True)
+        if len(batch) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    click.secho(f'Done, {total} dashboards deleted', fg='green')
+
+
+@dashboard.command('prune-changes')
+@click.option('--days', default=30, show_default=True, help='Keep the changes of the last days')
+@click.option('--batch-size', default=10000, show_default=True, help='Changes deleted per transaction')
+def prune_changes(days, batch_size):
+    """Deletes the old entries of the dashboard change feed.
+
+    Consumers of dataset_dashboard_changes_since that are further behind
+    than that have to sync fully again. Changes are deleted oldest first in
+    batches, walking the seq index, and the highest seq deleted is recorded
+    so that the action can tell them.
+    """
+    table = DashboardChange.__table__
+    revision = DashboardRevision.__table__
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+
+    session = model.Session
+    total = 0
+    while True:
+        batch = select(table.c.seq).where(
+            table.c.changed_at < cutoff
+        ).order_by(table.c.seq).limit(batch_size).subquery()
+        last = session.execute(select(func.max(batch.c.seq))).scalar()
+        if last is None:
+            session.rollback()
+            break
+        deleted = session.execute(delete(table).where(table.c.seq <= last)).rowcount
+        session.execute(
+            update(revision).where(revision.c.id == 1)
+            .values(pruned_seq=func.greatest(revision.c.pruned_seq, last))
+        )
+        session.commit()
+        total += deleted
+        if deleted < batch_size:
+            break
+        click.echo(f'Deleted {total} changes', err=True)
+
+    click.secho(f'Done, {total} changes deleted', fg='green')
+
+
+@dashboard.command('backfill-urls')
+@click.option('--batch-size', default=1000, show_default=True, help='Dashboards parsed per transaction')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to wait between batches')
+def backfill_urls(batch_size, pause):
+    """Parses the URLs of the existing dashboards into their identifier
+    columns (host, Tableau site, workbook and view, Power BI workspace and
+    report).
+
+    New and updated dashboards are parsed when they are written, this is
+    only needed once after `ckan db upgrade -p dashboard`. The table is
+    walked in id order in batches and only changed rows are written. Each
+    batch holds the dashboard write lock, so live writes wait for it
+    instead of deadlocking with it. The shared definitions are parsed at
+    the end.
+    """
+    table = DatasetDashboard.__table__
+    columns = [table.c.id, table.c.package_id, table.c.embeded_url, table.c.report_url]
+    columns += [table.c[field] for field in urls.URL_FIELDS]
+    set_values = update(table).where(table.c.id == bindparam('_id')).values(
+        # Bind parameters can't be named like the columns they set
+        {field: bindparam(f'_{field}') for field in urls.URL_FIELDS}
+    )
+
+    session = model.Session
+    marker = 0
+    scanned = updated = 0
+    while True:
+        # Taken before reading, so no write can change the batch meanwhile
+        revision = changes.lock(session)
+        rows = session.execute(
+            select(*columns).where(table.c.id > marker).order_by(table.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            session.rollback()
+            break
+        marker = rows[-1].id
+        scanned += len(rows)
+
+        changed = []
+        for row in rows:
+            values = urls.identifiers(row.embeded_url, row.report_url)
+            if any(getattr(row, field) != value for field, value in values.items()):
+                changed.append((row.package_id, dict(
+                    {f'_{field}': value for field, value in values.items()}, _id=row.id,
+                )))
+        if changed:
+            session.execute(set_values, [values for _, values in changed])
+            package_ids = [package_id for package_id, _ in changed]
+            changes.record(session, package_ids, revision)
+            session.commit()
+            changes.after_commit(package_ids, revision)
+            updated += len(changed)
+        else:
+            session.rollback()
+
+        click.echo(f'Parsed {scanned} dashboards, {updated} updated', err=True)
+        if len(rows) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    # There are few definitions, they are parsed in one go
+    revision = changes.lock(session)
+    definitions = session.query(DashboardDefinition).all()
+    for definition in definitions:
+        definition.parse_urls()
+    changed = [definition.id for definition in definitions if session.is_modified(definition)]
+    if changed:
+        session.flush()
+        package_ids = session.execute(
+            select(table.c.package_id).where(table.c.definition_id.in_(changed))
+        ).scalars().all()
+        changes.record(session, package_ids, revision)
+        session.commit()
+        changes.after_commit(package_ids, revision)
+        click.echo(f'{len(changed)} shared definitions updated', err=True)
+    else:
+        session.rollback()
+
+    click.secho(f'Done, {updated} of {scanned} dashboards updated', fg='green')
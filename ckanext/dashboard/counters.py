@@ -0,0 +1,233 @@
+"""
+Dashboard view counts, counted in memory and written behind in batches
+"""
+
+import atexit
+import datetime
+import logging
+import os
+import threading
+
+from sqlalchemy import String, cast, func
+from sqlalchemy.dialects.postgresql import insert
+
+from ckan import model
+from ckan.plugins import toolkit
+
+from ckanext.dashboard import db
+from ckanext.dashboard.cache import LRUCache
+from ckanext.dashboard.models import DashboardViews, DatasetDashboard
+
+log = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 30
+DEFAULT_FLUSH_EVENTS = 1000
+DEFAULT_POPULAR_CACHE_TTL = 60
+
+
+def _today():
+    return datetime.datetime.utcnow().date()
+
+
+def write_views(rows):
+    """Adds ``rows`` of package_id, day and views to the daily totals with a
+    single multi-row upsert, in its own transaction"""
+    table = DashboardViews.__table__
+    stmt = insert(table).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.package_id, table.c.day],
+        set_={'views': table.c.views + stmt.excluded.views},
+    )
+    # Not through model.Session, a flush must not commit the request's work
+    with model.meta.engine.begin() as connection:
+        connection.execute(stmt)
+
+
+class ViewCounter:
+    """Views per (dataset, day) counted in this worker.
+
+    Counting is a dictionary update, the database is only written by a
+    background thread every ``flush_interval`` seconds, or sooner once
+    ``flush_events`` views are pending. Views that fail to be written are
+    kept for the next flush.
+    """
+
+    def __init__(self, writer=write_views, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 flush_events=DEFAULT_FLUSH_EVENTS):
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.flush_events = flush_events
+        self.enabled = True
+        self.beacon = False
+        self._counts = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        # Only one flush writes at a time, so rows are never counted twice
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.recorded = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.errors = 0
+
+    def record(self, package_id, views=1):
+        if not self.enabled:
+            return
+        self._start()
+        key = (str(package_id), _today())
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + views
+            self._pending += views
+            self.recorded += views
+            due = self._pending >= self.flush_events
+        if due:
+            self._wake.set()
+
+    def _start(self):
+        """Starts the flush thread in this process, after a fork too"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                # Copied from the parent process, which writes them itself
+                self._counts = {}
+                self._pending = 0
+            self._pid = pid
+            threading.Thread(target=self._run, name='dashboard-views', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Writes the pending views, returns the number of rows written"""
+        with self._flush_lock:
+            with self._lock:
+                counts, self._counts = self._counts, {}
+                self._pending = 0
+            if not counts:
+                return 0
+            rows = [
+                {'package_id': package_id, 'day': day, 'views': views}
+                # Sorted, so concurrent flushes of several workers lock the
+                # rows in the same order
+                for (package_id, day), views in sorted(counts.items())
+            ]
+            try:
+                self.writer(rows)
+            except Exception as e:
+                log.warning(f"Could not write {len(rows)} dashboard view counts, will retry: {e}")
+                with self._lock:
+                    self.errors += 1
+                    for key, views in counts.items():
+                        self._counts[key] = self._counts.get(key, 0) + views
+                return 0
+            with self._lock:
+                self.flushes += 1
+                self.flushed += sum(counts.values())
+            return len(rows)
+
+    def clear(self):
+        with self._lock:
+            self._counts = {}
+            self._pending = 0
+            self._reset_counters()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'beacon': self.beacon,
+                'pending': sum(self._counts.values()),
+                'recorded': self.recorded,
+                'flushed': self.flushed,
+                'flushes': self.flushes,
+                'errors': self.errors,
+            }
+
+
+counter = ViewCounter()
+popular_cache = LRUCache(maxsize=100, ttl=DEFAULT_POPULAR_CACHE_TTL)
+
+
+@atexit.register
+def _flush_at_exit():
+    counter.flush()
+
+
+def configure(config):
+    """Sets up the counter from the ``ckanext.dashboard.views.*`` settings"""
+    counter.enabled = toolkit.asbool(config.get('ckanext.dashboard.views.enabled', True))
+    counter.beacon = toolkit.asbool(config.get('ckanext.dashboard.views.beacon', False))
+    counter.flush_interval = toolkit.asint(
+        config.get('ckanext.dashboard.views.flush_interval', DEFAULT_FLUSH_INTERVAL)
+    )
+    counter.flush_events = toolkit.asint(
+        config.get('ckanext.dashboard.views.flush_events', DEFAULT_FLUSH_EVENTS)
+    )
+    popular_cache.resize(100, toolkit.asint(
+        config.get('ckanext.dashboard.views.popular_cache_ttl', DEFAULT_POPULAR_CACHE_TTL)
+    ))
+
+
+def count_render(package_id):
+    """Counts a view of the dashboard of a dataset page, unless the
+    browser reports the views itself"""
+    if not counter.beacon:
+        counter.record(package_id)
+
+
+def beacon_enabled():
+    """Whether views are reported by the browser instead"""
+    return counter.enabled and counter.beacon
+
+
+def _load_popular(key):
+    days, limit = key
+    since = _today() - datetime.timedelta(days=days - 1)
+    views = func.sum(DashboardViews.views).label('views')
+
+    def load(session):
+        return session.query(
+            DashboardViews.package_id, model.Package.name, model.Package.title, views,
+        ).join(
+            model.Package, model.Package.id == cast(DashboardViews.package_id, String)
+        ).join(
+            # Only datasets that still have a dashboard
+            DatasetDashboard, DatasetDashboard.package_id == DashboardViews.package_id
+        ).filter(
+            DashboardViews.day >= since,
+            model.Package.state == 'active',
+            model.Package.private.is_(False),
+        ).group_by(
+            DashboardViews.package_id, model.Package.name, model.Package.title,
+        ).order_by(views.desc(), DashboardViews.package_id).limit(limit).all()
+
+    return [
+        {'package_id': str(package_id), 'name': name, 'title': title, 'views': int(total)}
+        for package_id, name, title, total in db.read(load)
+    ]
+
+
+def popular(days, limit):
+    """The public datasets whose dashboard was viewed the most in the last
+    ``days`` days, read from the daily totals and cached for a while"""
+    return popular_cache.get_or_load((days, limit), _load_popular)
+
+
+def clear():
+    counter.clear()
+    popular_cache.clear()
+
+
+def stats():
+    return counter.stats()
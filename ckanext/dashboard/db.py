@@ -0,0 +1,165 @@
+"""
+Routing of the dashboard read queries to a read replica
+"""
+
+import logging
+import threading
+import time
+
+from flask import has_request_context, request
+from sqlalchemy import create_engine, orm
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+
+from ckan import model
+from ckan.plugins import toolkit
+
+log = logging.getLogger(__name__)
+
+DEFAULT_RETRY_INTERVAL = 30
+DEFAULT_STICKINESS = 10
+
+# Set on the WSGI environ of a request that wrote a dashboard
+WROTE_KEY = 'ckanext.dashboard.wrote'
+# Sent to the browser of the user who wrote a dashboard
+STICKY_COOKIE = 'ckanext-dashboard-primary'
+
+
+class ReadReplica:
+    """Pooled engine of the read replica, with a circuit breaker.
+
+    After a failed query the replica is skipped for ``retry_interval``
+    seconds and everything is read from the primary.
+    """
+
+    def __init__(self):
+        self.engine = None
+        self.session_factory = None
+        self.retry_interval = DEFAULT_RETRY_INTERVAL
+        self.stickiness = DEFAULT_STICKINESS
+        self._down_until = 0
+        self._primary_until = 0
+        self._lock = threading.Lock()
+        self.reads = 0
+        self.fallbacks = 0
+
+    def configure(self, url, retry_interval=DEFAULT_RETRY_INTERVAL, stickiness=DEFAULT_STICKINESS):
+        if self.engine:
+            self.engine.dispose()
+        self.engine = create_engine(url, pool_pre_ping=True) if url else None
+        self.session_factory = (
+            orm.sessionmaker(bind=self.engine, autoflush=False, expire_on_commit=False)
+            if self.engine else None
+        )
+        self.retry_interval = retry_interval
+        self.stickiness = stickiness
+        self._down_until = 0
+        self._primary_until = 0
+
+    def available(self):
+        return bool(self.engine) and time.monotonic() >= self._down_until
+
+    def mark_down(self):
+        with self._lock:
+            self._down_until = time.monotonic() + self.retry_interval
+            self.fallbacks += 1
+
+    def record_read(self):
+        with self._lock:
+            self.reads += 1
+
+    def wrote(self):
+        """Keeps this worker reading from the primary for a while, so data
+        it just wrote is not read back from a lagging replica"""
+        with self._lock:
+            self._primary_until = time.monotonic() + self.stickiness
+
+    def primary_required(self):
+        return time.monotonic() < self._primary_until or self.request_wrote()
+
+    def request_wrote(self):
+        """Whether the current request, or a recent one of the same user,
+        wrote a dashboard"""
+        if has_request_context():
+            return bool(request.environ.get(WROTE_KEY) or request.cookies.get(STICKY_COOKIE))
+        return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'configured': bool(self.engine),
+                'available': self.available(),
+                'reads': self.reads,
+                'fallbacks': self.fallbacks,
+            }
+
+
+replica = ReadReplica()
+
+
+def configure(config):
+    """Sets up the replica engine from ``ckanext.dashboard.read_sqlalchemy_url``"""
+    url = config.get('ckanext.dashboard.read_sqlalchemy_url')
+    replica.configure(
+        url,
+        retry_interval=toolkit.asint(
+            config.get('ckanext.dashboard.read_replica.retry_interval', DEFAULT_RETRY_INTERVAL)
+        ),
+        stickiness=toolkit.asint(
+            config.get('ckanext.dashboard.read_replica.stickiness', DEFAULT_STICKINESS)
+        ),
+    )
+    if url:
+        log.debug("Dashboard reads go to the read replica")
+
+
+def read(func):
+    """Returns ``func(session)``, run on the read replica if there is one.
+
+    Falls back to the primary ``model.Session`` when no replica is
+    configured, it failed recently, or the current user or worker has just
+    written a dashboard. ``func`` may run twice, so it must only read.
+
+    Only connection errors fail over, anything else, like a DataError for
+    a malformed id, is raised as is.
+    """
+    if replica.available() and not replica.primary_required():
+        session = replica.session_factory()
+        try:
+            result = func(session)
+            replica.record_read()
+            return result
+        except DBAPIError as e:
+            if not (isinstance(e, (OperationalError, InterfaceError)) or e.connection_invalidated):
+                raise
+            log.warning(f"Dashboard read replica failed, reading from the primary: {e}")
+            replica.mark_down()
+        finally:
+            session.close()
+    return func(model.Session)
+
+
+def bypass_caches():
+    """Whether the worker caches must be skipped to read the current user's
+    own writes: other workers may have cached what the replica returned
+    before them"""
+    return bool(replica.engine) and replica.request_wrote()
+
+
+def wrote():
+    """Records that a dashboard was written, for read-your-writes"""
+    if not replica.engine:
+        return
+    replica.wrote()
+    if has_request_context():
+        request.environ[WROTE_KEY] = True
+
+
+def set_sticky_cookie(response):
+    """Sends the read-your-writes cookie after a request that wrote"""
+    if replica.engine and request.environ.get(WROTE_KEY):
+        response.set_cookie(STICKY_COOKIE, '1', max_age=replica.stickiness, httponly=True, samesite='Lax')
+    return response
+
+
+def stats():
+    return replica.stats()
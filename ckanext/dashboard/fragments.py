@@ -0,0 +1,202 @@
+"""
+Cache of the rendered dashboard section of the dataset page
+"""
+
+import logging
+import threading
+import time
+
+import redis
+
+from ckan.lib.redis import connect_to_redis
+from ckan.plugins import toolkit
+
+from ckanext.dashboard.cache import LRUCache
+
+log = logging.getLogger(__name__)
+
+DEFAULT_FRAGMENT_BACKEND = 'memory'
+DEFAULT_FRAGMENT_CACHE_SIZE = 1000
+DEFAULT_FRAGMENT_CACHE_TTL = 300
+# Writes made by other workers don't reach this worker's memory backend,
+# the variants of older versions are dropped past this many
+MAX_MEMORY_VARIANTS = 16
+
+
+class MemoryBackend:
+    """Fragments kept in this worker, per dataset and signature"""
+    name = 'memory'
+
+    def __init__(self, maxsize=DEFAULT_FRAGMENT_CACHE_SIZE, ttl=DEFAULT_FRAGMENT_CACHE_TTL):
+        # The variants of a dataset (one per locale...) share an entry, so
+        # a write drops all of them at once
+        self._cache = LRUCache(maxsize, ttl)
+
+    def get(self, package_id, signature):
+        return self._cache.get(package_id, {}).get(signature)
+
+    def set(self, package_id, signature, html):
+        variants = dict(self._cache.get(package_id, {}))
+        variants[signature] = html
+        while len(variants) > MAX_MEMORY_VARIANTS:
+            del variants[next(iter(variants))]
+        self._cache.set(package_id, variants)
+
+    def delete(self, package_id):
+        self._cache.invalidate(package_id)
+
+    def clear(self):
+        self._cache.clear()
+
+
+class RedisBackend:
+    """Fragments shared by all the workers through CKAN's Redis, in a hash
+    per dataset with a field per signature"""
+    name = 'redis'
+    prefix = 'ckanext.dashboard.fragment:'
+
+    def __init__(self, ttl=DEFAULT_FRAGMENT_CACHE_TTL):
+        self.ttl = ttl
+
+    def get(self, package_id, signature):
+        value = connect_to_redis().hget(self.prefix + package_id, signature)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, package_id, signature, html):
+        pipeline = connect_to_redis().pipeline()
+        pipeline.hset(self.prefix + package_id, signature, html)
+        pipeline.expire(self.prefix + package_id, self.ttl)
+        pipeline.execute()
+
+    def delete(self, package_id):
+        connect_to_redis().delete(self.prefix + package_id)
+
+    def clear(self):
+        conn = connect_to_redis()
+        for key in conn.scan_iter(self.prefix + '*'):
+            conn.delete(key)
+
+
+class FragmentCache:
+    """Rendered HTML per dataset and signature.
+
+    The signature covers everything the fragment depends on, so a fragment
+    rendered from stale data is never read again, and the variants of a
+    dataset, like its locales, are cached side by side. Writes drop all the
+    variants of their dataset. Backend errors are logged and the fragment
+    rendered as if not cached.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.render_time = 0.0
+
+    def get_or_render(self, package_id, signature, render):
+        signature = repr(signature)
+        if self.backend:
+            try:
+                html = self.backend.get(package_id, signature)
+            except redis.RedisError as e:
+                log.warning(f"Could not read the cached dashboard fragment: {e}")
+                html = None
+                with self._lock:
+                    self.errors += 1
+            if html is not None:
+                with self._lock:
+                    self.hits += 1
+                return html
+
+        start = time.perf_counter()
+        html = render()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.misses += 1
+            self.render_time += elapsed
+
+        if self.backend:
+            try:
+                self.backend.set(package_id, signature, html)
+            except redis.RedisError as e:
+                log.warning(f"Could not cache the dashboard fragment: {e}")
+                with self._lock:
+                    self.errors += 1
+        return html
+
+    def invalidate(self, package_id):
+        if not self.backend:
+            return
+        try:
+            self.backend.delete(package_id)
+        except redis.RedisError as e:
+            # Stale variants have another signature, so this only wastes space
+            log.warning(f"Could not drop the cached dashboard fragment: {e}")
+            with self._lock:
+                self.errors += 1
+
+    def clear(self):
+        if self.backend:
+            self.backend.clear()
+        with self._lock:
+            self._reset_counters()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': self.backend.name if self.backend else None,
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors,
+                'hit_ratio': self.hits / lookups if lookups else None,
+                'render_time_avg_ms': 1000 * self.render_time / self.misses if self.misses else None,
+            }
+
+
+fragment_cache = FragmentCache(MemoryBackend())
+
+
+def configure(config):
+    """Sets up the backend from the ``ckanext.dashboard.fragment_cache.*``
+    settings"""
+    backend = config.get('ckanext.dashboard.fragment_cache.backend', DEFAULT_FRAGMENT_BACKEND)
+    ttl = toolkit.asint(config.get('ckanext.dashboard.fragment_cache.ttl', DEFAULT_FRAGMENT_CACHE_TTL))
+    if backend == 'memory':
+        maxsize = toolkit.asint(
+            config.get('ckanext.dashboard.fragment_cache.size', DEFAULT_FRAGMENT_CACHE_SIZE)
+        )
+        fragment_cache.backend = MemoryBackend(maxsize, ttl)
+    elif backend == 'redis':
+        fragment_cache.backend = RedisBackend(ttl)
+    elif backend == 'none':
+        fragment_cache.backend = None
+    else:
+        raise ValueError(
+            f"Invalid ckanext.dashboard.fragment_cache.backend: {backend}, "
+            "must be one of memory, redis or none"
+        )
+    log.debug(f"Dashboard fragment cache backend: {backend}, ttl: {ttl}s")
+
+
+def get_or_render(package_id, signature, render):
+    """Returns the cached fragment of a dataset if it was rendered with the
+    same ``signature``, otherwise calls ``render()`` and caches its output"""
+    return fragment_cache.get_or_render(str(package_id), signature, render)
+
+
+def invalidate(package_id):
+    fragment_cache.invalidate(str(package_id))
+
+
+def clear():
+    fragment_cache.clear()
+
+
+def stats():
+    return fragment_cache.stats()
@@ -1,22 +1,65 @@
 import logging
-from ckan import model
+from markupsafe import Markup
 from ckan.plugins import toolkit as t
 
-from ckanext.dashboard.models import DatasetDashboard
+from ckanext.dashboard import cache, counters, fragments, metrics, tokens
 
 log = logging.getLogger(__name__)
 
 
+@metrics.instrument('helper')
 def get_dataset_dashboard(package_id):
-    session = model.Session
-    return session.query(DatasetDashboard).filter_by(package_id=package_id).first()
+    """Gets the dashboard of a dataset from the per-worker cache"""
+    return cache.get_dashboard(package_id)
 
 
+@metrics.instrument('helper')
 def get_dashboard_title_from_config():
     """Gets the dashboard title from the .ini configuration"""
     # If exists and it's empty, we assume users wants not to display the title
     title = t.config.get('ckanext.dashboard.title', '')
-    print(f"Dashboard title from config: {title}")  # Debugging output
     log.debug(f"Dashboard title from config: {title}")
 
     return title
+
+
+@metrics.instrument('helper')
+def render_dataset_dashboard(package_id):
+    """Renders the dashboard section of the dataset page, or returns an
+    empty string if the dataset has no dashboard to show.
+
+    The HTML is cached for what it depends on: the dashboard and
+    definition versions, the locale, the title, the view beacon and
+    whether the dashboard needs an embed token. Every call counts a view
+    of the dashboard, cached or not.
+    """
+    dashboard = cache.get_dashboard(package_id)
+    if not dashboard or not dashboard.embeded_url:
+        return ''
+
+    counters.count_render(dashboard.package_id)
+    title = get_dashboard_title_from_config()
+    html = fragments.get_or_render(
+        dashboard.package_id,
+        (dashboard.id, dashboard.version, dashboard.definition_version, t.h.lang(), title,
+         dashboard_view_beacon(), tokens.requires_token(dashboard)),
+        lambda: t.render_snippet('dashboard/fragment.html', dashboard=dashboard, dashboard_title=title),
+    )
+    return Markup(html)
+
+
+def dashboard_view_beacon():
+    """Whether the browser reports the views of the dashboards, see
+    ckanext.dashboard.views.beacon"""
+    return counters.beacon_enabled()
+
+
+def dashboard_requires_token(dashboard):
+    """Whether the dashboard is secured and the browser has to get an embed
+    token before loading it"""
+    return tokens.requires_token(dashboard)
+
+
+def include_dashboard_in_package_dict():
+    """Whether package_show and package_search results embed the dashboard"""
+    return t.asbool(t.config.get('ckanext.dashboard.include_in_package_dict', False))
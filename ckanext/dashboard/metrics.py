@@ -0,0 +1,200 @@
+"""
+Call counts, latencies, SQL query counts and errors of the dashboard
+actions, template helpers and views
+"""
+
+import functools
+import logging
+import socket
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ckan.plugins import toolkit
+
+log = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DEFAULT_STATSD_PREFIX = 'ckanext.dashboard'
+
+_local = threading.local()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    _local.queries = getattr(_local, 'queries', 0) + 1
+
+
+def _query_count():
+    """SQL statements run by this thread so far"""
+    return getattr(_local, 'queries', 0)
+
+
+class Metric:
+    """Counters and latency histogram of one instrumented function"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.queries = 0
+        self.duration = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def observe(self, duration, queries, error):
+        self.calls += 1
+        self.errors += error
+        self.queries += queries
+        self.duration += duration
+        for position, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                self.buckets[position] += 1
+                break
+
+
+class StatsdSink:
+    """Pushes every observation to a StatsD compatible daemon over UDP"""
+
+    def __init__(self, host, port, prefix=DEFAULT_STATSD_PREFIX):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def send(self, kind, name, duration, queries, error):
+        key = f'{self.prefix}.{kind}.{name}'
+        lines = [
+            f'{key}.calls:1|c',
+            f'{key}.duration:{duration * 1000:.3f}|ms',
+            f'{key}.sql_queries:{queries}|c',
+        ]
+        if error:
+            lines.append(f'{key}.errors:1|c')
+        try:
+            self._socket.sendto('\n'.join(lines).encode('utf-8'), self.address)
+        except OSError as e:
+            # Metrics must never break a request
+            log.debug(f"Could not send metrics to StatsD: {e}")
+
+
+class Registry:
+    """Metrics of this worker, keyed by (kind, name)"""
+
+    def __init__(self):
+        self.enabled = True
+        self.sink = None
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def observe(self, kind, name, duration, queries, error):
+        with self._lock:
+            metric = self._metrics.get((kind, name))
+            if metric is None:
+                metric = self._metrics[(kind, name)] = Metric()
+            metric.observe(duration, queries, error)
+        if self.sink:
+            self.sink.send(kind, name, duration, queries, error)
+
+    def snapshot(self):
+        """Copy of the metrics as a dict of (kind, name) to plain dicts"""
+        with self._lock:
+            return {
+                key: {
+                    'calls': metric.calls,
+                    'errors': metric.errors,
+                    'sql_queries': metric.queries,
+                    'duration': metric.duration,
+                    'buckets': list(metric.buckets),
+                }
+                for key, metric in self._metrics.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+
+
+registry = Registry()
+
+
+def instrument(kind, name=None):
+    """Decorator recording the calls of a function as ``kind``/``name``
+    (the function name by default).
+
+    The SQL query count of a call includes the queries of the instrumented
+    functions it calls in turn. Any exception counts as an error.
+    """
+    def decorator(func):
+        metric_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return func(*args, **kwargs)
+            queries = _query_count()
+            start = time.perf_counter()
+            error = False
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                registry.observe(
+                    kind, metric_name, time.perf_counter() - start, _query_count() - queries, error
+                )
+        return wrapper
+    return decorator
+
+
+def _labels(kind, name, **extra):
+    labels = dict(kind=kind, name=name, **extra)
+    return ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def render_prometheus():
+    """This worker's metrics in the Prometheus text exposition format"""
+    metrics = sorted(registry.snapshot().items())
+    lines = []
+
+    counters = (
+        ('calls', 'ckanext_dashboard_calls_total', 'Calls of dashboard actions, helpers and views'),
+        ('errors', 'ckanext_dashboard_errors_total', 'Calls that raised an exception'),
+        ('sql_queries', 'ckanext_dashboard_sql_queries_total', 'SQL statements run during the calls'),
+    )
+    for field, metric_name, help_text in counters:
+        lines.append(f'# HELP {metric_name} {help_text}')
+        lines.append(f'# TYPE {metric_name} counter')
+        for (kind, name), values in metrics:
+            lines.append(f'{metric_name}{{{_labels(kind, name)}}} {values[field]}')
+
+    metric_name = 'ckanext_dashboard_duration_seconds'
+    lines.append(f'# HELP {metric_name} Duration of the calls')
+    lines.append(f'# TYPE {metric_name} histogram')
+    for (kind, name), values in metrics:
+        cumulative = 0
+        for bound, count in zip(BUCKETS, values['buckets']):
+            cumulative += count
+            lines.append(f'{metric_name}_bucket{{{_labels(kind, name, le=bound)}}} {cumulative}')
+        lines.append(f'{metric_name}_bucket{{{_labels(kind, name, le="+Inf")}}} {values["calls"]}')
+        lines.append(f'{metric_name}_sum{{{_labels(kind, name)}}} {values["duration"]}')
+        lines.append(f'{metric_name}_count{{{_labels(kind, name)}}} {values["calls"]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def configure(config):
+    """Sets up the registry from the ``ckanext.dashboard.metrics.*`` settings"""
+    registry.enabled = toolkit.asbool(config.get('ckanext.dashboard.metrics.enabled', True))
+
+    statsd = config.get('ckanext.dashboard.metrics.statsd')
+    if statsd:
+        host, _, port = statsd.rpartition(':')
+        prefix = config.get('ckanext.dashboard.metrics.statsd_prefix', DEFAULT_STATSD_PREFIX)
+        registry.sink = StatsdSink(host or 'localhost', int(port), prefix)
+        log.debug(f"Sending dashboard metrics to StatsD at {statsd}")
+    else:
+        registry.sink = None
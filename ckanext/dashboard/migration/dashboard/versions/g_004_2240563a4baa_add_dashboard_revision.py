@@ -0,0 +1,30 @@
+"""Add dashboard_revision table
+
+Revision ID: 2240563a4baa
+Revises: f156e94e8f69
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2240563a4baa'
+down_revision = 'f156e94e8f69'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    revision_table = op.create_table(
+        'dashboard_revision',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('revision', sa.BigInteger, nullable=False, server_default='0'),
+    )
+    # Single row bumped by every dashboard write
+    op.bulk_insert(revision_table, [{'id': 1, 'revision': 0}])
+
+
+def downgrade():
+    op.drop_table('dashboard_revision')
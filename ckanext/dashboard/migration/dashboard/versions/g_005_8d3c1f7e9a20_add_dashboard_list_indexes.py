@@ -0,0 +1,32 @@
+"""Add indexes for listing dashboards
+
+Revision ID: 8d3c1f7e9a20
+Revises: 2240563a4baa
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8d3c1f7e9a20'
+down_revision = '2240563a4baa'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keyset pages filtered by type are a single range scan
+    op.create_index(
+        'idx_dashboard_dashboard_type_id', 'dashboard_dashboard', ['dashboard_type', 'id']
+    )
+    # Prefix matches on the embed URL (filter by embed host)
+    op.create_index(
+        'idx_dashboard_dashboard_embeded_url', 'dashboard_dashboard', ['embeded_url'],
+        postgresql_ops={'embeded_url': 'varchar_pattern_ops'},
+    )
+
+
+def downgrade():
+    op.drop_index('idx_dashboard_dashboard_embeded_url', table_name='dashboard_dashboard')
+    op.drop_index('idx_dashboard_dashboard_type_id', table_name='dashboard_dashboard')
@@ -0,0 +1,36 @@
+"""Add updated_at and version to dashboard_dashboard
+
+Revision ID: 5b7e2a9c4d13
+Revises: 8d3c1f7e9a20
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7e2a9c4d13'
+down_revision = '8d3c1f7e9a20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The server defaults fill in the existing rows
+    op.add_column(
+        'dashboard_dashboard',
+        sa.Column(
+            'updated_at', sa.DateTime, nullable=False,
+            server_default=sa.text("timezone('utc', now())"),
+        ),
+    )
+    op.add_column(
+        'dashboard_dashboard',
+        sa.Column('version', sa.Integer, nullable=False, server_default='1'),
+    )
+
+
+def downgrade():
+    op.drop_column('dashboard_dashboard', 'version')
+    op.drop_column('dashboard_dashboard', 'updated_at')
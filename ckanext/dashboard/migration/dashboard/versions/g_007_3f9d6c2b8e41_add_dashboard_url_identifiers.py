@@ -0,0 +1,65 @@
+"""Add the identifiers parsed from the dashboard URLs
+
+Revision ID: 3f9d6c2b8e41
+Revises: 5b7e2a9c4d13
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9d6c2b8e41'
+down_revision = '5b7e2a9c4d13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('dashboard_dashboard', sa.Column('embed_host', sa.String(255)))
+    op.add_column('dashboard_dashboard', sa.Column('tableau_site', sa.String(255)))
+    op.add_column('dashboard_dashboard', sa.Column('tableau_workbook', sa.String(255)))
+    op.add_column('dashboard_dashboard', sa.Column('tableau_view', sa.String(255)))
+    op.add_column('dashboard_dashboard', sa.Column('powerbi_group_id', sa.String(64)))
+    op.add_column('dashboard_dashboard', sa.Column('powerbi_report_id', sa.String(64)))
+
+    # The host is enough for the embed_host filter to keep working. The
+    # other identifiers are filled by `ckan dashboard backfill-urls`.
+    op.execute(
+        "UPDATE dashboard_dashboard "
+        "SET embed_host = lower(substring(embeded_url from '^https?://([^/:?#]+)'))"
+    )
+
+    op.create_index(
+        'idx_dashboard_dashboard_embed_host_id', 'dashboard_dashboard', ['embed_host', 'id']
+    )
+    op.create_index(
+        'idx_dashboard_dashboard_tableau_site_id', 'dashboard_dashboard', ['tableau_site', 'id']
+    )
+    op.create_index(
+        'idx_dashboard_dashboard_tableau_workbook', 'dashboard_dashboard', ['tableau_workbook', 'tableau_view']
+    )
+    op.create_index(
+        'idx_dashboard_dashboard_powerbi_group_id', 'dashboard_dashboard', ['powerbi_group_id', 'id']
+    )
+    op.create_index(
+        'idx_dashboard_dashboard_powerbi_report_id', 'dashboard_dashboard', ['powerbi_report_id']
+    )
+    # Replaced by the embed_host index
+    op.drop_index('idx_dashboard_dashboard_embeded_url', table_name='dashboard_dashboard')
+
+
+def downgrade():
+    op.create_index(
+        'idx_dashboard_dashboard_embeded_url', 'dashboard_dashboard', ['embeded_url'],
+        postgresql_ops={'embeded_url': 'varchar_pattern_ops'},
+    )
+    op.drop_index('idx_dashboard_dashboard_powerbi_report_id', table_name='dashboard_dashboard')
+    op.drop_index('idx_dashboard_dashboard_powerbi_group_id', table_name='dashboard_dashboard')
+    op.drop_index('idx_dashboard_dashboard_tableau_workbook', table_name='dashboard_dashboard')
+    op.drop_index('idx_dashboard_dashboard_tableau_site_id', table_name='dashboard_dashboard')
+    op.drop_index('idx_dashboard_dashboard_embed_host_id', table_name='dashboard_dashboard')
+    for column in ('powerbi_report_id', 'powerbi_group_id', 'tableau_view', 'tableau_workbook',
+                   'tableau_site', 'embed_host'):
+        op.drop_column('dashboard_dashboard', column)
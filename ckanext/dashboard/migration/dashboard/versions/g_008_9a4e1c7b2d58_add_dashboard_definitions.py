@@ -0,0 +1,78 @@
+"""Add dashboard definitions shared by many datasets
+
+Revision ID: 9a4e1c7b2d58
+Revises: 3f9d6c2b8e41
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4e1c7b2d58'
+down_revision = '3f9d6c2b8e41'
+branch_labels = None
+depends_on = None
+
+# Configuration moved from the dashboards to their definition
+CONFIG_COLUMNS = [
+    'dashboard_type', 'embeded_url', 'report_url', 'report_title', 'embed_host',
+    'tableau_site', 'tableau_workbook', 'tableau_view', 'powerbi_group_id', 'powerbi_report_id',
+]
+# What makes two dashboards the same
+KEY_COLUMNS = ['dashboard_type', 'embeded_url', 'report_url', 'report_title']
+
+
+def upgrade():
+    op.create_table(
+        'dashboard_definition',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('dashboard_type', sa.String(20)),
+        sa.Column('embeded_url', sa.String(2000)),
+        sa.Column('report_url', sa.String(2000)),
+        sa.Column('report_title', sa.String(200), nullable=True),
+        sa.Column('updated_at', sa.DateTime, nullable=False, server_default=sa.func.now()),
+        sa.Column('version', sa.Integer, nullable=False, server_default='1'),
+        sa.Column('embed_host', sa.String(255)),
+        sa.Column('tableau_site', sa.String(255)),
+        sa.Column('tableau_workbook', sa.String(255)),
+        sa.Column('tableau_view', sa.String(255)),
+        sa.Column('powerbi_group_id', sa.String(64)),
+        sa.Column('powerbi_report_id', sa.String(64)),
+    )
+    op.add_column(
+        'dashboard_dashboard',
+        sa.Column('definition_id', sa.Integer, sa.ForeignKey('dashboard_definition.id'), nullable=True),
+    )
+    op.create_index('idx_dashboard_dashboard_definition_id', 'dashboard_dashboard', ['definition_id'])
+
+    # Dashboards with the same configuration share a definition
+    op.execute(
+        f"INSERT INTO dashboard_definition (updated_at, {', '.join(CONFIG_COLUMNS)}) "
+        f"SELECT max(updated_at), {', '.join(KEY_COLUMNS)}, "
+        f"{', '.join(f'max({column})' for column in CONFIG_COLUMNS[len(KEY_COLUMNS):])} "
+        f"FROM dashboard_dashboard WHERE embeded_url <> '' "
+        f"GROUP BY {', '.join(KEY_COLUMNS)} HAVING count(*) > 1"
+    )
+    op.execute(
+        f"UPDATE dashboard_dashboard SET definition_id = d.id, "
+        f"{', '.join(f'{column} = NULL' for column in CONFIG_COLUMNS)} "
+        # Matching on the URL first allows a hash join
+        f"FROM dashboard_definition d WHERE dashboard_dashboard.embeded_url = d.embeded_url AND "
+        f"{' AND '.join(f'dashboard_dashboard.{column} IS NOT DISTINCT FROM d.{column}' for column in KEY_COLUMNS)}"
+    )
+    # Running workers drop their cached dashboards
+    op.execute("UPDATE dashboard_revision SET revision = revision + 1")
+
+
+def downgrade():
+    op.execute(
+        f"UPDATE dashboard_dashboard SET definition_id = NULL, "
+        f"{', '.join(f'{column} = d.{column}' for column in CONFIG_COLUMNS)} "
+        f"FROM dashboard_definition d WHERE d.id = dashboard_dashboard.definition_id"
+    )
+    op.drop_index('idx_dashboard_dashboard_definition_id', table_name='dashboard_dashboard')
+    op.drop_column('dashboard_dashboard', 'definition_id')
+    op.drop_table('dashboard_definition')
+    op.execute("UPDATE dashboard_revision SET revision = revision + 1")
@@ -0,0 +1,32 @@
+"""Add the daily dashboard view counts
+
+Revision ID: c61f0b8d3e27
+Revises: 9a4e1c7b2d58
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c61f0b8d3e27'
+down_revision = '9a4e1c7b2d58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'dashboard_views_daily',
+        sa.Column('package_id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('day', sa.Date, primary_key=True),
+        sa.Column('views', sa.BigInteger, nullable=False, server_default='0'),
+    )
+    op.create_index('idx_dashboard_views_daily_day', 'dashboard_views_daily', ['day'])
+
+
+def downgrade():
+    op.drop_index('idx_dashboard_views_daily_day', table_name='dashboard_views_daily')
+    op.drop_table('dashboard_views_daily')
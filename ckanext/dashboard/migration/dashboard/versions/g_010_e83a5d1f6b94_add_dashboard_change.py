@@ -0,0 +1,32 @@
+"""Add the dashboard change feed
+
+Revision ID: e83a5d1f6b94
+Revises: c61f0b8d3e27
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e83a5d1f6b94'
+down_revision = 'c61f0b8d3e27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'dashboard_change',
+        sa.Column('seq', sa.BigInteger, primary_key=True, autoincrement=True),
+        sa.Column('package_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('revision', sa.BigInteger, nullable=False),
+        sa.Column('deleted', sa.Boolean, nullable=False, server_default=sa.false()),
+        sa.Column('changed_at', sa.DateTime, nullable=False, server_default=sa.text("timezone('utc', now())")),
+    )
+
+
+def downgrade():
+    op.drop_table('dashboard_change')
@@ -0,0 +1,27 @@
+"""Record up to which seq the dashboard change feed was pruned
+
+Revision ID: 4b2d9f7a1c63
+Revises: e83a5d1f6b94
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b2d9f7a1c63'
+down_revision = 'e83a5d1f6b94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'dashboard_revision',
+        sa.Column('pruned_seq', sa.BigInteger, nullable=False, server_default='0'),
+    )
+
+
+def downgrade():
+    op.drop_column('dashboard_revision', 'pruned_seq')
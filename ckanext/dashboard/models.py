@@ -1,13 +1,68 @@
-from sqlalchemy import Column, Integer, String
+import datetime
+
+from sqlalchemy import (
+    BigInteger, Boolean, Column, Date, DateTime, ForeignKey, Index, Integer, String, bindparam, event, text,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import relationship
 
 from ckan import model
 from ckan.model.types import UuidType
 from ckan.plugins import toolkit
 
+from ckanext.dashboard import urls
+
+
+# Columns holding the configuration of a dashboard, shared through a
+# DashboardDefinition when the dashboard references one
+CONFIG_FIELDS = ('dashboard_type', 'embeded_url', 'report_url', 'report_title', *urls.URL_FIELDS)
+
+
+class DashboardDefinition(toolkit.BaseModel):
+    """Dashboard configuration shared by many datasets, e.g. the same
+    Tableau view embedded on all the datasets of a series"""
+    __tablename__ = "dashboard_definition"
+
+    id = Column(Integer, primary_key=True)
+    dashboard_type = Column(String(20))
+    embeded_url = Column(String(2000))
+    report_url = Column(String(2000))
+    report_title = Column(String(200), nullable=True)
+    updated_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow,
+                        onupdate=datetime.datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1)
+    embed_host = Column(String(urls.URL_FIELDS['embed_host']))
+    tableau_site = Column(String(urls.URL_FIELDS['tableau_site']))
+    tableau_workbook = Column(String(urls.URL_FIELDS['tableau_workbook']))
+    tableau_view = Column(String(urls.URL_FIELDS['tableau_view']))
+    powerbi_group_id = Column(String(urls.URL_FIELDS['powerbi_group_id']))
+    powerbi_report_id = Column(String(urls.URL_FIELDS['powerbi_report_id']))
+
+    def dictize(self):
+        return {
+            'id': self.id,
+            **{field: getattr(self, field) for field in CONFIG_FIELDS},
+            'version': self.version,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+    def parse_urls(self):
+        for field, value in urls.identifiers(self.embeded_url, self.report_url).items():
+            setattr(self, field, value)
+
 
 class DatasetDashboard(toolkit.BaseModel):
     """Data model for storing the configuration of a dashboard per dataset"""
     __tablename__ = "dashboard_dashboard"
+    __table_args__ = (
+        Index('idx_dashboard_dashboard_type_id', 'dashboard_type', 'id'),
+        Index('idx_dashboard_dashboard_embed_host_id', 'embed_host', 'id'),
+        Index('idx_dashboard_dashboard_tableau_site_id', 'tableau_site', 'id'),
+        Index('idx_dashboard_dashboard_tableau_workbook', 'tableau_workbook', 'tableau_view'),
+        Index('idx_dashboard_dashboard_powerbi_group_id', 'powerbi_group_id', 'id'),
+        Index('idx_dashboard_dashboard_powerbi_report_id', 'powerbi_report_id'),
+        Index('idx_dashboard_dashboard_definition_id', 'definition_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     package_id = Column(UuidType, nullable=False, unique=True)
@@ -15,19 +70,143 @@ class DatasetDashboard(toolkit.BaseModel):
     embeded_url = Column(String(2000))
     report_url = Column(String(2000))
     report_title = Column(String(200), nullable=True)
+    # Set by every write, used for ETags and optimistic concurrency checks
+    updated_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow,
+                        onupdate=datetime.datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1)
+    # Parsed from the URLs on every write, see urls.identifiers
+    embed_host = Column(String(urls.URL_FIELDS['embed_host']))
+    tableau_site = Column(String(urls.URL_FIELDS['tableau_site']))
+    tableau_workbook = Column(String(urls.URL_FIELDS['tableau_workbook']))
+    tableau_view = Column(String(urls.URL_FIELDS['tableau_view']))
+    powerbi_group_id = Column(String(urls.URL_FIELDS['powerbi_group_id']))
+    powerbi_report_id = Column(String(urls.URL_FIELDS['powerbi_report_id']))
+    # When set the CONFIG_FIELDS of the row are empty and come from the
+    # definition, loaded in the same query as the dashboard
+    definition_id = Column(Integer, ForeignKey('dashboard_definition.id'), nullable=True)
+    definition = relationship(DashboardDefinition, lazy='joined')
 
     def dictize(self):
+        """The effective configuration of the dashboard, its own or the one
+        of its definition"""
+        source = self.definition or self
+        updated_at = self.updated_at
+        if self.definition and self.definition.updated_at and (
+                not updated_at or self.definition.updated_at > updated_at):
+            updated_at = self.definition.updated_at
         return {
             'id': self.id,
             'package_id': str(self.package_id),
-            'dashboard_type': self.dashboard_type,
-            'embeded_url': self.embeded_url,
-            'report_url': self.report_url,
-            'report_title': self.report_title,
+            **{field: getattr(source, field) for field in CONFIG_FIELDS},
+            'version': self.version,
+            'updated_at': updated_at.isoformat() if updated_at else None,
+            'definition_id': self.definition_id,
+            'definition_version': self.definition.version if self.definition else None,
         }
 
+    def parse_urls(self):
+        for field, value in urls.identifiers(self.embeded_url, self.report_url).items():
+            setattr(self, field, value)
+
     def save(self):
         model.Session.add(self)
         model.Session.commit()
         model.Session.refresh(self)
         return self
+
+
+@event.listens_for(DatasetDashboard, 'before_insert')
+@event.listens_for(DatasetDashboard, 'before_update')
+@event.listens_for(DashboardDefinition, 'before_insert')
+@event.listens_for(DashboardDefinition, 'before_update')
+def parse_dashboard_urls(mapper, connection, dashboard):
+    dashboard.parse_urls()
+
+
+class DashboardRevision(toolkit.BaseModel):
+    """Single-row counter bumped by every dashboard write.
+
+    Workers compare it with the value they last saw to find out whether
+    another process changed any dashboard since. Bumped by
+    DashboardChange.bump, the row stays locked until the transaction ends,
+    so concurrent dashboard writes commit in revision order.
+    """
+    __tablename__ = "dashboard_revision"
+
+    id = Column(Integer, primary_key=True)
+    revision = Column(BigInteger, nullable=False, default=0)
+    # Highest DashboardChange.seq deleted by ckan dashboard prune-changes
+    pruned_seq = Column(BigInteger, nullable=False, default=0)
+
+    @classmethod
+    def current(cls, session):
+        return session.query(cls.revision).filter_by(id=1).scalar()
+
+    @classmethod
+    def pruned(cls, session):
+        return session.query(cls.pruned_seq).filter_by(id=1).scalar() or 0
+
+
+# Bumping the revision first takes its row lock before the seqs are drawn
+_RECORD_CHANGES = text(
+    "WITH bump AS ("
+    "  UPDATE dashboard_revision SET revision = revision + 1 WHERE id = 1 RETURNING revision"
+    "), changed AS ("
+    "  INSERT INTO dashboard_change (package_id, revision, deleted)"
+    "  SELECT CAST(package_id AS uuid), bump.revision, :deleted"
+    "  FROM bump, unnest(CAST(:package_ids AS text[])) AS package_id"
+    ") SELECT revision FROM bump"
+).bindparams(bindparam('package_ids', type_=ARRAY(String)))
+_ADD_CHANGES = text(
+    "INSERT INTO dashboard_change (package_id, revision, deleted)"
+    " SELECT CAST(package_id AS uuid), :revision, :deleted"
+    " FROM unnest(CAST(:package_ids AS text[])) AS package_id"
+).bindparams(bindparam('package_ids', type_=ARRAY(String)))
+
+
+class DashboardChange(toolkit.BaseModel):
+    """Feed of the dashboard writes, one row per dataset and write.
+
+    Rows are only added while holding the revision row lock, so ``seq``
+    grows in commit order and a reader that has seen a seq never misses a
+    smaller one committed later.
+    """
+    __tablename__ = "dashboard_change"
+
+    seq = Column(BigInteger, primary_key=True, autoincrement=True)
+    package_id = Column(UuidType, nullable=False)
+    revision = Column(BigInteger, nullable=False)
+    # Tombstone: the write deleted the dashboard of the dataset
+    deleted = Column(Boolean, nullable=False, default=False)
+    # Set by the database, the rows are inserted by SQL; UTC like updated_at
+    changed_at = Column(DateTime, nullable=False, server_default=text("timezone('utc', now())"))
+
+    @classmethod
+    def bump(cls, session, package_ids=(), deleted=False):
+        """Bumps the revision and records a change for each dataset with a
+        single statement, returns the new revision"""
+        return session.execute(_RECORD_CHANGES, {
+            'package_ids': [str(package_id) for package_id in package_ids], 'deleted': deleted,
+        }).scalar()
+
+    @classmethod
+    def add(cls, session, package_ids, revision, deleted=False):
+        """Records a change for each dataset under a revision already bumped
+        in the session's transaction"""
+        session.execute(_ADD_CHANGES, {
+            'package_ids': [str(package_id) for package_id in package_ids], 'revision': revision,
+            'deleted': deleted,
+        })
+
+
+class DashboardViews(toolkit.BaseModel):
+    """Views of the dashboard of a dataset per day (UTC), written in batches
+    by counters.ViewCounter"""
+    __tablename__ = "dashboard_views_daily"
+    __table_args__ = (
+        Index('idx_dashboard_views_daily_day', 'day'),
+    )
+
+    package_id = Column(UuidType, primary_key=True)
+    day = Column(Date, primary_key=True)
+    views = Column(BigInteger, nullable=False, default=0)
@@ -1,15 +1,30 @@
 import logging
 
+from ckan import model
 from ckan import plugins as p
 from ckan.lib.plugins import DefaultTranslation
 from ckan.plugins import toolkit
 from ckanext.dashboard.blueprints.dashboard import dashboard_bp
 from ckanext.dashboard.actions.dashboard_dataset import (
     dataset_dashboard_create, dataset_dashboard_update, dataset_dashboard_delete,
-    dataset_dashboard_show
+    dataset_dashboard_show, dataset_dashboard_show_many, dataset_dashboard_list,
+    dataset_dashboard_bulk_upsert, dataset_dashboard_bulk_update, dataset_dashboard_bulk_delete,
+    dataset_dashboard_definition_create, dataset_dashboard_definition_show,
+    dataset_dashboard_definition_update, dataset_dashboard_definition_delete,
+    dataset_dashboard_popular, dataset_dashboard_changes_since, dataset_dashboard_cache_stats, show_dict,
+    dataset_purge, delete_package_dashboards,
 )
 from ckanext.dashboard.auth import dashboard_dataset as auth
 from ckanext.dashboard import helpers as h
+from ckanext.dashboard import cache
+from ckanext.dashboard import changes
+from ckanext.dashboard import cli
+from ckanext.dashboard import counters
+from ckanext.dashboard import db
+from ckanext.dashboard import fragments
+from ckanext.dashboard import metrics
+from ckanext.dashboard import search
+from ckanext.dashboard import tokens
 
 
 log = logging.getLogger(__name__)
@@ -18,11 +33,15 @@ log = logging.getLogger(__name__)
 class DashboardPlugin(p.SingletonPlugin, DefaultTranslation):
     """Plugin for managing dashboards in CKAN"""
     p.implements(p.IConfigurer)
+    p.implements(p.IConfigurable)
     p.implements(p.IBlueprint)
     p.implements(p.IActions)
     p.implements(p.ITemplateHelpers)
     p.implements(p.IAuthFunctions)
     p.implements(p.ITranslation)
+    p.implements(p.IClick)
+    p.implements(p.IPackageController, inherit=True)
+    p.implements(p.IFacets, inherit=True)
 
     # IConfigurer
 
@@ -30,6 +49,7 @@ class DashboardPlugin(p.SingletonPlugin, DefaultTranslation):
         toolkit.add_template_directory(config_, "templates")
         toolkit.add_public_directory(config_, "public")
         toolkit.add_resource("assets", "dashboard")
+        toolkit.add_ckan_admin_tab(config_, "embeded_dashboard.console", "Dashboards", icon="chart-bar")
 
         title_config = config_.get("ckanext.dashboard_title", config_.get("ckanext.dashboard.title", ""))
         log.debug(f"Setting default dashboard title: {title_config}")
@@ -39,6 +59,16 @@ class DashboardPlugin(p.SingletonPlugin, DefaultTranslation):
             title_config
         )
 
+    # IConfigurable
+
+    def configure(self, config_):
+        db.configure(config_)
+        cache.configure(config_)
+        fragments.configure(config_)
+        metrics.configure(config_)
+        tokens.configure(config_)
+        counters.configure(config_)
+
     def get_blueprint(self):
         return dashboard_bp
 
@@ -50,6 +80,18 @@ class DashboardPlugin(p.SingletonPlugin, DefaultTranslation):
             "dataset_dashboard_create": auth.dashboard_dataset_create,
             "dataset_dashboard_update": auth.dashboard_dataset_update,
             "dataset_dashboard_delete": auth.dashboard_dataset_delete,
+            "dataset_dashboard_show_many": auth.dashboard_dataset_show_many,
+            "dataset_dashboard_bulk_upsert": auth.dashboard_dataset_bulk_upsert,
+            "dataset_dashboard_list": auth.dashboard_dataset_list,
+            "dataset_dashboard_bulk_update": auth.dashboard_dataset_bulk_update,
+            "dataset_dashboard_bulk_delete": auth.dashboard_dataset_bulk_delete,
+            "dataset_dashboard_definition_create": auth.dashboard_definition_create,
+            "dataset_dashboard_definition_show": auth.dashboard_definition_show,
+            "dataset_dashboard_definition_update": auth.dashboard_definition_update,
+            "dataset_dashboard_definition_delete": auth.dashboard_definition_delete,
+            "dataset_dashboard_popular": auth.dashboard_dataset_popular,
+            "dataset_dashboard_changes_since": auth.dashboard_dataset_changes_since,
+            "dataset_dashboard_cache_stats": auth.dashboard_cache_stats,
         }
         return functions
 
@@ -58,15 +100,81 @@ class DashboardPlugin(p.SingletonPlugin, DefaultTranslation):
             'dataset_dashboard_show': dataset_dashboard_show,
             'dataset_dashboard_create': dataset_dashboard_create,
             'dataset_dashboard_update': dataset_dashboard_update,
-            'dataset_dashboard_delete': dataset_dashboard_delete
+            'dataset_dashboard_delete': dataset_dashboard_delete,
+            'dataset_dashboard_show_many': dataset_dashboard_show_many,
+            'dataset_dashboard_bulk_upsert': dataset_dashboard_bulk_upsert,
+            'dataset_dashboard_list': dataset_dashboard_list,
+            'dataset_dashboard_bulk_update': dataset_dashboard_bulk_update,
+            'dataset_dashboard_bulk_delete': dataset_dashboard_bulk_delete,
+            'dataset_dashboard_definition_create': dataset_dashboard_definition_create,
+            'dataset_dashboard_definition_show': dataset_dashboard_definition_show,
+            'dataset_dashboard_definition_update': dataset_dashboard_definition_update,
+            'dataset_dashboard_definition_delete': dataset_dashboard_definition_delete,
+            'dataset_dashboard_popular': dataset_dashboard_popular,
+            'dataset_dashboard_changes_since': dataset_dashboard_changes_since,
+            'dataset_dashboard_cache_stats': dataset_dashboard_cache_stats,
+            'dataset_purge': dataset_purge,
         }
 
     def get_helpers(self):
         return {
             'get_dataset_dashboard': h.get_dataset_dashboard,
-            'get_dashboard_title_from_config': h.get_dashboard_title_from_config
+            'get_dashboard_title_from_config': h.get_dashboard_title_from_config,
+            'render_dataset_dashboard': h.render_dataset_dashboard,
+            'dashboard_requires_token': h.dashboard_requires_token,
+            'dashboard_view_beacon': h.dashboard_view_beacon,
         }
 
+    # IClick
+
+    def get_commands(self):
+        return cli.get_commands()
+
+    # IPackageController
+
+    def before_dataset_index(self, pkg_dict):
+        # Added by after_dataset_show, only plain fields can be indexed
+        pkg_dict.pop('dashboard', None)
+        pkg_dict.update(search.index_fields(pkg_dict['id']))
+        return pkg_dict
+
+    def after_dataset_delete(self, context, pkg_dict):
+        # By default the dashboard is kept, so it is back if the dataset is
+        # restored. `ckan dashboard gc --deleted-datasets` cleans them up.
+        if not toolkit.asbool(toolkit.config.get('ckanext.dashboard.delete_with_dataset', False)):
+            return
+        # The id may also be the name of the dataset
+        pkg = model.Package.get(pkg_dict['id'])
+        if not pkg:
+            return
+        # Part of package_delete's transaction, which CKAN commits
+        session = model.Session()
+        revision, deleted = delete_package_dashboards(session, [pkg.id])
+        if deleted:
+            changes.on_commit(session, deleted, revision, exists=False, reindex=False)
+
+    def after_dataset_show(self, context, pkg_dict):
+        if not h.include_dashboard_in_package_dict():
+            return
+        record = cache.get_dashboard(pkg_dict['id'])
+        pkg_dict['dashboard'] = show_dict(record) if record else None
+
+    def after_dataset_search(self, search_results, search_params):
+        if not h.include_dashboard_in_package_dict():
+            return search_results
+        # One query for the whole page of results
+        records = cache.get_dashboards([pkg['id'] for pkg in search_results['results']])
+        for pkg_dict in search_results['results']:
+            record = records[pkg_dict['id']]
+            pkg_dict['dashboard'] = show_dict(record) if record else None
+        return search_results
+
+    # IFacets
+
+    def dataset_facets(self, facets_dict, package_type):
+        facets_dict['dashboard_type'] = toolkit._('Dashboard type')
+        return facets_dict
+
     def i18n_locales(self):
         """Languages this plugin has translations for."""
         # Return a list of languages that this plugin has translations for.
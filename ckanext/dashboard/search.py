@@ -0,0 +1,64 @@
+"""
+Search index integration: dashboard fields on the dataset documents
+"""
+
+import logging
+
+from ckan import model
+from ckan.lib import search
+from ckan.plugins import toolkit
+
+from ckanext.dashboard import urls
+from ckanext.dashboard.models import DatasetDashboard
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SYNC_REINDEX_LIMIT = 50
+
+
+def index_fields(package_id):
+    """Fields added to the search document of a dataset"""
+    dashboard = model.Session.query(DatasetDashboard).filter_by(package_id=package_id).first()
+    if not dashboard:
+        return {'has_dashboard': 'false'}
+    data = dashboard.dictize()
+    fields = {'has_dashboard': 'true'}
+    if data['dashboard_type']:
+        fields['dashboard_type'] = data['dashboard_type']
+    if data['embed_host']:
+        fields['dashboard_host'] = data['embed_host']
+    for field in urls.URL_FIELDS:
+        value = data[field]
+        if field != 'embed_host' and value:
+            fields[f'dashboard_{field}'] = value
+    if data['definition_id']:
+        fields['dashboard_definition_id'] = str(data['definition_id'])
+    return fields
+
+
+def rebuild(package_ids):
+    """Reindexes the given datasets and commits once at the end"""
+    for package_id in package_ids:
+        try:
+            search.rebuild(package_ids=[package_id], defer_commit=True)
+        except (toolkit.ObjectNotFound, search.SearchIndexError) as e:
+            log.warning(f"Could not reindex dataset {package_id}: {e}")
+    search.commit()
+
+
+def reindex(package_ids):
+    """Reindexes the datasets whose dashboard changed.
+
+    Small batches are reindexed straight away, so the change is searchable
+    when the request returns; larger ones go to a background job.
+    """
+    package_ids = [str(package_id) for package_id in package_ids]
+    if not package_ids:
+        return
+    limit = toolkit.asint(
+        toolkit.config.get('ckanext.dashboard.search.sync_reindex_limit', DEFAULT_SYNC_REINDEX_LIMIT)
+    )
+    if len(package_ids) <= limit:
+        rebuild(package_ids)
+    else:
+        toolkit.enqueue_job(rebuild, [package_ids], title=f'Reindex {len(package_ids)} datasets with dashboards')
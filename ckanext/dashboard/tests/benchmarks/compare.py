@@ -0,0 +1,43 @@
+"""
+Compares two benchmark result files::
+
+    python -m ckanext.dashboard.tests.benchmarks.compare old.json new.json
+"""
+
+import json
+import sys
+
+FIELDS = ("p50_ms", "p95_ms", "p99_ms", "queries_per_call")
+
+
+def compare(old, new):
+    lines = [f"{old['commit']} -> {new['commit']} ({new.get('datasets')} datasets)"]
+    for name in sorted(set(old["results"]) | set(new["results"])):
+        before = old["results"].get(name)
+        after = new["results"].get(name)
+        if not before or not after:
+            lines.append(f"  {name:32} only in {'new' if after else 'old'}")
+            continue
+        changes = []
+        for field in FIELDS:
+            if field not in before or field not in after:
+                continue
+            delta = after[field] - before[field]
+            ratio = f" ({delta / before[field]:+.0%})" if before[field] else ""
+            changes.append(f"{field} {after[field]:.2f}{ratio}")
+        lines.append(f"  {name:32} " + "  ".join(changes))
+    return "\n".join(lines)
+
+
+def main(argv):
+    if len(argv) != 3:
+        sys.exit(__doc__)
+    with open(argv[1]) as f:
+        old = json.load(f)
+    with open(argv[2]) as f:
+        new = json.load(f)
+    print(compare(old, new))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,14 @@
+import os
+
+import pytest
+
+
+def pytest_collection_modifyitems(config, items):
+    """The benchmarks seed large tables and take minutes, they only run
+    when explicitly requested"""
+    if os.environ.get("DASHBOARD_BENCHMARK"):
+        return
+    skip = pytest.mark.skip(reason="Set DASHBOARD_BENCHMARK=1 to run the benchmarks")
+    for item in items:
+        if "benchmarks" in item.nodeid:
+            item.add_marker(skip)
@@ -0,0 +1,126 @@
+"""
+Benchmarks of the dashboard read and write paths.
+
+Run them with::
+
+    DASHBOARD_BENCHMARK=1 pytest --ckan-ini=test.ini ckanext/dashboard/tests/benchmarks
+
+Settings (environment variables):
+
+- ``DASHBOARD_BENCHMARK_SIZES``: comma separated numbers of datasets to
+  seed, default ``1000,10000``
+- ``DASHBOARD_BENCHMARK_FRACTION``: share of the datasets with a
+  dashboard, default ``0.5``
+- ``DASHBOARD_BENCHMARK_ITERATIONS``: calls measured per operation,
+  default ``200``
+- ``DASHBOARD_BENCHMARK_DIR``: where the JSON results are written,
+  default ``.benchmarks``
+
+Each run writes ``<commit>-<datasets>.json``. Compare two runs with
+``python -m ckanext.dashboard.tests.benchmarks.compare old.json new.json``.
+"""
+
+import os
+import random
+import time
+
+import pytest
+from ckan.lib.helpers import url_for
+from ckan.tests import factories, helpers
+
+from ckanext.dashboard import cache, fragments
+from ckanext.dashboard.helpers import get_dataset_dashboard
+from ckanext.dashboard.tests.benchmarks.utils import latency_summary, write_results
+from ckanext.dashboard.tests.conftest import QueryBudget
+from ckanext.dashboard.tests.factories import seed_dashboards
+
+SIZES = [int(size) for size in os.environ.get("DASHBOARD_BENCHMARK_SIZES", "1000,10000").split(",")]
+FRACTION = float(os.environ.get("DASHBOARD_BENCHMARK_FRACTION", "0.5"))
+ITERATIONS = int(os.environ.get("DASHBOARD_BENCHMARK_ITERATIONS", "200"))
+
+
+def measure(operation, args_list, setup=None):
+    """Calls ``operation(*args)`` for every args in ``args_list`` and returns
+    the latency percentiles in milliseconds and the queries per call"""
+    timings = []
+    # Every statement counts, CKAN's own queries are part of the latency
+    with QueryBudget(float('inf'), tables=None) as queries:
+        for args in args_list:
+            if setup:
+                setup()
+            start = time.perf_counter()
+            operation(*args)
+            timings.append((time.perf_counter() - start) * 1000)
+    return dict(latency_summary(timings), queries_per_call=len(queries.statements) / len(timings))
+
+
+def _clear_caches():
+    cache.clear()
+    fragments.clear()
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+@pytest.mark.parametrize("datasets", SIZES)
+def test_benchmark(app, datasets):
+    sysadmin = factories.Sysadmin()
+    org = factories.Organization()
+    with_dashboard, without_dashboard = seed_dashboards(datasets, FRACTION, org["id"])
+    rng = random.Random(datasets)
+    sample = [rng.choice(with_dashboard) for _ in range(ITERATIONS)]
+    sample_without = [rng.choice(without_dashboard) for _ in range(ITERATIONS)] if without_dashboard else []
+    anonymous = {"user": "", "ignore_auth": False}
+    admin = {"user": sysadmin["name"], "ignore_auth": False}
+    results = {}
+
+    def show(package_id):
+        helpers.call_action("dataset_dashboard_show", context=dict(anonymous), pkg_id=package_id)
+
+    results["get_dataset_dashboard_cold"] = measure(
+        get_dataset_dashboard, [(pkg_id,) for pkg_id, _ in sample], setup=_clear_caches
+    )
+    results["get_dataset_dashboard_warm"] = measure(get_dataset_dashboard, [(pkg_id,) for pkg_id, _ in sample])
+    if sample_without:
+        results["get_dataset_dashboard_missing"] = measure(
+            get_dataset_dashboard, [(pkg_id,) for pkg_id, _ in sample_without]
+        )
+    results["dataset_dashboard_show"] = measure(show, [(pkg_id,) for pkg_id, _ in sample])
+
+    def read(name):
+        app.get(url_for("dataset.read", id=name), status=200)
+
+    results["dataset_read_cold"] = measure(read, [(name,) for _, name in sample], setup=_clear_caches)
+    results["dataset_read_warm"] = measure(read, [(name,) for _, name in sample])
+
+    def update(package_id):
+        helpers.call_action(
+            "dataset_dashboard_update", context=dict(admin), package_id=package_id,
+            report_title=f"Updated {rng.random()}",
+        )
+
+    results["dataset_dashboard_update"] = measure(update, [(pkg_id,) for pkg_id, _ in sample])
+
+    if without_dashboard:
+        targets = rng.sample(without_dashboard, min(ITERATIONS, len(without_dashboard)))
+        created = []
+
+        def create(package_id):
+            created.append(helpers.call_action(
+                "dataset_dashboard_create", context=dict(admin), package_id=package_id,
+                dashboard_type="tableau", embeded_url="https://public.tableau.com/views/new",
+            )["id"])
+
+        def delete(dashboard_id):
+            helpers.call_action("dataset_dashboard_delete", context=dict(admin), id=dashboard_id)
+
+        results["dataset_dashboard_create"] = measure(create, [(pkg_id,) for pkg_id, _ in targets])
+        results["dataset_dashboard_delete"] = measure(delete, [(dashboard_id,) for dashboard_id in created])
+
+    path = write_results(str(datasets), {
+        "datasets": datasets, "fraction": FRACTION, "iterations": ITERATIONS, "results": results,
+    })
+    print(f"\nBenchmark results for {datasets} datasets written to {path}")
+    for name, values in sorted(results.items()):
+        print(
+            f"  {name:32} p50 {values['p50_ms']:8.2f}ms  p95 {values['p95_ms']:8.2f}ms  "
+            f"p99 {values['p99_ms']:8.2f}ms  {values['queries_per_call']:6.1f} queries"
+        )
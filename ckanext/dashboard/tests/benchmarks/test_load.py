@@ -0,0 +1,179 @@
+"""
+Load test of the dataset page with embedded dashboards.
+
+A thread pool drives the CKAN test app with a mix of anonymous dataset
+page reads, authenticated reads (which also run the nav ``check_access``)
+and dashboard edits through the ``embeded_dashboard.create`` form, while
+a sampler watches the database connection pool.
+
+Run it with::
+
+    DASHBOARD_BENCHMARK=1 pytest --ckan-ini=test.ini -s ckanext/dashboard/tests/benchmarks/test_load.py
+
+Settings (environment variables):
+
+- ``DASHBOARD_LOAD_CONCURRENCY``: comma separated numbers of concurrent
+  clients, default ``1,8,32``
+- ``DASHBOARD_LOAD_REQUESTS``: requests per concurrency level, default
+  ``2000``
+- ``DASHBOARD_LOAD_MIX``: weights of the request kinds, default
+  ``anonymous=70,authenticated=25,edit=5``
+- ``DASHBOARD_LOAD_DATASETS``: datasets seeded, half of them with a
+  dashboard, default ``1000``
+
+Each concurrency level writes ``<commit>-load-<concurrency>.json`` to the
+benchmark results directory.
+"""
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from ckan import model
+from ckan.lib.helpers import url_for
+from ckan.tests import factories
+
+from ckanext.dashboard.tests.benchmarks.utils import latency_summary, write_results
+from ckanext.dashboard.tests.factories import seed_dashboards
+
+CONCURRENCY = [int(n) for n in os.environ.get("DASHBOARD_LOAD_CONCURRENCY", "1,8,32").split(",")]
+REQUESTS = int(os.environ.get("DASHBOARD_LOAD_REQUESTS", "2000"))
+MIX = {
+    kind: int(weight) for kind, weight in (
+        item.split("=") for item in
+        os.environ.get("DASHBOARD_LOAD_MIX", "anonymous=70,authenticated=25,edit=5").split(",")
+    )
+}
+DATASETS = int(os.environ.get("DASHBOARD_LOAD_DATASETS", "1000"))
+POOL_SAMPLE_INTERVAL = 0.005
+
+
+class PoolSampler(threading.Thread):
+    """Samples how many connections of the engine's pool are in use"""
+
+    def __init__(self, pool):
+        super().__init__(daemon=True)
+        self.pool = pool
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.samples.append(self.pool.checkedout() if hasattr(self.pool, "checkedout") else 0)
+            time.sleep(POOL_SAMPLE_INTERVAL)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def summary(self):
+        size = self.pool.size() if hasattr(self.pool, "size") else None
+        samples = self.samples or [0]
+        return {
+            "pool_size": size,
+            "max_overflow": getattr(self.pool, "_max_overflow", None),
+            "checked_out_max": max(samples),
+            "checked_out_mean": sum(samples) / len(samples),
+            # Share of the time all the pool's regular connections were busy
+            "saturated_ratio": (
+                sum(1 for n in samples if n >= size) / len(samples) if size else None
+            ),
+        }
+
+
+def _run(app, plan, concurrency):
+    """Sends the requests of ``plan`` from ``concurrency`` threads, returns
+    the latencies and errors per request kind and the wall time"""
+    timings = {kind: [] for kind in MIX}
+    errors = {kind: 0 for kind in MIX}
+    lock = threading.Lock()
+
+    def send(request):
+        kind, method, url, kwargs = request
+        start = time.perf_counter()
+        try:
+            response = getattr(app, method)(url, **kwargs)
+            failed = response.status_code >= 400
+        except Exception:
+            failed = True
+        finally:
+            # Each thread has its own scoped session
+            model.Session.remove()
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            timings[kind].append(elapsed)
+            errors[kind] += failed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, plan))
+    return timings, errors, time.perf_counter() - start
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+@pytest.mark.parametrize("concurrency", CONCURRENCY)
+def test_dataset_page_load(app, concurrency):
+    sysadmin = factories.SysadminWithToken()
+    editor = factories.UserWithToken()
+    org = factories.Organization(users=[{"name": editor["name"], "capacity": "editor"}])
+    with_dashboard, without_dashboard = seed_dashboards(DATASETS, 0.5, org["id"])
+    rng = random.Random(concurrency)
+    datasets = with_dashboard + without_dashboard
+
+    def request(kind):
+        package_id, name = rng.choice(with_dashboard if kind == "edit" else datasets)
+        if kind == "anonymous":
+            return kind, "get", url_for("dataset.read", id=name), {}
+        if kind == "authenticated":
+            return kind, "get", url_for("dataset.read", id=name), {
+                "headers": {"Authorization": editor["token"]},
+            }
+        return kind, "post", url_for("embeded_dashboard.create", package_id=package_id), {
+            "headers": {"Authorization": sysadmin["token"]},
+            "data": {
+                "dashboard_type": "tableau",
+                "embeded_url": f"https://public.tableau.com/views/load-{rng.random()}",
+            },
+        }
+
+    kinds = rng.choices(list(MIX), weights=list(MIX.values()), k=REQUESTS)
+    plan = [request(kind) for kind in kinds]
+    # Warm up the caches and the connection pool
+    for item in plan[:50]:
+        getattr(app, item[1])(item[2], **item[3])
+
+    sampler = PoolSampler(model.meta.engine.pool)
+    sampler.start()
+    try:
+        timings, errors, elapsed = _run(app, plan, concurrency)
+    finally:
+        sampler.stop()
+
+    results = {
+        kind: dict(latency_summary(timings[kind]), errors=errors[kind]) for kind in MIX
+    }
+    results["all"] = dict(
+        latency_summary([t for kind in MIX for t in timings[kind]]), errors=sum(errors.values())
+    )
+    pool = sampler.summary()
+    path = write_results(f"load-{concurrency}", {
+        "datasets": DATASETS,
+        "concurrency": concurrency,
+        "requests": REQUESTS,
+        "mix": MIX,
+        "throughput_rps": REQUESTS / elapsed,
+        "pool": pool,
+        "results": results,
+    })
+
+    print(f"\nLoad test with {concurrency} clients written to {path}")
+    print(f"  throughput {REQUESTS / elapsed:.1f} req/s, pool {pool}")
+    for kind, values in results.items():
+        if values["calls"]:
+            print(
+                f"  {kind:14} {values['calls']:6} requests  p50 {values['p50_ms']:8.2f}ms  "
+                f"p95 {values['p95_ms']:8.2f}ms  p99 {values['p99_ms']:8.2f}ms  {values['errors']} errors"
+            )
@@ -0,0 +1,54 @@
+"""
+Helpers shared by the benchmarks and the load test
+"""
+
+import datetime
+import json
+import os
+import subprocess
+
+OUTPUT_DIR = os.environ.get("DASHBOARD_BENCHMARK_DIR", ".benchmarks")
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    rank = max(int(round(pct / 100.0 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def latency_summary(timings):
+    """Percentiles and mean of a list of latencies in milliseconds"""
+    timings = sorted(timings)
+    if not timings:
+        return {"calls": 0}
+    return {
+        "calls": len(timings),
+        "p50_ms": percentile(timings, 50),
+        "p95_ms": percentile(timings, 95),
+        "p99_ms": percentile(timings, 99),
+        "max_ms": timings[-1],
+        "mean_ms": sum(timings) / len(timings),
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def write_results(name, data):
+    """Writes ``data`` with the commit and date to
+    ``<OUTPUT_DIR>/<commit>-<name>.json``, returns the path"""
+    commit = current_commit()
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    path = os.path.join(OUTPUT_DIR, f"{commit}-{name}.json")
+    with open(path, "w") as f:
+        json.dump(
+            dict(data, commit=commit, date=datetime.datetime.utcnow().isoformat()),
+            f, indent=2, sort_keys=True,
+        )
+    return path
@@ -1,4 +1,10 @@
 import pytest
+from sqlalchemy import event
+from ckan import model
+
+from ckanext.dashboard import cache, counters, fragments
+
+DASHBOARD_TABLES = ("dashboard_dashboard", "dashboard_definition", "dashboard_revision", "dashboard_change")
 
 
 @pytest.fixture
@@ -6,3 +12,43 @@ def clean_db(reset_db, migrate_db_for):
     """Clean and initialize the database."""
     reset_db()
     migrate_db_for("dashboard")
+    cache.clear()
+    counters.clear()
+    fragments.clear()
+
+
+class QueryBudget:
+    """Fails when a block runs more SQL statements than allowed.
+
+    Only the statements that mention one of ``tables`` count, by default the
+    dashboard ones, so budgets for this extension's queries don't break on
+    changes in CKAN. Pass ``tables=None`` to count every statement.
+    """
+
+    def __init__(self, limit, tables=DASHBOARD_TABLES):
+        self.limit = limit
+        self.tables = tables
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if not self.tables or any(table in statement for table in self.tables):
+            self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(model.meta.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        event.remove(model.meta.engine, "before_cursor_execute", self._record)
+        if exc_type is None and len(self.statements) > self.limit:
+            pytest.fail(
+                f"{len(self.statements)} SQL statements run, the budget is {self.limit}:\n\n"
+                + "\n\n".join(self.statements)
+            )
+
+
+@pytest.fixture
+def query_budget():
+    """``with query_budget(2): ...`` fails the test if the block runs more
+    than 2 statements on the dashboard tables"""
+    return QueryBudget
@@ -1,6 +1,11 @@
+import datetime
+import uuid
+
 import factory
+from sqlalchemy import text
 from ckan import model
 from ckantoolkit.tests import factories
+from ckanext.dashboard import urls
 from ckanext.dashboard.models import DatasetDashboard
 
 
@@ -22,3 +27,47 @@ class DashboardFactory(factory.Factory):
         model.Session.remove()
 
         return obj
+
+
+SEED_CHUNK_SIZE = 5000
+
+
+def seed_dashboards(datasets, fraction=0.5, owner_org=None):
+    """Bulk inserts ``datasets`` datasets, ``fraction`` of them with a
+    dashboard. Returns the (id, name) of both groups."""
+    now = datetime.datetime.utcnow()
+    packages = []
+    for n in range(datasets):
+        package_id = str(uuid.uuid4())
+        packages.append({
+            "id": package_id, "name": f"bench-{n}-{package_id[:8]}", "title": f"Benchmark dataset {n}",
+            "type": "dataset", "state": "active", "private": False, "owner_org": owner_org,
+            "metadata_created": now, "metadata_modified": now,
+        })
+    with_dashboard = packages[:int(datasets * fraction)]
+
+    session = model.Session
+    for start in range(0, datasets, SEED_CHUNK_SIZE):
+        session.execute(model.Package.__table__.insert(), packages[start:start + SEED_CHUNK_SIZE])
+    for start in range(0, len(with_dashboard), SEED_CHUNK_SIZE):
+        session.execute(DatasetDashboard.__table__.insert(), [
+            {
+                "package_id": package["id"],
+                "dashboard_type": "tableau" if n % 2 else "powerbi",
+                "embeded_url": f"https://public.tableau.com/views/bench-{n}",
+                "report_url": f"https://report.example/bench-{n}",
+                "report_title": "View full report",
+                "updated_at": now,
+                "version": 1,
+                **urls.identifiers(f"https://public.tableau.com/views/bench-{n}"),
+            }
+            for n, package in enumerate(with_dashboard[start:start + SEED_CHUNK_SIZE], start)
+        ])
+    session.commit()
+    session.execute(text("ANALYZE package, dashboard_dashboard"))
+    session.commit()
+
+    return (
+        [(p["id"], p["name"]) for p in with_dashboard],
+        [(p["id"], p["name"]) for p in packages[len(with_dashboard):]],
+    )
@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+from ckan import model
+from ckan.lib.helpers import url_for
+from ckan.plugins import toolkit
+from ckan.tests import factories
+
+from ckanext.dashboard.auth import dashboard_dataset as auth
+from ckanext.dashboard.tests.factories import DashboardFactory
+
+
+@pytest.fixture
+def setup_data():
+    obj = SimpleNamespace()
+    obj.user = factories.UserWithToken()
+    obj.headers = {"Authorization": obj.user["token"]}
+    obj.org = factories.Organization(users=[{"name": obj.user["name"], "capacity": "editor"}])
+    obj.dataset = factories.Dataset(owner_org=obj.org["id"])
+    DashboardFactory(package_id=obj.dataset["id"], dashboard_type="tableau")
+    return obj
+
+
+@pytest.fixture
+def auth_evaluations(monkeypatch):
+    """Records the package permission checks run by the dashboard auth functions"""
+    evaluations = []
+    check_access = toolkit.check_access
+
+    def counting_check_access(action, context=None, data_dict=None):
+        if action in ("package_update", "package_show"):
+            evaluations.append((context.get("user"), action, data_dict.get("id")))
+        return check_access(action, context, data_dict)
+
+    monkeypatch.setattr(toolkit, "check_access", counting_check_access)
+    return evaluations
+
+
+@pytest.fixture
+def sql_statements():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = model.meta.engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestAuthMemoization:
+
+    def test_package_read(self, app, setup_data, auth_evaluations, sql_statements):
+        url = url_for("dataset.read", id=setup_data.dataset["name"])
+        app.get(url, headers=setup_data.headers)
+        del auth_evaluations[:]
+        del sql_statements[:]
+
+        response = app.get(url, headers=setup_data.headers)
+
+        assert 'Dashboard' in response
+        # The nav icon check, once
+        assert auth_evaluations == [(setup_data.user["name"], "package_update", setup_data.dataset["id"])]
+        # Warm caches: the dashboard comes from the worker cache
+        assert not [s for s in sql_statements if "dashboard_dashboard" in s or "dashboard_revision" in s]
+
+    def test_checks_run_once_per_request(self, app, setup_data, auth_evaluations, sql_statements, monkeypatch):
+        url = url_for("embeded_dashboard.create", package_id=setup_data.dataset["id"])
+
+        app.get(url, headers=setup_data.headers, status=200)
+        memoized_queries = len(sql_statements)
+        # The view and the nav icon of the form both check package_update
+        assert auth_evaluations.count(
+            (setup_data.user["name"], "package_update", setup_data.dataset["id"])
+        ) == 1
+
+        monkeypatch.setattr(auth, "has_request_context", lambda: False)
+        del auth_evaluations[:]
+        del sql_statements[:]
+        app.get(url, headers=setup_data.headers, status=200)
+
+        assert len(auth_evaluations) > 1
+        assert len(sql_statements) > memoized_queries
+
+    def test_memo_does_not_outlive_the_request(self, app, setup_data, auth_evaluations):
+        url = url_for("dataset.read", id=setup_data.dataset["name"])
+        app.get(url, headers=setup_data.headers)
+        app.get(url, headers=setup_data.headers)
+
+        update_checks = [e for e in auth_evaluations if e[1] == "package_update"]
+        assert len(update_checks) == 2
@@ -0,0 +1,96 @@
+import pytest
+from ckan import model
+from ckan.plugins import toolkit as t
+from ckan.tests import helpers, factories
+from ckanext.dashboard.models import DatasetDashboard
+from ckanext.dashboard.tests.factories import DashboardFactory
+
+
+@pytest.fixture
+def setup_data():
+    """Creates an editor of an organization with two datasets, one of them
+    with a dashboard, and a dataset of another organization."""
+    data = {}
+    data["editor"] = factories.User()
+    data["org"] = factories.Organization(users=[{"name": data["editor"]["name"], "capacity": "editor"}])
+    data["dataset"] = factories.Dataset(owner_org=data["org"]["id"])
+    data["with_dashboard"] = factories.Dataset(owner_org=data["org"]["id"])
+    data["dashboard"] = DashboardFactory(
+        package_id=data["with_dashboard"]["id"],
+        dashboard_type="tableau",
+        embeded_url="https://old/embed",
+        report_title="Old title",
+    )
+    data["other_dataset"] = factories.Dataset(owner_org=factories.Organization()["id"])
+    return data
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestDashboardBulkUpsert:
+
+    def _upsert(self, user, records):
+        ctx = {"user": user["name"], "ignore_auth": False}
+        return helpers.call_action("dataset_dashboard_bulk_upsert", context=ctx, records=records)
+
+    def test_creates_and_updates(self, setup_data):
+        out = self._upsert(setup_data["editor"], [
+            {"package_id": setup_data["dataset"]["id"], "dashboard_type": "powerbi",
+             "embeded_url": "https://new/embed"},
+            {"package_id": setup_data["with_dashboard"]["id"], "dashboard_type": "powerbi",
+             "embeded_url": "https://updated/embed"},
+        ])
+
+        assert (out["created"], out["updated"], out["failed"]) == (1, 1, 0)
+        assert out["results"][0]["created"] is True
+        assert out["results"][1]["created"] is False
+        assert out["results"][1]["id"] == setup_data["dashboard"].id
+
+        updated = model.Session.query(DatasetDashboard).filter_by(id=setup_data["dashboard"].id).one()
+        assert updated.dashboard_type == "powerbi"
+        assert updated.embeded_url == "https://updated/embed"
+        # Fields left out keep their value
+        assert updated.report_title == "Old title"
+
+    def test_per_item_errors(self, setup_data):
+        out = self._upsert(setup_data["editor"], [
+            {"package_id": setup_data["other_dataset"]["id"], "dashboard_type": "tableau"},
+            {"package_id": "not-a-dataset", "dashboard_type": "tableau"},
+            {"package_id": setup_data["dataset"]["id"]},
+            {"package_id": setup_data["dataset"]["id"], "dashboard_type": "x" * 21},
+        ])
+
+        assert out["failed"] == 4
+        errors = [r["error"] for r in out["results"]]
+        assert errors[0] == "Not authorized"
+        assert errors[1] == "Dataset not found"
+        assert "required" in errors[2]
+        assert "longer" in errors[3]
+        assert model.Session.query(DatasetDashboard).count() == 1
+
+    def test_last_duplicate_wins(self, setup_data):
+        out = self._upsert(setup_data["editor"], [
+            {"package_id": setup_data["dataset"]["id"], "dashboard_type": "tableau"},
+            {"package_id": setup_data["dataset"]["id"], "dashboard_type": "powerbi"},
+        ])
+
+        assert out["results"][0]["success"] is False
+        assert out["results"][1]["success"] is True
+        dashboard = model.Session.query(DatasetDashboard).filter_by(package_id=setup_data["dataset"]["id"]).one()
+        assert dashboard.dashboard_type == "powerbi"
+
+    @pytest.mark.ckan_config("ckanext.dashboard.bulk_upsert.chunk_size", "2")
+    def test_chunks(self, setup_data):
+        sysadmin = factories.Sysadmin()
+        datasets = [factories.Dataset() for _ in range(5)]
+        out = self._upsert(sysadmin, [
+            {"package_id": d["id"], "dashboard_type": "tableau"} for d in datasets
+        ])
+        assert out["created"] == 5
+
+    def test_anonymous_not_allowed(self, setup_data):
+        with pytest.raises(t.NotAuthorized):
+            helpers.call_action(
+                "dataset_dashboard_bulk_upsert",
+                context={"user": "", "ignore_auth": False},
+                records=[{"package_id": setup_data["dataset"]["id"], "dashboard_type": "tableau"}],
+            )
@@ -0,0 +1,302 @@
+import pytest
+from ckan import model
+from ckan.plugins import toolkit as t
+from ckan.tests import factories, helpers
+
+from ckanext.dashboard import cache, changes
+from ckanext.dashboard.cache import LRUCache
+from ckanext.dashboard.helpers import get_dataset_dashboard
+from ckanext.dashboard.models import DatasetDashboard
+from ckanext.dashboard.tests.factories import DashboardFactory
+
+
+class TestLRUCache:
+
+    def test_evicts_least_recently_used(self):
+        lru = LRUCache(maxsize=2, ttl=60)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+
+        assert lru.get("a") == 1
+        assert lru.get("b", None) is None
+        assert lru.stats()["evictions"] == 1
+
+    def test_expired_entries_are_misses(self, monkeypatch):
+        lru = LRUCache(maxsize=10, ttl=5)
+        lru.set("a", 1)
+        now = cache.time.monotonic()
+        monkeypatch.setattr(cache.time, "monotonic", lambda: now + 10)
+
+        assert lru.get("a", None) is None
+        assert lru.stats()["misses"] == 1
+
+    def test_none_is_cached(self):
+        lru = LRUCache(maxsize=10, ttl=60)
+        calls = []
+
+        def loader(key):
+            calls.append(key)
+
+        assert lru.get_or_load("a", loader) is None
+        assert lru.get_or_load("a", loader) is None
+        assert calls == ["a"]
+        assert lru.stats()["hits"] == 1
+
+    def test_load_racing_an_invalidation_is_not_stored(self):
+        lru = LRUCache(maxsize=10, ttl=60)
+
+        def loader(key):
+            lru.invalidate(key)
+            return "stale"
+
+        assert lru.get_or_load("a", loader) == "stale"
+        assert lru.get("a", None) is None
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestDashboardLookupCache:
+
+    def test_helper_returns_immutable_record(self):
+        dataset = factories.Dataset()
+        DashboardFactory(package_id=dataset["id"], dashboard_type="tableau")
+
+        record = get_dataset_dashboard(dataset["id"])
+
+        assert record.package_id == dataset["id"]
+        assert record.dashboard_type == "tableau"
+        with pytest.raises(AttributeError):
+            record.dashboard_type = "powerbi"
+
+    def test_second_lookup_is_a_hit(self):
+        dataset = factories.Dataset()
+        get_dataset_dashboard(dataset["id"])
+        get_dataset_dashboard(dataset["id"])
+
+        stats = cache.stats()
+        assert stats["misses"] >= 1
+        assert stats["hits"] >= 1
+
+    def test_write_actions_invalidate(self):
+        sysadmin = factories.Sysadmin()
+        dataset = factories.Dataset()
+        ctx = {"user": sysadmin["name"]}
+
+        assert get_dataset_dashboard(dataset["id"]) is None
+
+        created = helpers.call_action(
+            "dataset_dashboard_create", context=ctx,
+            package_id=dataset["id"], dashboard_type="tableau",
+            embeded_url="https://embed.example/d/1",
+        )
+        assert get_dataset_dashboard(dataset["id"]).embeded_url == "https://embed.example/d/1"
+
+        helpers.call_action(
+            "dataset_dashboard_update", context=ctx,
+            package_id=dataset["id"], embeded_url="https://embed.example/d/2",
+        )
+        assert get_dataset_dashboard(dataset["id"]).embeded_url == "https://embed.example/d/2"
+
+        helpers.call_action("dataset_dashboard_delete", context=ctx, id=created["id"])
+        assert get_dataset_dashboard(dataset["id"]) is None
+
+    def test_stats_are_sysadmin_only(self):
+        user = factories.User()
+        with pytest.raises(t.NotAuthorized):
+            helpers.call_action(
+                "dataset_dashboard_cache_stats",
+                context={"user": user["name"], "ignore_auth": False},
+            )
+
+        sysadmin = factories.Sysadmin()
+        stats = helpers.call_action("dataset_dashboard_cache_stats", context={"user": sysadmin["name"]})
+        assert set(stats) >= {"hits", "misses", "evictions", "size"}
+
+
+class TestPackageIdIndex:
+
+    def test_unknown_ids_are_skipped(self):
+        index = cache.PackageIdIndex(lambda: ["a"])
+
+        assert index.might_have("a")
+        assert not index.might_have("b")
+        assert index.stats()["skipped"] == 1
+
+    def test_loads_once_until_stale(self, monkeypatch):
+        loads = []
+
+        def loader():
+            loads.append(1)
+            return ["a"]
+
+        index = cache.PackageIdIndex(loader, refresh_interval=30)
+        index.might_have("a")
+        index.might_have("b")
+        assert len(loads) == 1
+
+        now = cache.time.monotonic()
+        monkeypatch.setattr(cache.time, "monotonic", lambda: now + 60)
+        index.might_have("a")
+        assert len(loads) == 2
+
+    def test_writes_during_reload_are_kept(self):
+        index = cache.PackageIdIndex(lambda: [])
+
+        def loader():
+            index.set_exists("new", True)
+            return []
+
+        index.loader = loader
+        assert index.might_have("new")
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestDashboardIndex:
+
+    def test_dataset_without_dashboard_skips_the_database(self):
+        with_dashboard = factories.Dataset()
+        DashboardFactory(package_id=with_dashboard["id"], dashboard_type="tableau")
+        without_dashboard = factories.Dataset()
+
+        assert get_dataset_dashboard(with_dashboard["id"]) is not None
+        misses = cache.stats()["misses"]
+        skipped = cache.stats()["index"]["skipped"]
+
+        assert get_dataset_dashboard(without_dashboard["id"]) is None
+        assert cache.stats()["misses"] == misses
+        assert cache.stats()["index"]["skipped"] == skipped + 1
+
+    def test_create_and_delete_keep_the_index_in_sync(self):
+        sysadmin = factories.Sysadmin()
+        dataset = factories.Dataset()
+        ctx = {"user": sysadmin["name"]}
+        assert get_dataset_dashboard(dataset["id"]) is None
+
+        created = helpers.call_action(
+            "dataset_dashboard_create", context=ctx,
+            package_id=dataset["id"], dashboard_type="powerbi",
+        )
+        assert dataset["id"] in cache.dashboard_index._ids
+
+        helpers.call_action("dataset_dashboard_delete", context=ctx, id=created["id"])
+        assert dataset["id"] not in cache.dashboard_index._ids
+
+
+class TestRevisionWatcher:
+
+    def test_change_from_another_worker_is_applied(self, monkeypatch):
+        states = [(1, 10, 0)]
+        changes = []
+        watcher = cache.RevisionWatcher(
+            lambda: states[-1], lambda previous, current: changes.append((previous, current)), check_interval=5,
+        )
+        watcher.check()
+        assert changes == [(None, (1, 10))]
+        changes.clear()
+
+        states.append((2, 12, 0))
+        watcher.check()
+        assert changes == []  # within the check interval
+
+        now = cache.time.monotonic()
+        monkeypatch.setattr(cache.time, "monotonic", lambda: now + 10)
+        watcher.check()
+        assert changes == [((1, 10), (2, 12))]
+        assert watcher.stats()["changes"] == 1
+
+    def test_pruned_changes_are_unknown(self):
+        states = [(1, 10, 0)]
+        changes = []
+        watcher = cache.RevisionWatcher(
+            lambda: states[-1], lambda previous, current: changes.append(previous), check_interval=0,
+        )
+        watcher.check()
+
+        states.append((5, 30, 20))
+        watcher.check()
+        assert changes == [None, None]
+
+    def test_own_writes_keep_caches(self):
+        states = [(1, 10, 0)]
+        changes = []
+        watcher = cache.RevisionWatcher(
+            lambda: states[-1], lambda previous, current: changes.append(previous), check_interval=0,
+        )
+        watcher.check()
+        changes.clear()
+
+        states.append((2, 11, 0))
+        watcher.seen(2)
+        watcher.check()
+        assert changes == []
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestChangesFromOtherWorkers:
+
+    def _write_elsewhere(self, package_id, **values):
+        """Writes a dashboard like another worker would, without touching
+        the caches of this one"""
+        revision = changes.lock(model.Session, [package_id])
+        if values:
+            model.Session.query(DatasetDashboard).filter_by(package_id=package_id).update(values)
+        else:
+            model.Session.query(DatasetDashboard).filter_by(package_id=package_id).delete()
+        model.Session.commit()
+        return revision
+
+    def test_only_changed_datasets_are_dropped(self, monkeypatch):
+        datasets = [factories.Dataset() for _ in range(2)]
+        for dataset in datasets:
+            DashboardFactory(package_id=dataset["id"], dashboard_type="tableau")
+        monkeypatch.setattr(cache.revision_watcher, "check_interval", 0)
+        for dataset in datasets:
+            cache.get_dashboard(dataset["id"])
+        reloads = cache.stats()["index"]["reloads"]
+
+        self._write_elsewhere(datasets[0]["id"], dashboard_type="powerbi")
+        self._write_elsewhere(datasets[1]["id"])
+        hits = cache.stats()["hits"]
+
+        assert cache.get_dashboard(datasets[0]["id"]).dashboard_type == "powerbi"
+        assert cache.get_dashboard(datasets[1]["id"]) is None
+        assert datasets[1]["id"] not in cache.dashboard_index._ids
+        assert cache.stats()["index"]["reloads"] == reloads
+        assert cache.stats()["hits"] == hits
+
+    def test_revisions_without_changes_drop_everything(self, monkeypatch):
+        dataset = factories.Dataset()
+        DashboardFactory(package_id=dataset["id"], dashboard_type="tableau")
+        monkeypatch.setattr(cache.revision_watcher, "check_interval", 0)
+        cache.get_dashboard(dataset["id"])
+        reloads = cache.stats()["index"]["reloads"]
+
+        # Like a migration
+        changes.lock(model.Session)
+        model.Session.commit()
+        cache.get_dashboard(dataset["id"])
+
+        assert cache.stats()["index"]["reloads"] == reloads + 1
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestDashboardRevision:
+
+    def test_write_actions_bump_the_revision(self):
+        from ckan import model
+        from ckanext.dashboard.models import DashboardRevision
+
+        sysadmin = factories.Sysadmin()
+        dataset = factories.Dataset()
+        ctx = {"user": sysadmin["name"]}
+        before = DashboardRevision.current(model.Session)
+
+        created = helpers.call_action(
+            "dataset_dashboard_create", context=ctx,
+            package_id=dataset["id"], dashboard_type="tableau",
+        )
+        helpers.call_action("dataset_dashboard_update", context=ctx, package_id=dataset["id"], report_title="x")
+        helpers.call_action("dataset_dashboard_delete", context=ctx, id=created["id"])
+
+        assert DashboardRevision.current(model.Session) == before + 3
@@ -0,0 +1,114 @@
+import pytest
+from ckan import model
+from ckan.cli.cli import ckan
+from ckan.plugins import toolkit as t
+from ckan.tests import factories, helpers
+
+from ckanext.dashboard.models import DashboardChange
+
+
+def _changes(**kwargs):
+    return helpers.call_action("dataset_dashboard_changes_since", **kwargs)
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestChangesSince:
+
+    def test_every_write_is_recorded(self):
+        dataset = factories.Dataset()
+        helpers.call_action(
+            "dataset_dashboard_create", package_id=dataset["id"], dashboard_type="tableau",
+            embeded_url="https://public.tableau.com/views/A/B",
+        )
+        helpers.call_action("dataset_dashboard_update", package_id=dataset["id"], report_title="Budget")
+
+        page = _changes()
+
+        assert [change["package_id"] for change in page["changes"]] == [dataset["id"], dataset["id"]]
+        assert [change["deleted"] for change in page["changes"]] == [False, False]
+        assert page["changes"][0]["seq"] < page["changes"][1]["seq"]
+        assert page["changes"][0]["revision"] < page["changes"][1]["revision"]
+        assert page["changes"][1]["dashboard"]["report_title"] == "Budget"
+        assert page["next_seq"] == page["changes"][1]["seq"]
+        assert page["has_more"] is False
+
+    def test_deletes_leave_tombstones(self):
+        dataset = factories.Dataset()
+        helpers.call_action("dataset_dashboard_create", package_id=dataset["id"], dashboard_type="tableau")
+        seq = _changes()["next_seq"]
+
+        helpers.call_action("dataset_dashboard_delete", package_id=dataset["id"])
+
+        page = _changes(seq=seq)
+        assert [(change["package_id"], change["deleted"]) for change in page["changes"]] == [(dataset["id"], True)]
+        assert page["changes"][0]["dashboard"] is None
+
+    def test_bulk_writes_record_each_dataset(self):
+        datasets = [factories.Dataset() for _ in range(3)]
+        helpers.call_action("dataset_dashboard_bulk_upsert", records=[
+            {"package_id": dataset["id"], "dashboard_type": "tableau"} for dataset in datasets
+        ])
+        seq = _changes()["next_seq"]
+        assert model.Session.query(DashboardChange).count() == 3
+
+        dashboards = helpers.call_action("dataset_dashboard_list")["results"]
+        helpers.call_action("dataset_dashboard_bulk_delete", ids=[dashboards[0]["id"]])
+
+        page = _changes(seq=seq)
+        assert [change["deleted"] for change in page["changes"]] == [True]
+
+    def test_failed_records_are_not_recorded(self):
+        dataset = factories.Dataset()
+        out = helpers.call_action("dataset_dashboard_bulk_upsert", records=[
+            {"package_id": dataset["id"], "dashboard_type": "tableau"},
+            {"package_id": "not-a-dataset", "dashboard_type": "tableau"},
+            {"package_id": "0c6f7e1a-2b3d-4e5f-8a9b-0c1d2e3f4a5b", "dashboard_type": "tableau"},
+        ])
+
+        assert out["failed"] == 2
+        assert [change["package_id"] for change in _changes()["changes"]] == [dataset["id"]]
+
+    def test_pages(self):
+        datasets = [factories.Dataset() for _ in range(3)]
+        for dataset in datasets:
+            helpers.call_action("dataset_dashboard_create", package_id=dataset["id"], dashboard_type="tableau")
+
+        first = _changes(limit=2)
+        second = _changes(seq=first["next_seq"], limit=2)
+
+        assert first["has_more"] is True
+        assert second["has_more"] is False
+        assert [change["package_id"] for change in first["changes"] + second["changes"]] == [
+            dataset["id"] for dataset in datasets
+        ]
+        assert _changes(seq=second["next_seq"]) == {"changes": [], "next_seq": second["next_seq"], "has_more": False}
+
+    def test_pruned_changes(self, cli):
+        datasets = [factories.Dataset() for _ in range(3)]
+        for dataset in datasets:
+            helpers.call_action("dataset_dashboard_create", package_id=dataset["id"], dashboard_type="tableau")
+        seqs = [change["seq"] for change in _changes()["changes"]]
+
+        result = cli.invoke(ckan, ["dashboard", "prune-changes", "--days", "0", "--batch-size", "2"])
+        assert not result.exit_code, result.output
+        assert "Done, 3 changes deleted" in result.output
+
+        for seq in [0, seqs[1]]:
+            with pytest.raises(t.ValidationError) as error:
+                _changes(seq=seq)
+            assert error.value.error_dict["pruned_seq"] == [seqs[2]]
+        assert _changes(seq=seqs[2])["changes"] == []
+
+        dataset = factories.Dataset()
+        helpers.call_action("dataset_dashboard_create", package_id=dataset["id"], dashboard_type="tableau")
+        assert [change["package_id"] for change in _changes(seq=seqs[2])["changes"]] == [dataset["id"]]
+
+    @pytest.mark.parametrize("data", [{"seq": -1}, {"seq": "x"}, {"limit": 0}, {"limit": 5000}])
+    def test_validation(self, data):
+        with pytest.raises(t.ValidationError):
+            _changes(**data)
+
+    def test_requires_sysadmin(self):
+        context = {"user": factories.User()["name"], "ignore_auth": False}
+        with pytest.raises(t.NotAuthorized):
+            helpers.call_action("dataset_dashboard_changes_since", context=context)
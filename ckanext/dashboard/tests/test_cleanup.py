@@ -0,0 +1,81 @@
+import uuid
+
+import pytest
+from ckan import model
+from ckan.cli.cli import ckan
+from ckan.tests import factories, helpers
+
+from ckanext.dashboard import cache
+from ckanext.dashboard.models import DatasetDashboard
+from ckanext.dashboard.tests.factories import DashboardFactory
+
+
+def _dashboards():
+    return {str(package_id) for (package_id,) in model.Session.query(DatasetDashboard.package_id)}
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestDatasetHooks:
+
+    def test_purge_removes_the_dashboard(self):
+        dataset = factories.Dataset()
+        other = factories.Dataset()
+        DashboardFactory(package_id=dataset["id"])
+        DashboardFactory(package_id=other["id"])
+        assert cache.get_dashboard(dataset["id"])
+
+        helpers.call_action("dataset_purge", id=dataset["name"])
+
+        assert _dashboards() == {other["id"]}
+        assert cache.get_dashboard(dataset["id"]) is None
+
+    def test_delete_keeps_the_dashboard_by_default(self):
+        dataset = factories.Dataset()
+        DashboardFactory(package_id=dataset["id"])
+
+        helpers.call_action("package_delete", id=dataset["id"])
+
+        assert _dashboards() == {dataset["id"]}
+
+    @pytest.mark.ckan_config("ckanext.dashboard.delete_with_dataset", "true")
+    def test_delete_removes_the_dashboard_when_configured(self):
+        dataset = factories.Dataset()
+        DashboardFactory(package_id=dataset["id"])
+        assert cache.get_dashboard(dataset["id"])
+
+        helpers.call_action("package_delete", id=dataset["name"])
+
+        assert _dashboards() == set()
+        assert cache.get_dashboard(dataset["id"]) is None
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestGarbageCollection:
+
+    def test_gc_deletes_orphans_in_batches(self, cli):
+        kept = DashboardFactory()
+        for _ in range(5):
+            DashboardFactory(package_id=str(uuid.uuid4()))
+
+        result = cli.invoke(ckan, ['dashboard', 'gc', '--dry-run'])
+        assert not result.exit_code, result.output
+        assert "5 dashboards would be deleted" in result.output
+        assert len(_dashboards()) == 6
+
+        result = cli.invoke(ckan, ['dashboard', 'gc', '--batch-size', '2'])
+
+        assert not result.exit_code, result.output
+        assert "Done, 5 dashboards deleted" in result.output
+        assert _dashboards() == {kept.package_id}
+
+    def test_gc_deleted_datasets(self, cli):
+        dataset = factories.Dataset()
+        DashboardFactory(package_id=dataset["id"])
+        helpers.call_action("package_delete", id=dataset["id"])
+
+        result = cli.invoke(ckan, ['dashboard', 'gc'])
+        assert "Done, 0 dashboards deleted" in result.output
+
+        result = cli.invoke(ckan, ['dashboard', 'gc', '--deleted-datasets'])
+        assert "Done, 1 dashboards deleted" in result.output
+        assert _dashboards() == set()
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+from ckan import model
+from sqlalchemy import update
+from ckan.cli.cli import ckan
+from ckan.tests import factories
+from ckanext.dashboard.models import DatasetDashboard
+from ckanext.dashboard.tests.factories import DashboardFactory
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestExportImport:
+
+    def test_export_jsonl(self, cli):
+        dashboards = [DashboardFactory() for _ in range(3)]
+
+        result = cli.invoke(ckan, ['dashboard', 'export', '--batch-size', '2'])
+
+        assert not result.exit_code, result.output
+        rows = [json.loads(line) for line in result.output.splitlines() if line.startswith("{")]
+        assert [row["id"] for row in rows] == [d.id for d in dashboards]
+        assert rows[0]["package_id"] == dashboards[0].package_id
+
+    def test_export_csv(self, cli, tmp_path):
+        DashboardFactory(embeded_url="https://embed.example/csv")
+        output = tmp_path / "dashboards.csv"
+
+        result = cli.invoke(ckan, ['dashboard', 'export', str(output)])
+
+        assert not result.exit_code, result.output
+        content = output.read_text()
+        assert content.startswith("id,package_id,dashboard_type")
+        assert "https://embed.example/csv" in content
+
+    def test_import_round_trip(self, cli, tmp_path):
+        existing = DashboardFactory(dashboard_type="tableau")
+        dataset = factories.Dataset()
+        source = tmp_path / "dashboards.jsonl"
+        source.write_text("\n".join([
+            json.dumps({"package_id": existing.package_id, "dashboard_type": "powerbi"}),
+            json.dumps({"package_id": dataset["id"], "dashboard_type": "tableau",
+                        "embeded_url": "https://embed.example/new"}),
+            "not json",
+        ]))
+
+        result = cli.invoke(ckan, ['dashboard', 'import', str(source), '--chunk-size', '1'])
+
+        assert not result.exit_code, result.output
+        assert "created: 1, updated: 1, failed: 1" in result.output
+        assert model.Session.query(DatasetDashboard).filter_by(package_id=dataset["id"]).one()
+        updated = model.Session.query(DatasetDashboard).filter_by(id=existing.id).one()
+        assert updated.dashboard_type == "powerbi"
+
+    def test_import_dry_run_writes_nothing(self, cli, tmp_path):
+        dataset = factories.Dataset()
+        source = tmp_path / "dashboards.csv"
+        source.write_text(f"package_id,dashboard_type\n{dataset['id']},tableau\n")
+
+        result = cli.invoke(ckan, ['dashboard', 'import', str(source), '--dry-run'])
+
+        assert not result.exit_code, result.output
+        assert "created: 1" in result.output
+        assert model.Session.query(DatasetDashboard).count() == 0
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestBackfillUrls:
+
+    def test_backfill(self, cli):
+        dashboards = [
+            DashboardFactory(embeded_url=f"https://tableau.example.com/t/site-{n}/views/Workbook/View")
+            for n in range(5)
+        ]
+        # Rows written before the identifier columns existed
+        table = DatasetDashboard.__table__
+        model.Session.execute(update(table).values(embed_host=None, tableau_site=None, tableau_workbook=None))
+        model.Session.commit()
+
+        result = cli.invoke(ckan, ['dashboard', 'backfill-urls', '--batch-size', '2'])
+
+        assert not result.exit_code, result.output
+        assert "Done, 5 of 5 dashboards updated" in result.output
+        rows = model.Session.query(DatasetDashboard).order_by(DatasetDashboard.id).all()
+        assert [row.tableau_site for row in rows] == [f"site-{n}" for n in range(5)]
+        assert {row.embed_host for row in rows} == {"tableau.example.com"}
+        assert [row.version for row in rows] == [d.version for d in dashboards]
+
+        result = cli.invoke(ckan, ['dashboard', 'backfill-urls'])
+        assert "Done, 0 of 5 dashboards updated" in result.output
@@ -0,0 +1,204 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy import text, update
+from sqlalchemy.orm import Session
+from ckan import model
+from ckan.lib.helpers import url_for
+from ckan.plugins import toolkit as t
+from ckan.tests import factories, helpers
+
+from ckanext.dashboard import cache, changes
+from ckanext.dashboard.blueprints import dashboard as views
+from ckanext.dashboard.models import DatasetDashboard
+from ckanext.dashboard.tests.factories import DashboardFactory
+
+
+@pytest.fixture
+def setup_data():
+    data = {}
+    data["sysadmin"] = factories.SysadminWithToken()
+    data["datasets"] = [factories.Dataset(title=f"Dataset {n}") for n in range(3)]
+    data["dashboards"] = [
+        DashboardFactory(
+            package_id=dataset["id"], dashboard_type="tableau",
+            embeded_url=f"https://{'old.example.com' if n < 2 else 'other.example.com'}/views/{n}?embed=y",
+        )
+        for n, dataset in enumerate(data["datasets"])
+    ]
+    return data
+
+
+def _dashboard(dashboard_id):
+    return model.Session.query(DatasetDashboard).get(dashboard_id)
+
+
+def _lock_waits():
+    with model.meta.engine.connect() as connection:
+        return connection.execute(
+            text("SELECT count(*) FROM pg_stat_activity WHERE wait_event_type = 'Lock'")
+        ).scalar()
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestBulkActions:
+
+    def test_change_type(self, setup_data):
+        ids = [dashboard.id for dashboard in setup_data["dashboards"][:2]]
+        assert cache.get_dashboard(setup_data["datasets"][0]["id"]).dashboard_type == "tableau"
+
+        result = helpers.call_action("dataset_dashboard_bulk_update", ids=ids, dashboard_type="powerbi")
+
+        assert result == {"updated": 2}
+        assert [_dashboard(i).dashboard_type for i in ids] == ["powerbi", "powerbi"]
+        assert [_dashboard(i).version for i in ids] == [2, 2]
+        assert _dashboard(setup_data["dashboards"][2].id).dashboard_type == "tableau"
+        assert cache.get_dashboard(setup_data["datasets"][0]["id"]).dashboard_type == "powerbi"
+
+    def test_move_embed_host(self, setup_data):
+        ids = [dashboard.id for dashboard in setup_data["dashboards"]]
+
+        result = helpers.call_action(
+            "dataset_dashboard_bulk_update", ids=",".join(str(i) for i in ids),
+            from_host="old.example.com", to_host="new.example.com",
+        )
+
+        assert result == {"updated": 2}
+        assert [_dashboard(i).embeded_url for i in ids] == [
+            "https://new.example.com/views/0?embed=y",
+            "https://new.example.com/views/1?embed=y",
+            "https://other.example.com/views/2?embed=y",
+        ]
+        assert _dashboard(ids[0]).embed_host == "new.example.com"
+
+    def test_move_embed_host_without_path(self):
+        urls = ["https://old.example.com", "https://old.example.com?:embed=y", "https://old.example.com#x"]
+        ids = [
+            DashboardFactory(package_id=factories.Dataset()["id"], embeded_url=url).id for url in urls
+        ]
+
+        result = helpers.call_action(
+            "dataset_dashboard_bulk_update", ids=ids, from_host="old.example.com", to_host="new.example.com",
+        )
+
+        assert result == {"updated": 3}
+        assert [_dashboard(i).embeded_url for i in ids] == [
+            "https://new.example.com", "https://new.example.com?:embed=y", "https://new.example.com#x",
+        ]
+        assert {_dashboard(i).embed_host for i in ids} == {"new.example.com"}
+
+    @pytest.mark.parametrize("data", [
+        {"dashboard_type": "powerbi"},
+        {"ids": ["x"], "dashboard_type": "powerbi"},
+        {"ids": [1]},
+        {"ids": [1], "from_host": "old.example.com", "to_host": "https://new.example.com/"},
+    ])
+    def test_validation(self, setup_data, data):
+        with pytest.raises(t.ValidationError):
+            helpers.call_action("dataset_dashboard_bulk_update", **data)
+
+    def test_delete(self, setup_data):
+        ids = [dashboard.id for dashboard in setup_data["dashboards"][1:]]
+
+        assert helpers.call_action("dataset_dashboard_bulk_delete", ids=ids) == {"deleted": 2}
+
+        assert model.Session.query(DatasetDashboard.id).all() == [(setup_data["dashboards"][0].id,)]
+        assert cache.get_dashboard(setup_data["datasets"][1]["id"]) is None
+
+    def test_requires_sysadmin(self, setup_data):
+        context = {"user": factories.User()["name"], "ignore_auth": False}
+        ids = [setup_data["dashboards"][0].id]
+        with pytest.raises(t.NotAuthorized):
+            helpers.call_action("dataset_dashboard_bulk_update", context=context, ids=ids, dashboard_type="x")
+        with pytest.raises(t.NotAuthorized):
+            helpers.call_action("dataset_dashboard_bulk_delete", context=context, ids=ids)
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestLockOrder:
+
+    def test_bulk_update_queues_behind_a_dashboard_write(self, setup_data):
+        dashboard_id = setup_data["dashboards"][0].id
+        package_id = setup_data["datasets"][0]["id"]
+        locked = threading.Event()
+        errors = []
+
+        def edit():
+            # A form save on another connection, half way through
+            try:
+                with Session(model.meta.engine) as session:
+                    changes.lock(session, [package_id])
+                    locked.set()
+                    # Until the bulk update waits for a lock
+                    _wait_for(lambda: _lock_waits() > 0)
+                    session.execute(
+                        update(DatasetDashboard.__table__).where(DatasetDashboard.id == dashboard_id)
+                        .values(report_title="Edited")
+                    )
+                    session.commit()
+            except Exception as e:
+                errors.append(e)
+                locked.set()
+
+        thread = threading.Thread(target=edit)
+        thread.start()
+        locked.wait(5)
+        result = helpers.call_action("dataset_dashboard_bulk_update", ids=[dashboard_id], dashboard_type="powerbi")
+        thread.join(5)
+
+        assert errors == []
+        assert result == {"updated": 1}
+        dashboard = _dashboard(dashboard_id)
+        assert (dashboard.report_title, dashboard.dashboard_type) == ("Edited", "powerbi")
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestConsole:
+
+    def test_lists_dashboards(self, app, setup_data):
+        response = app.get(
+            url_for("embeded_dashboard.console"), headers={"Authorization": setup_data["sysadmin"]["token"]},
+        )
+
+        assert "3 dashboards" in response.body
+        assert "Dataset 2" in response.body
+        assert "https://other.example.com/views/2?embed=y" in response.body
+
+    def test_pages(self, app, setup_data, monkeypatch):
+        monkeypatch.setattr(views, "CONSOLE_PAGE_SIZE", 2)
+        headers = {"Authorization": setup_data["sysadmin"]["token"]}
+
+        response = app.get(url_for("embeded_dashboard.console", dashboard_type="tableau"), headers=headers)
+        assert "Dataset 1" in response.body
+        assert "Dataset 2" not in response.body
+        next_url = url_for(
+            "embeded_dashboard.console", marker=setup_data["dashboards"][1].id, dashboard_type="tableau",
+        )
+        assert next_url.replace("&", "&amp;") in response.body
+
+        response = app.get(next_url, headers=headers)
+        assert "Dataset 2" in response.body
+        assert "Dataset 1" not in response.body
+
+    def test_bulk_delete(self, app, setup_data):
+        ids = [dashboard.id for dashboard in setup_data["dashboards"][:2]]
+
+        response = app.post(
+            url_for("embeded_dashboard.console"), data={"operation": "delete", "ids": ids},
+            headers={"Authorization": setup_data["sysadmin"]["token"]},
+        )
+
+        assert "2 dashboards deleted" in response.body
+        assert model.Session.query(DatasetDashboard).count() == 1
+
+    def test_requires_sysadmin(self, app, setup_data):
+        user = factories.UserWithToken()
+        app.get(url_for("embeded_dashboard.console"), headers={"Authorization": user["token"]}, status=403)
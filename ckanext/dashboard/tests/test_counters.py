@@ -0,0 +1,143 @@
+import datetime
+import time
+
+import pytest
+from ckan import model
+from ckan.lib.helpers import url_for
+from ckan.plugins import toolkit as t
+from ckan.tests import factories, helpers
+
+from ckanext.dashboard import counters
+from ckanext.dashboard.counters import ViewCounter
+from ckanext.dashboard.models import DashboardViews
+from ckanext.dashboard.tests.factories import DashboardFactory
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+class TestViewCounter:
+
+    def test_views_are_written_in_one_batch(self):
+        batches = []
+        counter = ViewCounter(writer=batches.append, flush_interval=3600)
+
+        for package_id in ["b", "a", "b", "b"]:
+            counter.record(package_id)
+
+        assert batches == []
+        assert counter.flush() == 2
+        today = datetime.datetime.utcnow().date()
+        assert batches == [[
+            {"package_id": "a", "day": today, "views": 1},
+            {"package_id": "b", "day": today, "views": 3},
+        ]]
+        assert counter.flush() == 0
+        assert counter.stats()["flushed"] == 4
+
+    def test_flushes_after_enough_views(self):
+        batches = []
+        counter = ViewCounter(writer=batches.append, flush_interval=3600, flush_events=3)
+
+        for _ in range(3):
+            counter.record("a")
+
+        _wait_for(lambda: batches)
+        assert batches[0][0]["views"] == 3
+
+    def test_failed_writes_are_retried(self):
+        def fail(rows):
+            raise RuntimeError("Database is down")
+
+        counter = ViewCounter(writer=fail, flush_interval=3600)
+        counter.record("a")
+
+        assert counter.flush() == 0
+        assert counter.stats()["errors"] == 1
+
+        batches = []
+        counter.writer = batches.append
+        counter.record("a")
+        counter.flush()
+        assert batches[0][0]["views"] == 2
+
+
+def _views(package_id):
+    return model.Session.query(DashboardViews.views).filter_by(package_id=package_id).scalar()
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestCounting:
+
+    def test_dataset_page_counts_without_writing(self, app, query_budget):
+        dataset = factories.Dataset()
+        DashboardFactory(package_id=dataset["id"], dashboard_type="tableau")
+
+        with query_budget(0, tables=("dashboard_views_daily",)):
+            app.get(url_for("dataset.read", id=dataset["name"]))
+            app.get(url_for("dataset.read", id=dataset["name"]))
+
+        counters.counter.flush()
+        assert _views(dataset["id"]) == 2
+
+    def test_flushes_add_up(self):
+        dataset = factories.Dataset()
+        counters.counter.record(dataset["id"])
+        counters.counter.flush()
+        counters.counter.record(dataset["id"])
+        counters.counter.flush()
+
+        assert _views(dataset["id"]) == 2
+
+    def test_beacon(self, app, monkeypatch):
+        dataset = factories.Dataset()
+        DashboardFactory(package_id=dataset["id"], dashboard_type="tableau")
+        url = url_for("embeded_dashboard.view", package_id=dataset["id"])
+
+        app.post(url, status=404)
+
+        monkeypatch.setattr(counters.counter, "beacon", True)
+        response = app.get(url_for("dataset.read", id=dataset["name"]))
+        assert url in response.body
+
+        app.post(url, status=204)
+        app.post(url_for("embeded_dashboard.view", package_id=factories.Dataset()["id"]), status=404)
+        app.post(url_for("embeded_dashboard.view", package_id=dataset["name"]), status=400)
+        counters.counter.flush()
+        assert _views(dataset["id"]) == 1
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestPopular:
+
+    def test_most_viewed_first(self):
+        datasets = [factories.Dataset() for _ in range(3)]
+        private = factories.Dataset(private=True, owner_org=factories.Organization()["id"])
+        for dataset in datasets + [private]:
+            DashboardFactory(package_id=dataset["id"])
+        today = datetime.datetime.utcnow().date()
+        counters.write_views([
+            {"package_id": datasets[0]["id"], "day": today, "views": 5},
+            {"package_id": datasets[1]["id"], "day": today, "views": 7},
+            {"package_id": datasets[1]["id"], "day": today - datetime.timedelta(days=30), "views": 100},
+            {"package_id": datasets[2]["id"], "day": today - datetime.timedelta(days=1), "views": 6},
+            {"package_id": private["id"], "day": today, "views": 50},
+        ])
+
+        result = helpers.call_action("dataset_dashboard_popular", days=7, limit=2)
+
+        assert [(d["name"], d["views"]) for d in result] == [
+            (datasets[1]["name"], 7), (datasets[2]["name"], 6),
+        ]
+        result = helpers.call_action("dataset_dashboard_popular", days=1)
+        assert [d["package_id"] for d in result] == [datasets[1]["id"], datasets[0]["id"]]
+
+    def test_validation(self):
+        with pytest.raises(t.ValidationError):
+            helpers.call_action("dataset_dashboard_popular", days=0)
+        with pytest.raises(t.ValidationError):
+            helpers.call_action("dataset_dashboard_popular", limit=1000)
@@ -189,3 +189,21 @@ class TestDashboard:
         )
         # Depending on your validation, it could be 200, 400, or 302
         assert response.status_code in [200, 400, 302]
+
+    def test_dashboard_embed_is_lazy(self, app, setup_data):
+        """The dataset page renders a placeholder wired to the JS module
+        instead of loading the vendor script and the embed straight away"""
+        DashboardFactory(
+            package_id=setup_data.dataset["id"],
+            dashboard_type="tableau",
+            embeded_url="https://public.tableau.com/views/lazy",
+        )
+        response = app.get(
+            url_for("dataset.read", id=setup_data.dataset["name"]),
+            headers=setup_data.sysadmin["headers"]
+        )
+
+        assert 'data-module="dashboard-embed"' in response
+        assert 'data-module-src="https://public.tableau.com/views/lazy"' in response
+        assert "<tableau-viz" not in response
+        assert "tableau.embedding.3.latest.min.js" not in response
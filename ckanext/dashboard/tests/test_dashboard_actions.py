@@ -257,3 +257,30 @@ class TestDashboardActions:
             .first()
         )
         assert deleted is None
+
+    def test_show_public_dataset_skips_auth_chain(self, setup_data, monkeypatch):
+        """Dashboards of public datasets are authorized from the joined row."""
+        dash = DashboardFactory(package_id=setup_data["dataset"]["id"], dashboard_type="tableau")
+
+        def fail(*args, **kwargs):
+            raise AssertionError("package_show auth should not run")
+
+        monkeypatch.setattr(t, "check_access", fail)
+        out = helpers.call_action(
+            "dataset_dashboard_show",
+            context={"user": "", "ignore_auth": False},
+            pkg_id=setup_data["dataset"]["id"],
+        )
+        assert out["id"] == dash.id
+
+    def test_show_deleted_dataset_uses_auth_chain(self, setup_data):
+        """Dashboards of deleted datasets are only visible to who can see the dataset."""
+        DashboardFactory(package_id=setup_data["dataset"]["id"], dashboard_type="tableau")
+        helpers.call_action("package_delete", id=setup_data["dataset"]["id"])
+
+        with pytest.raises(t.NotAuthorized):
+            helpers.call_action(
+                "dataset_dashboard_show",
+                context={"user": setup_data["user"]["name"], "ignore_auth": False},
+                pkg_id=setup_data["dataset"]["id"],
+            )
@@ -0,0 +1,90 @@
+import pytest
+from ckan.plugins import toolkit as t
+from ckan.tests import helpers, factories
+from ckanext.dashboard.tests.factories import DashboardFactory
+
+
+@pytest.fixture
+def setup_data():
+    """Creates two organizations with dashboards of both types."""
+    data = {}
+    data["sysadmin"] = factories.Sysadmin()
+    data["org"] = factories.Organization()
+    data["other_org"] = factories.Organization()
+    data["dashboards"] = []
+    for n, org in enumerate([data["org"], data["org"], data["other_org"]]):
+        dataset = factories.Dataset(owner_org=org["id"])
+        data["dashboards"].append(DashboardFactory(
+            package_id=dataset["id"],
+            dashboard_type="tableau" if n % 2 == 0 else "powerbi",
+            embeded_url=f"https://{'public.tableau.com' if n % 2 == 0 else 'app.powerbi.com'}/view/{n}",
+        ))
+    return data
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestDashboardList:
+
+    def _list(self, setup_data, **kwargs):
+        ctx = {"user": setup_data["sysadmin"]["name"]}
+        return helpers.call_action("dataset_dashboard_list", context=ctx, **kwargs)
+
+    def test_keyset_pagination_walks_all_rows(self, setup_data):
+        seen = []
+        marker = None
+        while True:
+            page = self._list(setup_data, limit=2, marker=marker)
+            seen.extend(d["id"] for d in page["results"])
+            marker = page["next_marker"]
+            if marker is None:
+                break
+
+        assert seen == sorted(d.id for d in setup_data["dashboards"])
+
+    def test_filter_by_type(self, setup_data):
+        page = self._list(setup_data, dashboard_type="powerbi")
+        assert [d["dashboard_type"] for d in page["results"]] == ["powerbi"]
+
+    def test_filter_by_organization(self, setup_data):
+        page = self._list(setup_data, organization=setup_data["other_org"]["name"])
+        assert [d["id"] for d in page["results"]] == [setup_data["dashboards"][2].id]
+
+    def test_filter_by_embed_host(self, setup_data):
+        page = self._list(setup_data, embed_host="public.tableau.com")
+        assert len(page["results"]) == 2
+        assert all("public.tableau.com" in d["embeded_url"] for d in page["results"])
+
+    def test_filter_by_provider_ids(self, setup_data):
+        tableau = DashboardFactory(
+            dashboard_type="tableau", embeded_url="https://tableau.example.com/t/finance/views/Budget/Summary",
+        )
+        powerbi = DashboardFactory(
+            dashboard_type="powerbi",
+            embeded_url="https://app.powerbi.com/reportEmbed?reportId=R-1&groupId=G-1",
+        )
+
+        assert [d["id"] for d in self._list(setup_data, tableau_site="finance")["results"]] == [tableau.id]
+        assert [d["id"] for d in self._list(setup_data, tableau_workbook="Budget")["results"]] == [tableau.id]
+        assert [d["id"] for d in self._list(setup_data, powerbi_group_id="G-1")["results"]] == [powerbi.id]
+        assert [d["id"] for d in self._list(setup_data, powerbi_report_id="r-1")["results"]] == [powerbi.id]
+        assert self._list(setup_data, tableau_view="Other")["results"] == []
+
+    def test_totals(self, setup_data):
+        page = self._list(setup_data, limit=1, totals=True)
+        assert page["totals"] == {"tableau": 2, "powerbi": 1}
+        assert page["count"] == 3
+
+        page = self._list(setup_data, organization=setup_data["org"]["name"], totals=True)
+        assert page["totals"] == {"tableau": 1, "powerbi": 1}
+
+    def test_invalid_limit(self, setup_data):
+        with pytest.raises(t.ValidationError):
+            self._list(setup_data, limit=0)
+
+    def test_requires_sysadmin(self):
+        user = factories.User()
+        with pytest.raises(t.NotAuthorized):
+            helpers.call_action(
+                "dataset_dashboard_list",
+                context={"user": user["name"], "ignore_auth": False},
+            )
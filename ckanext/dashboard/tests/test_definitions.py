@@ -0,0 +1,163 @@
+import pytest
+from ckan import model
+from ckan.plugins import toolkit as t
+from ckan.tests import factories, helpers
+
+from ckanext.dashboard import cache, changes
+from ckanext.dashboard.models import DatasetDashboard
+
+TABLEAU_URL = "https://tableau.example.com/t/finance/views/Budget/Summary"
+
+
+@pytest.fixture
+def setup_data():
+    data = {}
+    data["definition"] = helpers.call_action(
+        "dataset_dashboard_definition_create", dashboard_type="tableau", embeded_url=TABLEAU_URL,
+        report_url="https://tableau.example.com/#/site/finance/views/Budget/Summary",
+    )
+    data["datasets"] = [factories.Dataset() for _ in range(3)]
+    data["dashboards"] = [
+        helpers.call_action(
+            "dataset_dashboard_create", package_id=dataset["id"], definition_id=data["definition"]["id"],
+        )
+        for dataset in data["datasets"]
+    ]
+    return data
+
+
+def _show(dataset):
+    return helpers.call_action("dataset_dashboard_show", pkg_id=dataset["id"])
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestDefinitions:
+
+    def test_datasets_show_the_definition(self, setup_data):
+        dashboard = _show(setup_data["datasets"][0])
+
+        assert dashboard["embeded_url"] == TABLEAU_URL
+        assert dashboard["dashboard_type"] == "tableau"
+        assert dashboard["tableau_workbook"] == "Budget"
+        assert dashboard["definition_id"] == setup_data["definition"]["id"]
+        assert dashboard["definition_version"] == 1
+        row = model.Session.query(DatasetDashboard).get(dashboard["id"])
+        assert row.embeded_url is None
+
+    def test_show_is_a_single_query(self, setup_data, query_budget):
+        with query_budget(1):
+            _show(setup_data["datasets"][0])
+
+    def test_update_is_a_single_row_write(self, setup_data, query_budget, monkeypatch):
+        # Reindexing goes through CKAN core, not what the budget is about
+        monkeypatch.setattr(changes.search, "reindex", lambda package_ids: None)
+        for dataset in setup_data["datasets"]:
+            assert cache.get_dashboard(dataset["id"]).embeded_url == TABLEAU_URL
+        new_url = TABLEAU_URL.replace("tableau.example.com", "tableau.example.org")
+
+        # The revision, lock, UPDATE, the datasets using it and their
+        # changes, whatever their number
+        with query_budget(5):
+            result = helpers.call_action(
+                "dataset_dashboard_definition_update", id=setup_data["definition"]["id"], embeded_url=new_url,
+            )
+
+        assert result["version"] == 2
+        assert result["dashboards"] == 3
+        assert result["embed_host"] == "tableau.example.org"
+        for dataset in setup_data["datasets"]:
+            assert cache.get_dashboard(dataset["id"]).embeded_url == new_url
+            assert _show(dataset)["definition_version"] == 2
+        versions = [row.version for row in model.Session.query(DatasetDashboard)]
+        assert versions == [1, 1, 1]
+
+    def test_update_checks_the_version(self, setup_data):
+        with pytest.raises(t.ValidationError):
+            helpers.call_action(
+                "dataset_dashboard_definition_update", id=setup_data["definition"]["id"],
+                report_title="Budget", expected_version=5,
+            )
+
+    def test_changing_one_dataset_copies_the_definition(self, setup_data):
+        dataset = setup_data["datasets"][0]
+
+        result = helpers.call_action("dataset_dashboard_update", package_id=dataset["id"], report_title="Mine")
+
+        assert result["definition_id"] is None
+        assert result["embeded_url"] == TABLEAU_URL
+        assert result["report_title"] == "Mine"
+        assert _show(setup_data["datasets"][1])["report_title"] == "View full report"
+
+    def test_switch_to_a_definition(self, setup_data):
+        dataset = factories.Dataset()
+        helpers.call_action(
+            "dataset_dashboard_create", package_id=dataset["id"], dashboard_type="powerbi",
+            embeded_url="https://app.powerbi.com/view?r=1",
+        )
+
+        result = helpers.call_action(
+            "dataset_dashboard_update", package_id=dataset["id"], definition_id=setup_data["definition"]["id"],
+        )
+
+        assert result["embeded_url"] == TABLEAU_URL
+        assert result["version"] == 2
+
+    def test_upsert_copies_the_definition(self, setup_data):
+        dataset = setup_data["datasets"][0]
+
+        helpers.call_action("dataset_dashboard_bulk_upsert", records=[
+            {"package_id": dataset["id"], "dashboard_type": "tableau", "report_title": "Upserted"},
+        ])
+
+        row = model.Session.query(DatasetDashboard).filter_by(package_id=dataset["id"]).one()
+        assert row.definition_id is None
+        assert row.embeded_url == TABLEAU_URL
+        assert row.tableau_site == "finance"
+        assert row.report_title == "Upserted"
+
+    def test_list_filters_match_definitions(self, setup_data):
+        own = helpers.call_action(
+            "dataset_dashboard_create", package_id=factories.Dataset()["id"], dashboard_type="tableau",
+            embeded_url="https://public.tableau.com/views/Other/View",
+        )
+
+        page = helpers.call_action(
+            "dataset_dashboard_list", embed_host="tableau.example.com", totals=True,
+        )
+        assert [d["id"] for d in page["results"]] == [d["id"] for d in setup_data["dashboards"]]
+        assert page["totals"] == {"tableau": 3}
+
+        page = helpers.call_action("dataset_dashboard_list", dashboard_type="tableau", totals=True)
+        assert page["count"] == 4
+        assert page["results"][-1]["id"] == own["id"]
+
+        page = helpers.call_action("dataset_dashboard_list", definition_id=setup_data["definition"]["id"])
+        assert len(page["results"]) == 3
+
+    def test_bulk_update_leaves_shared_dashboards_alone(self, setup_data):
+        ids = [dashboard["id"] for dashboard in setup_data["dashboards"]]
+
+        result = helpers.call_action("dataset_dashboard_bulk_update", ids=ids, dashboard_type="powerbi")
+
+        assert result == {"updated": 0}
+
+    def test_delete(self, setup_data):
+        definition_id = setup_data["definition"]["id"]
+        with pytest.raises(t.ValidationError):
+            helpers.call_action("dataset_dashboard_definition_delete", id=definition_id)
+
+        for dataset in setup_data["datasets"]:
+            helpers.call_action("dataset_dashboard_update", package_id=dataset["id"], definition_id="")
+        helpers.call_action("dataset_dashboard_definition_delete", id=definition_id)
+
+        with pytest.raises(t.ObjectNotFound):
+            helpers.call_action("dataset_dashboard_definition_show", id=definition_id)
+        assert _show(setup_data["datasets"][0])["embeded_url"] == TABLEAU_URL
+
+    def test_requires_sysadmin(self, setup_data):
+        context = {"user": factories.User()["name"], "ignore_auth": False}
+        with pytest.raises(t.NotAuthorized):
+            helpers.call_action(
+                "dataset_dashboard_definition_update", context=context, id=setup_data["definition"]["id"],
+                report_title="x",
+            )
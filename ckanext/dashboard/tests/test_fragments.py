@@ -0,0 +1,121 @@
+import pytest
+import redis
+from ckan.lib.helpers import url_for
+from ckan.tests import factories, helpers
+
+from ckanext.dashboard import fragments, tokens
+from ckanext.dashboard.fragments import FragmentCache, MemoryBackend
+from ckanext.dashboard.tests.factories import DashboardFactory
+
+
+class BrokenBackend:
+    name = 'broken'
+
+    def get(self, package_id, signature):
+        raise redis.ConnectionError("down")
+
+    def set(self, package_id, signature, html):
+        raise redis.ConnectionError("down")
+
+
+class TestFragmentCache:
+
+    def test_renders_once_per_signature(self):
+        fragment_cache = FragmentCache(MemoryBackend())
+        renders = []
+
+        def render():
+            renders.append(1)
+            return "<p>dashboard</p>"
+
+        assert fragment_cache.get_or_render("a", (1, "en"), render) == "<p>dashboard</p>"
+        assert fragment_cache.get_or_render("a", (1, "en"), render) == "<p>dashboard</p>"
+        fragment_cache.get_or_render("a", (2, "en"), render)
+        fragment_cache.get_or_render("a", (2, "es"), render)
+
+        assert len(renders) == 3
+        stats = fragment_cache.stats()
+        assert stats["hits"] == 1
+        assert stats["hit_ratio"] == 0.25
+        assert stats["render_time_avg_ms"] is not None
+
+    def test_locales_do_not_replace_each_other(self):
+        fragment_cache = FragmentCache(MemoryBackend())
+        renders = []
+
+        for locale in ["en", "es", "en", "es"]:
+            fragment_cache.get_or_render("a", (1, locale), lambda: renders.append(locale) or locale)
+
+        assert renders == ["en", "es"]
+        fragment_cache.invalidate("a")
+        fragment_cache.get_or_render("a", (1, "es"), lambda: renders.append("es") or "es")
+        assert renders == ["en", "es", "es"]
+
+    def test_backend_errors_fall_back_to_rendering(self):
+        fragment_cache = FragmentCache(BrokenBackend())
+
+        assert fragment_cache.get_or_render("a", (1,), lambda: "html") == "html"
+        assert fragment_cache.stats()["errors"] == 2
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestDatasetPageFragment:
+
+    def test_dataset_page_uses_the_cache(self, app):
+        dataset = factories.Dataset()
+        DashboardFactory(package_id=dataset["id"], embeded_url="https://embed.example/cached")
+        url = url_for("dataset.read", id=dataset["name"])
+
+        assert "https://embed.example/cached" in app.get(url)
+        assert "https://embed.example/cached" in app.get(url)
+
+        stats = fragments.stats()
+        assert (stats["hits"], stats["misses"]) == (1, 1)
+
+    def test_writes_invalidate_the_fragment(self, app):
+        dataset = factories.Dataset()
+        DashboardFactory(package_id=dataset["id"], embeded_url="https://embed.example/old")
+        url = url_for("dataset.read", id=dataset["name"])
+        app.get(url)
+
+        helpers.call_action(
+            "dataset_dashboard_update", package_id=dataset["id"], embeded_url="https://embed.example/new",
+        )
+        response = app.get(url)
+
+        assert "https://embed.example/new" in response
+        assert "https://embed.example/old" not in response
+
+    def test_token_config_changes_the_fragment(self, app, monkeypatch):
+        dataset = factories.Dataset()
+        DashboardFactory(
+            package_id=dataset["id"], dashboard_type="tableau",
+            embeded_url="https://tableau.example/views/Sales/Overview",
+        )
+        url = url_for("dataset.read", id=dataset["name"])
+        assert "data-module-token-url" not in app.get(url)
+
+        monkeypatch.setattr(tokens.broker, "providers", [
+            tokens.TableauConnectedApp("client", "secret-id", "secret-value", server_url="https://tableau.example"),
+        ])
+
+        assert "data-module-token-url" in app.get(url)
+
+    def test_assets_are_included_on_hits(self, app):
+        dataset = factories.Dataset()
+        DashboardFactory(package_id=dataset["id"])
+        url = url_for("dataset.read", id=dataset["name"])
+        app.get(url)
+
+        assert "dashboard.js" in app.get(url)
+
+    @pytest.mark.ckan_config("ckanext.dashboard.fragment_cache.backend", "none")
+    def test_cache_can_be_disabled(self, app):
+        dataset = factories.Dataset()
+        DashboardFactory(package_id=dataset["id"])
+        url = url_for("dataset.read", id=dataset["name"])
+        app.get(url)
+        app.get(url)
+
+        assert fragments.stats()["backend"] is None
+        assert fragments.stats()["hits"] == 0
@@ -0,0 +1,110 @@
+import pytest
+from ckan import model
+from ckan.lib.helpers import url_for
+from ckan.plugins import toolkit
+from ckan.tests import helpers, factories
+
+from ckanext.dashboard.models import DatasetDashboard
+from ckanext.dashboard.tests.factories import DashboardFactory
+
+
+@pytest.fixture
+def dashboard():
+    dataset = factories.Dataset()
+    return DashboardFactory(package_id=dataset["id"], dashboard_type="tableau")
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestVersioning:
+
+    def test_writes_bump_the_version(self, dashboard):
+        sysadmin = factories.Sysadmin()
+        context = {"user": sysadmin["name"]}
+        shown = helpers.call_action("dataset_dashboard_show", pkg_id=dashboard.package_id)
+        assert shown["version"] == 1
+        assert shown["updated_at"]
+
+        updated = helpers.call_action(
+            "dataset_dashboard_update", context=context,
+            package_id=dashboard.package_id, dashboard_type="powerbi",
+        )
+        assert updated["version"] == 2
+        assert updated["updated_at"] >= shown["updated_at"]
+
+        result = helpers.call_action(
+            "dataset_dashboard_bulk_upsert", context=context,
+            records=[{"package_id": dashboard.package_id, "dashboard_type": "tableau"}],
+        )
+        assert result["results"][0]["version"] == 3
+
+    def test_update_with_a_stale_version_fails(self, dashboard):
+        sysadmin = factories.Sysadmin()
+        context = {"user": sysadmin["name"]}
+        helpers.call_action(
+            "dataset_dashboard_update", context=context,
+            package_id=dashboard.package_id, report_title="First", expected_version=1,
+        )
+
+        with pytest.raises(toolkit.ValidationError, match="changed by someone else"):
+            helpers.call_action(
+                "dataset_dashboard_update", context=context,
+                package_id=dashboard.package_id, report_title="Second", expected_version=1,
+            )
+
+        stored = model.Session.query(DatasetDashboard).filter_by(id=dashboard.id).one()
+        assert stored.report_title == "First"
+        assert stored.version == 2
+
+    def test_edit_form_detects_concurrent_edits(self, app, dashboard):
+        sysadmin = factories.SysadminWithToken()
+        headers = {"Authorization": sysadmin["token"]}
+        url = url_for("embeded_dashboard.create", package_id=dashboard.package_id)
+        form = {"dashboard_type": "tableau", "embeded_url": "https://embed.example/1", "version": "1"}
+
+        app.post(url, data=form, headers=headers)
+        response = app.post(url, data=dict(form, embeded_url="https://embed.example/2"), headers=headers)
+
+        assert "changed by someone else" in response
+        stored = model.Session.query(DatasetDashboard).filter_by(id=dashboard.id).one()
+        assert stored.embeded_url == "https://embed.example/1"
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestConditionalRequests:
+
+    def test_show_api(self, app, dashboard):
+        url = url_for("api.action", ver=3, logic_function="dataset_dashboard_show", pkg_id=dashboard.package_id)
+
+        response = app.get(url)
+        etag = response.headers["ETag"]
+        assert etag == f'"{dashboard.id}-1"'
+        assert response.headers["Last-Modified"]
+
+        assert app.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+        helpers.call_action(
+            "dataset_dashboard_update", package_id=dashboard.package_id, report_title="Changed",
+        )
+        response = app.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.json["result"]["report_title"] == "Changed"
+
+    def test_fragment(self, app, dashboard):
+        url = url_for("embeded_dashboard.embed", package_id=dashboard.package_id)
+
+        response = app.get(url)
+        assert dashboard.embeded_url in response
+        etag = response.headers["ETag"]
+
+        response = app.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert not response.data
+
+        response = app.get(url, headers={"If-Modified-Since": response.headers["Last-Modified"]})
+        assert response.status_code == 304
+
+    def test_fragment_of_private_dataset(self, app):
+        dataset = factories.Dataset(owner_org=factories.Organization()["id"], private=True)
+        DashboardFactory(package_id=dataset["id"])
+
+        app.get(url_for("embeded_dashboard.embed", package_id=dataset["id"]), status=403)
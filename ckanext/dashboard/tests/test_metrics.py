@@ -0,0 +1,96 @@
+import socket
+
+import pytest
+from ckan.lib.helpers import url_for
+from ckan.plugins import toolkit
+from ckan.tests import factories, helpers
+
+from ckanext.dashboard import metrics
+from ckanext.dashboard.tests.factories import DashboardFactory
+
+
+@pytest.fixture
+def registry():
+    metrics.registry.clear()
+    yield metrics.registry
+    metrics.registry.clear()
+
+
+class TestInstrument:
+
+    def test_records_calls_errors_and_latency(self, registry):
+        @metrics.instrument('test')
+        def work(fail=False):
+            if fail:
+                raise ValueError()
+            return 42
+
+        assert work() == 42
+        with pytest.raises(ValueError):
+            work(fail=True)
+
+        values = registry.snapshot()[('test', 'work')]
+        assert values['calls'] == 2
+        assert values['errors'] == 1
+        assert sum(values['buckets']) == 2
+
+    def test_keeps_action_attributes(self):
+        @toolkit.side_effect_free
+        @metrics.instrument('action')
+        def some_action(context, data_dict):
+            pass
+
+        assert some_action.__name__ == 'some_action'
+        assert some_action.side_effect_free
+
+    def test_statsd_sink(self, registry):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(('127.0.0.1', 0))
+        receiver.settimeout(2)
+        registry.sink = metrics.StatsdSink('127.0.0.1', receiver.getsockname()[1], 'ckan')
+        try:
+            registry.observe('action', 'dataset_dashboard_show', 0.002, 1, False)
+            packet = receiver.recv(4096).decode('utf-8')
+        finally:
+            registry.sink = None
+            receiver.close()
+
+        assert packet.splitlines() == [
+            'ckan.action.dataset_dashboard_show.calls:1|c',
+            'ckan.action.dataset_dashboard_show.duration:2.000|ms',
+            'ckan.action.dataset_dashboard_show.sql_queries:1|c',
+        ]
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestMetricsEndpoint:
+
+    def test_actions_helpers_and_views_are_counted(self, app, registry):
+        sysadmin = factories.SysadminWithToken()
+        dataset = factories.Dataset()
+        DashboardFactory(package_id=dataset["id"])
+        helpers.call_action("dataset_dashboard_show", pkg_id=dataset["id"])
+        app.get(url_for("dataset.read", id=dataset["name"]))
+        app.get(url_for("embeded_dashboard.embed", package_id=dataset["id"]))
+
+        response = app.get(
+            url_for("embeded_dashboard.metrics"), headers={"Authorization": sysadmin["token"]}, status=200
+        )
+
+        assert response.headers["Content-Type"].startswith("text/plain")
+        body = response.body
+        assert 'ckanext_dashboard_calls_total{kind="action",name="dataset_dashboard_show"}' in body
+        assert 'ckanext_dashboard_calls_total{kind="helper",name="render_dataset_dashboard"} 1' in body
+        assert 'ckanext_dashboard_calls_total{kind="view",name="dashboard_embed"} 1' in body
+        assert ('ckanext_dashboard_duration_seconds_bucket'
+                '{kind="view",name="dashboard_embed",le="+Inf"} 1') in body
+        sql_line = next(
+            line for line in body.splitlines()
+            if line.startswith('ckanext_dashboard_sql_queries_total{kind="view",name="dashboard_embed"}')
+        )
+        assert int(sql_line.split()[-1]) > 0
+
+    def test_endpoint_is_sysadmin_only(self, app):
+        user = factories.UserWithToken()
+        app.get(url_for("embeded_dashboard.metrics"), headers={"Authorization": user["token"]}, status=403)
+        app.get(url_for("embeded_dashboard.metrics"), status=403)
@@ -0,0 +1,218 @@
+import pytest
+from sqlalchemy import event, text
+from ckan import model
+from ckan.lib.helpers import url_for
+from ckan.tests import factories, helpers
+
+from ckanext.dashboard import cache, changes
+from ckanext.dashboard.tests.factories import DashboardFactory, seed_dashboards
+
+
+@pytest.fixture
+def no_reindex(monkeypatch):
+    """Writes reindex their datasets through CKAN core, which is not what
+    the write budgets are about"""
+    monkeypatch.setattr(changes.search, "reindex", lambda package_ids: None)
+
+
+@pytest.fixture
+def pinned_revision(monkeypatch):
+    """Keeps the revision check out of the warm reads, however slow the
+    cold one was"""
+    monkeypatch.setattr(cache.revision_watcher, "check_interval", 3600)
+
+
+@pytest.fixture
+def setup_data():
+    data = {}
+    data["sysadmin"] = factories.SysadminWithToken()
+    data["org"] = factories.Organization()
+    data["datasets"] = [factories.Dataset(owner_org=data["org"]["id"]) for _ in range(3)]
+    data["dashboards"] = [
+        DashboardFactory(package_id=dataset["id"], dashboard_type="tableau") for dataset in data["datasets"]
+    ]
+    return data
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestReadBudgets:
+
+    def test_show(self, setup_data, query_budget):
+        with query_budget(1):
+            helpers.call_action(
+                "dataset_dashboard_show", context={"user": "", "ignore_auth": False},
+                pkg_id=setup_data["datasets"][0]["id"],
+            )
+
+    def test_show_many(self, setup_data, query_budget, pinned_revision):
+        package_ids = [dataset["id"] for dataset in setup_data["datasets"]]
+        cache.clear()
+        # Revision check, index of datasets with dashboards and one batch
+        with query_budget(3):
+            helpers.call_action("dataset_dashboard_show_many", package_ids=package_ids)
+        with query_budget(0):
+            helpers.call_action("dataset_dashboard_show_many", package_ids=package_ids)
+
+    def test_list(self, setup_data, query_budget):
+        context = {"user": setup_data["sysadmin"]["name"]}
+        with query_budget(1):
+            helpers.call_action(
+                "dataset_dashboard_list", context=context, dashboard_type="tableau",
+                embed_host="embed.com", limit=2,
+            )
+
+    def test_dataset_page(self, app, setup_data, query_budget, pinned_revision):
+        url = url_for("dataset.read", id=setup_data["datasets"][0]["name"])
+        cache.clear()
+        with query_budget(3):
+            app.get(url)
+        with query_budget(0):
+            app.get(url)
+
+    def test_embed_fragment(self, app, setup_data, query_budget):
+        with query_budget(1):
+            app.get(url_for("embeded_dashboard.embed", package_id=setup_data["datasets"][0]["id"]))
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db', 'no_reindex')
+class TestWriteBudgets:
+
+    def test_create(self, setup_data, query_budget):
+        dataset = factories.Dataset()
+        with query_budget(2):
+            helpers.call_action("dataset_dashboard_create", package_id=dataset["id"], dashboard_type="tableau")
+
+    def test_update(self, setup_data, query_budget):
+        # Load, update, revision and reading back version and updated_at
+        with query_budget(4):
+            helpers.call_action(
+                "dataset_dashboard_update", package_id=setup_data["datasets"][0]["id"], report_title="New",
+            )
+
+    def test_delete(self, setup_data, query_budget):
+        with query_budget(3):
+            helpers.call_action("dataset_dashboard_delete", id=setup_data["dashboards"][0].id)
+
+    def test_bulk_upsert_is_constant(self, setup_data, query_budget):
+        datasets = [factories.Dataset() for _ in range(10)]
+        records = [{"package_id": dataset["id"], "dashboard_type": "powerbi"} for dataset in datasets]
+        records += [{"package_id": dataset["id"], "dashboard_type": "powerbi"} for dataset in setup_data["datasets"]]
+        # Revision, a single INSERT ... ON CONFLICT for the whole chunk and
+        # the changes of the datasets written
+        with query_budget(3):
+            helpers.call_action("dataset_dashboard_bulk_upsert", records=records)
+
+    def test_bulk_update_is_constant(self, setup_data, query_budget):
+        ids = [dashboard.id for dashboard in setup_data["dashboards"]]
+        ids += [DashboardFactory().id for _ in range(10)]
+        # The revision, one UPDATE for all of them and their changes
+        with query_budget(3):
+            helpers.call_action("dataset_dashboard_bulk_update", ids=ids, dashboard_type="powerbi")
+        with query_budget(3):
+            helpers.call_action("dataset_dashboard_bulk_delete", ids=ids)
+
+
+@pytest.fixture
+def explain():
+    """Runs ``func`` and returns the plans of the filtered SELECTs it ran on
+    the dashboard table, as lists of (node type, relation, index)"""
+    def explain(func):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if (statement.lstrip().upper().startswith("SELECT") and "FROM dashboard_dashboard" in statement
+                    and "WHERE" in statement):
+                statements.append((statement, parameters))
+
+        engine = model.meta.engine
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            func()
+        finally:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+        assert statements, "No query on dashboard_dashboard was run"
+        connection = model.Session.connection()
+        return [
+            list(_scans(connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters)
+                        .scalar()[0]["Plan"]))
+            for statement, parameters in statements
+        ]
+    return explain
+
+
+def _scans(plan):
+    yield plan["Node Type"], plan.get("Relation Name"), plan.get("Index Name")
+    for child in plan.get("Plans", []):
+        yield from _scans(child)
+
+
+@pytest.fixture
+def large_table():
+    """10k datasets, half of them with a dashboard, plus a few with
+    dashboards hosted somewhere else"""
+    org = factories.Organization()
+    with_dashboard, _ = seed_dashboards(10000, 0.5, org["id"])
+    rare = [
+        DashboardFactory(embeded_url=f"https://rare.example.com/views/{n}", dashboard_type="tableau")
+        for n in range(3)
+    ]
+    model.Session.execute(text("ANALYZE dashboard_dashboard"))
+    model.Session.commit()
+    return with_dashboard, rare
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestQueryPlans:
+
+    def _assert_index_scans(self, plans, index_names):
+        for plan in plans:
+            assert ("Seq Scan", "dashboard_dashboard", None) not in plan, plan
+            used = {index for _, _, index in plan if index}
+            assert used & set(index_names), plan
+
+    def test_lookup_by_package_id(self, large_table, explain):
+        (package_id, _) = large_table[0][1234]
+        cache.clear()
+
+        plans = explain(lambda: cache.get_dashboard(package_id))
+        plans += explain(lambda: helpers.call_action("dataset_dashboard_show", pkg_id=package_id))
+
+        self._assert_index_scans(plans, ["dashboard_dashboard_package_id_key"])
+
+    def test_batch_lookup_by_package_id(self, large_table, explain):
+        package_ids = [package_id for package_id, _ in large_table[0][:20]]
+        cache.clear()
+
+        plans = explain(lambda: cache.get_dashboards(package_ids))
+
+        self._assert_index_scans(plans, ["dashboard_dashboard_package_id_key"])
+
+    def test_lookup_by_id(self, large_table, explain):
+        rare = large_table[1][0]
+
+        plans = explain(lambda: helpers.call_action("dataset_dashboard_delete", id=rare.id))
+
+        # Reindexing the dataset afterwards looks it up by package_id
+        assert any(index == "dashboard_dashboard_pkey" for _, _, index in plans[0]), plans[0]
+        self._assert_index_scans(plans, ["dashboard_dashboard_pkey", "dashboard_dashboard_package_id_key"])
+
+    def test_list_by_embed_host(self, large_table, explain):
+        plans = explain(lambda: helpers.call_action("dataset_dashboard_list", embed_host="rare.example.com"))
+
+        self._assert_index_scans(plans, ["idx_dashboard_dashboard_embed_host_id"])
+
+    def test_list_by_provider_ids(self, large_table, explain):
+        plans = explain(lambda: helpers.call_action("dataset_dashboard_list", tableau_workbook="bench-1234"))
+        plans += explain(lambda: helpers.call_action("dataset_dashboard_list", powerbi_report_id="r-1"))
+
+        self._assert_index_scans(plans, [
+            "idx_dashboard_dashboard_tableau_workbook", "idx_dashboard_dashboard_powerbi_report_id",
+        ])
+
+    def test_list_pages(self, large_table, explain):
+        plans = explain(lambda: helpers.call_action(
+            "dataset_dashboard_list", dashboard_type="powerbi", marker=2000, limit=100,
+        ))
+
+        self._assert_index_scans(plans, ["idx_dashboard_dashboard_type_id", "dashboard_dashboard_pkey"])
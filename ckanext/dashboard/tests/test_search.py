@@ -0,0 +1,42 @@
+import pytest
+from ckan.tests import helpers, factories
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
+class TestDashboardIndexing:
+
+    def _create(self, dataset, **kwargs):
+        sysadmin = factories.Sysadmin()
+        return helpers.call_action(
+            "dataset_dashboard_create", context={"user": sysadmin["name"]},
+            package_id=dataset["id"], **kwargs
+        )
+
+    def test_dashboard_fields_are_indexed(self):
+        dataset = factories.Dataset()
+        factories.Dataset()
+        self._create(dataset, dashboard_type="tableau", embeded_url="https://public.tableau.com/views/x")
+
+        result = helpers.call_action("package_search", fq="has_dashboard:true")
+        assert [d["id"] for d in result["results"]] == [dataset["id"]]
+
+        result = helpers.call_action("package_search", fq="dashboard_host:public.tableau.com")
+        assert result["count"] == 1
+
+    def test_dashboard_type_facet(self):
+        self._create(factories.Dataset(), dashboard_type="tableau")
+        self._create(factories.Dataset(), dashboard_type="powerbi")
+        self._create(factories.Dataset(), dashboard_type="powerbi")
+
+        result = helpers.call_action("package_search", **{"facet.field": ["dashboard_type"]})
+        assert result["facets"]["dashboard_type"] == {"powerbi": 2, "tableau": 1}
+
+    def test_delete_reindexes(self):
+        sysadmin = factories.Sysadmin()
+        dataset = factories.Dataset()
+        dashboard = self._create(dataset, dashboard_type="tableau")
+
+        helpers.call_action("dataset_dashboard_delete", context={"user": sysadmin["name"]}, id=dashboard["id"])
+
+        result = helpers.call_action("package_search", fq="has_dashboard:true")
+        assert result["count"] == 0
@@ -0,0 +1,103 @@
+import pytest
+from sqlalchemy import event
+from ckan import model
+from ckan.tests import helpers, factories
+
+from ckanext.dashboard import cache
+from ckanext.dashboard.plugin import DashboardPlugin
+from ckanext.dashboard.tests.factories import DashboardFactory
+
+
+@pytest.fixture
+def dashboard_queries():
+    """Collects the SQL statements that read the dashboard table"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if "FROM dashboard_dashboard" in statement:
+            statements.append(statement)
+
+    engine = model.meta.engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+@pytest.fixture
+def setup_data():
+    data = {}
+    data["org"] = factories.Organization()
+    data["public"] = [factories.Dataset(owner_org=data["org"]["id"]) for _ in range(3)]
+    data["private"] = factories.Dataset(owner_org=data["org"]["id"], private=True)
+    data["without_dashboard"] = factories.Dataset(owner_org=data["org"]["id"])
+    for dataset in data["public"] + [data["private"]]:
+        DashboardFactory(package_id=dataset["id"], dashboard_type="tableau", report_title=None)
+    return data
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestDashboardShowMany:
+
+    def test_returns_visible_dashboards_in_order(self, setup_data):
+        ids = [d["id"] for d in reversed(setup_data["public"])]
+        ids += [setup_data["private"]["id"], setup_data["without_dashboard"]["id"], "missing"]
+
+        out = helpers.call_action(
+            "dataset_dashboard_show_many", context={"user": "", "ignore_auth": False}, package_ids=ids
+        )
+
+        assert [d["package_id"] for d in out] == ids[:3]
+        assert out[0]["report_title"] == "View full report"
+
+    def test_org_members_see_private_dashboards(self, setup_data):
+        user = factories.User()
+        helpers.call_action(
+            "organization_member_create", id=setup_data["org"]["id"], username=user["name"], role="member"
+        )
+
+        out = helpers.call_action(
+            "dataset_dashboard_show_many", context={"user": user["name"], "ignore_auth": False},
+            package_ids=[setup_data["private"]["id"]],
+        )
+
+        assert len(out) == 1
+
+    def test_single_query(self, setup_data, dashboard_queries):
+        cache.clear()
+        helpers.call_action(
+            "dataset_dashboard_show_many", package_ids=[d["id"] for d in setup_data["public"]]
+        )
+
+        # One to load the index of datasets with dashboards, one for the batch
+        assert len(dashboard_queries) == 2
+
+    def test_package_dict_not_enriched_by_default(self, setup_data):
+        pkg = helpers.call_action("package_show", id=setup_data["public"][0]["id"])
+        assert "dashboard" not in pkg
+
+    def test_package_dict_left_alone_by_default(self, setup_data):
+        pkg_dict = {"id": setup_data["public"][0]["id"], "dashboard": "A field of another schema"}
+
+        DashboardPlugin().after_dataset_show({}, pkg_dict)
+
+        assert pkg_dict["dashboard"] == "A field of another schema"
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
+@pytest.mark.ckan_config("ckanext.dashboard.include_in_package_dict", "true")
+class TestPackageDictEnrichment:
+
+    def test_package_show(self, setup_data):
+        pkg = helpers.call_action("package_show", id=setup_data["public"][0]["id"])
+        assert pkg["dashboard"]["dashboard_type"] == "tableau"
+
+        pkg = helpers.call_action("package_show", id=setup_data["without_dashboard"]["id"])
+        assert pkg["dashboard"] is None
+
+    def test_package_search_uses_one_query(self, setup_data, dashboard_queries):
+        cache.clear()
+        result = helpers.call_action("package_search", rows=100)
+
+        with_dashboard = [pkg for pkg in result["results"] if pkg["dashboard"]]
+        assert len(with_dashboard) == len(setup_data["public"])
+        assert len(dashboard_queries) == 2
@@ -0,0 +1,71 @@
+import pytest
+from ckan import model
+from ckan.tests import factories, helpers
+
+from ckanext.dashboard import urls
+from ckanext.dashboard.models import DatasetDashboard
+from ckanext.dashboard.tests.factories import DashboardFactory
+
+
+@pytest.mark.parametrize("embeded_url, report_url, expected", [
+    ("https://public.tableau.com/views/Sales/Overview?:embed=y", None,
+     {"embed_host": "public.tableau.com", "tableau_workbook": "Sales", "tableau_view": "Overview"}),
+    ("https://public.tableau.com/app/profile/jane/viz/Covid/Cases", None,
+     {"embed_host": "public.tableau.com", "tableau_workbook": "Covid", "tableau_view": "Cases"}),
+    ("https://tableau.example.com/t/finance/views/Budget/Summary", None,
+     {"embed_host": "tableau.example.com", "tableau_site": "finance", "tableau_workbook": "Budget",
+      "tableau_view": "Summary"}),
+    ("https://Tableau.Example.com/#/site/hr/views/People/Headcount", None,
+     {"embed_host": "tableau.example.com", "tableau_site": "hr", "tableau_workbook": "People",
+      "tableau_view": "Headcount"}),
+    ("https://tableau.example.com/views/Budget/Summary", None,
+     {"embed_host": "tableau.example.com", "tableau_site": "", "tableau_workbook": "Budget",
+      "tableau_view": "Summary"}),
+    ("https://app.powerbi.com/reportEmbed?reportId=AAAA-1&groupId=BBBB-2&autoAuth=true", None,
+     {"embed_host": "app.powerbi.com", "powerbi_group_id": "bbbb-2", "powerbi_report_id": "aaaa-1"}),
+    ("https://app.powerbi.com/view?r=eyJrIjoiNz", "https://app.powerbi.com/groups/me/reports/CCCC-3/ReportSection",
+     {"embed_host": "app.powerbi.com", "powerbi_report_id": "cccc-3"}),
+    ("https://embed.example/embed-1.html", None, {"embed_host": "embed.example"}),
+    (None, None, {}),
+    ("http://[broken", None, {}),
+])
+def test_identifiers(embeded_url, report_url, expected):
+    assert urls.identifiers(embeded_url, report_url) == dict(dict.fromkeys(urls.URL_FIELDS), **expected)
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+class TestWrites:
+
+    def test_create_and_update_parse_the_urls(self):
+        dataset = factories.Dataset()
+        helpers.call_action(
+            "dataset_dashboard_create", package_id=dataset["id"], dashboard_type="tableau",
+            embeded_url="https://tableau.example.com/t/finance/views/Budget/Summary",
+        )
+        dashboard = helpers.call_action(
+            "dataset_dashboard_update", package_id=dataset["id"],
+            embeded_url="https://tableau.example.com/t/finance/views/Budget/Detail",
+        )
+
+        assert dashboard["tableau_site"] == "finance"
+        assert dashboard["tableau_view"] == "Detail"
+
+    def test_bulk_upsert_parses_the_urls(self):
+        dataset = factories.Dataset()
+        DashboardFactory(
+            package_id=dataset["id"], dashboard_type="powerbi",
+            embeded_url="https://app.powerbi.com/reportEmbed?reportId=r-1&groupId=g-1",
+        )
+
+        helpers.call_action("dataset_dashboard_bulk_upsert", records=[
+            {"package_id": dataset["id"], "dashboard_type": "powerbi", "report_title": "Only the title"},
+        ])
+        dashboard = model.Session.query(DatasetDashboard).filter_by(package_id=dataset["id"]).one()
+        assert (dashboard.powerbi_group_id, dashboard.powerbi_report_id) == ("g-1", "r-1")
+
+        helpers.call_action("dataset_dashboard_bulk_upsert", records=[
+            {"package_id": dataset["id"], "dashboard_type": "powerbi",
+             "embeded_url": "https://app.powerbi.com/reportEmbed?reportId=r-2"},
+        ])
+        model.Session.refresh(dashboard)
+        assert (dashboard.powerbi_group_id, dashboard.powerbi_report_id) == (None, "r-2")
@@ -0,0 +1,420 @@
+"""
+Embed tokens for secured Tableau and Power BI dashboards
+"""
+
+import datetime
+import logging
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import jwt
+import requests
+
+from ckan.plugins import toolkit
+
+from ckanext.dashboard.cache import LRUCache
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PROVIDERS = 'tableau powerbi'
+DEFAULT_TOKEN_CACHE_SIZE = 1000
+DEFAULT_REFRESH_AHEAD = 120
+# Tokens closer than this to their expiry are not handed out, the browser
+# needs some time to use them
+MIN_TOKEN_VALIDITY = 30
+DEFAULT_MINT_TIMEOUT = 10
+DEFAULT_TABLEAU_TOKEN_LIFETIME = 600
+DEFAULT_POWERBI_AUTHORITY_URL = 'https://login.microsoftonline.com'
+DEFAULT_POWERBI_API_URL = 'https://api.powerbi.com'
+POWERBI_SCOPE = 'https://analysis.windows.net/powerbi/api/.default'
+
+
+class TokenError(Exception):
+    """The provider could not issue an embed token"""
+
+
+Token = namedtuple('Token', ['value', 'expires_at'])
+
+
+class TokenProvider:
+    """Issues embed tokens for the dashboards of one BI tool.
+
+    Subclasses are registered in ``PROVIDERS`` and built by ``from_config``,
+    which returns ``None`` when the provider is not configured.
+    """
+    name = None
+
+    @classmethod
+    def from_config(cls, config):
+        raise NotImplementedError
+
+    def handles(self, dashboard):
+        """Whether ``dashboard`` is embedded with a token from this provider"""
+        raise NotImplementedError
+
+    def scope(self, dashboard, user):
+        """Who the token is for. Tokens are shared by the users with the
+        same scope."""
+        return ''
+
+    def mint(self, dashboard, scope):
+        """Returns a new ``Token``, raises ``TokenError`` on failure"""
+        raise NotImplementedError
+
+    def embed_config(self, dashboard):
+        """Extra values the browser needs to embed the dashboard"""
+        return {}
+
+
+def _port(parts):
+    return parts.port or {'http': 80, 'https': 443}.get(parts.scheme)
+
+
+def _on_server(url, server_url):
+    """Whether ``url`` is on ``server_url``, compared by parts: a plain
+    prefix would accept hosts like ``tableau.example.evil.net``, which
+    then get a token and load their own embedding script"""
+    try:
+        parts = urlsplit(url)
+        server = urlsplit(server_url)
+        if parts.username is not None or parts.password is not None:
+            return False
+        if (parts.scheme.lower(), parts.hostname, _port(parts)) != (
+                server.scheme.lower(), server.hostname, _port(server)):
+            return False
+    except ValueError:
+        return False
+    path = server.path.rstrip('/')
+    return parts.path == path or parts.path.startswith(path + '/')
+
+
+class TableauConnectedApp(TokenProvider):
+    """JSON Web Tokens of a Tableau Connected App (direct trust).
+
+    The tokens are signed here with the app's secret, Tableau checks them
+    when the viz is loaded. They are issued for the configured Tableau
+    user, or for the Tableau user with the same name as the CKAN user.
+    """
+    name = 'tableau'
+
+    def __init__(self, client_id, secret_id, secret_value, server_url=None, username=None,
+                 lifetime=DEFAULT_TABLEAU_TOKEN_LIFETIME):
+        self.client_id = client_id
+        self.secret_id = secret_id
+        self.secret_value = secret_value
+        self.server_url = server_url
+        self.username = username
+        self.lifetime = lifetime
+
+    @classmethod
+    def from_config(cls, config):
+        client_id = config.get('ckanext.dashboard.tableau.client_id')
+        if not client_id:
+            return None
+        if not config.get('ckanext.dashboard.tableau.server_url'):
+            log.warning(
+                "ckanext.dashboard.tableau.server_url is not set, no Tableau dashboard gets an embed token"
+            )
+        return cls(
+            client_id,
+            config.get('ckanext.dashboard.tableau.secret_id'),
+            config.get('ckanext.dashboard.tableau.secret_value'),
+            server_url=config.get('ckanext.dashboard.tableau.server_url'),
+            username=config.get('ckanext.dashboard.tableau.username'),
+            lifetime=toolkit.asint(
+                config.get('ckanext.dashboard.tableau.token_lifetime', DEFAULT_TABLEAU_TOKEN_LIFETIME)
+            ),
+        )
+
+    def handles(self, dashboard):
+        # Without a server, public dashboards (e.g. on public.tableau.com)
+        # would suddenly require a login
+        if dashboard.dashboard_type != 'tableau' or not dashboard.embeded_url or not self.server_url:
+            return False
+        return _on_server(dashboard.embeded_url, self.server_url)
+
+    def scope(self, dashboard, user):
+        scope = self.username or user
+        if not scope:
+            raise toolkit.NotAuthorized('Log in to view this dashboard')
+        return scope
+
+    def mint(self, dashboard, scope):
+        expires_at = time.time() + self.lifetime
+        claims = {
+            'iss': self.client_id,
+            'aud': 'tableau',
+            'sub': scope,
+            'jti': str(uuid.uuid4()),
+            'exp': int(expires_at),
+            'scp': ['tableau:views:embed'],
+        }
+        value = jwt.encode(
+            claims, self.secret_value, algorithm='HS256',
+            headers={'kid': self.secret_id, 'iss': self.client_id},
+        )
+        return Token(value, int(expires_at))
+
+
+class PowerBIEmbedded(TokenProvider):
+    """Power BI embed tokens, for the "embed for your customers" scenario.
+
+    A service principal gets an Azure AD access token, which is used to call
+    GenerateToken for the report parsed from the dashboard's URLs.
+    The tokens give view access without row level security, so all users
+    share them.
+    """
+    name = 'powerbi'
+
+    def __init__(self, tenant_id, client_id, client_secret, authority_url=DEFAULT_POWERBI_AUTHORITY_URL,
+                 api_url=DEFAULT_POWERBI_API_URL, timeout=DEFAULT_MINT_TIMEOUT):
+        self.tenant_id = tenant_id
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.authority_url = authority_url.rstrip('/')
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self._access_token = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        client_id = config.get('ckanext.dashboard.powerbi.client_id')
+        if not client_id:
+            return None
+        return cls(
+            config.get('ckanext.dashboard.powerbi.tenant_id'),
+            client_id,
+            config.get('ckanext.dashboard.powerbi.client_secret'),
+            authority_url=config.get('ckanext.dashboard.powerbi.authority_url', DEFAULT_POWERBI_AUTHORITY_URL),
+            api_url=config.get('ckanext.dashboard.powerbi.api_url', DEFAULT_POWERBI_API_URL),
+            timeout=toolkit.asint(config.get('ckanext.dashboard.tokens.timeout', DEFAULT_MINT_TIMEOUT)),
+        )
+
+    def handles(self, dashboard):
+        return dashboard.dashboard_type == 'powerbi' and bool(dashboard.powerbi_report_id)
+
+    def _post(self, url, **kwargs):
+        try:
+            response = requests.post(url, timeout=self.timeout, **kwargs)
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise TokenError(f'Power BI request to {url} failed: {e}')
+
+    def access_token(self):
+        """Azure AD token of the service principal, reused until it is
+        about to expire"""
+        with self._lock:
+            if self._access_token and self._access_token.expires_at - time.time() > MIN_TOKEN_VALIDITY:
+                return self._access_token.value
+            data = self._post(
+                f'{self.authority_url}/{self.tenant_id}/oauth2/v2.0/token',
+                data={
+                    'grant_type': 'client_credentials',
+                    'client_id': self.client_id,
+                    'client_secret': self.client_secret,
+                    'scope': POWERBI_SCOPE,
+                },
+            )
+            self._access_token = Token(data['access_token'], time.time() + int(data.get('expires_in', 0)))
+            return self._access_token.value
+
+    def mint(self, dashboard, scope):
+        report_id, group_id = dashboard.powerbi_report_id, dashboard.powerbi_group_id
+        path = f'groups/{group_id}/reports/{report_id}' if group_id else f'reports/{report_id}'
+        data = self._post(
+            f'{self.api_url}/v1.0/myorg/{path}/GenerateToken',
+            json={'accessLevel': 'View'},
+            headers={'Authorization': f'Bearer {self.access_token()}'},
+        )
+        try:
+            expiration = datetime.datetime.fromisoformat(data['expiration'].replace('Z', '+00:00'))
+            return Token(data['token'], int(expiration.timestamp()))
+        except (KeyError, ValueError) as e:
+            raise TokenError(f'Unexpected Power BI GenerateToken response: {e}')
+
+    def embed_config(self, dashboard):
+        return {'report_id': dashboard.powerbi_report_id}
+
+
+PROVIDERS = {
+    TableauConnectedApp.name: TableauConnectedApp,
+    PowerBIEmbedded.name: PowerBIEmbedded,
+}
+
+
+class _Mint:
+    """A token being minted, which concurrent requests for it wait for"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.token = None
+        self.error = None
+
+    def wait(self, timeout):
+        if not self.done.wait(timeout):
+            raise TokenError('Timed out waiting for the embed token')
+        if self.error:
+            raise self.error
+        return self.token
+
+
+class TokenBroker:
+    """Cache of embed tokens per (dashboard or definition version, scope).
+
+    Tokens are minted once per key, however many requests ask for it at the
+    same time. Tokens that expire within ``refresh_ahead`` seconds are still
+    handed out while a new one is minted in the background, so requests only
+    wait for the provider on the first view.
+    """
+
+    def __init__(self, providers=(), refresh_ahead=DEFAULT_REFRESH_AHEAD,
+                 maxsize=DEFAULT_TOKEN_CACHE_SIZE, timeout=DEFAULT_MINT_TIMEOUT):
+        self.providers = list(providers)
+        self.refresh_ahead = refresh_ahead
+        self.timeout = timeout
+        # Expiry is checked against each token's own expires_at
+        self._tokens = LRUCache(maxsize, ttl=float('inf'))
+        self._minting = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.mints = 0
+        self.refreshes = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def provider_for(self, dashboard):
+        for provider in self.providers:
+            if provider.handles(dashboard):
+                return provider
+        return None
+
+    def get(self, dashboard, user):
+        """Returns ``(provider, token)`` for ``dashboard`` as seen by
+        ``user``, or ``None`` if it is not embedded with a token"""
+        provider = self.provider_for(dashboard)
+        if not provider:
+            return None
+        scope = provider.scope(dashboard, user)
+        if dashboard.definition_id:
+            # Datasets sharing a definition embed the same report
+            key = (provider.name, 'definition', dashboard.definition_id, dashboard.definition_version, scope)
+        else:
+            key = (provider.name, 'dashboard', dashboard.id, dashboard.version, scope)
+
+        token = self._tokens.get(key, None)
+        remaining = token.expires_at - time.time() if token else 0
+        if remaining > self.refresh_ahead:
+            return provider, token
+        if remaining > MIN_TOKEN_VALIDITY:
+            mint, first = self._start(key)
+            if first:
+                with self._lock:
+                    self.refreshes += 1
+                self._background().submit(self._mint, mint, key, provider, dashboard, scope)
+            return provider, token
+
+        mint, first = self._start(key)
+        if first:
+            self._mint(mint, key, provider, dashboard, scope)
+        return provider, mint.wait(self.timeout)
+
+    def _start(self, key):
+        """Returns the mint of ``key`` in progress, and whether the caller
+        just started it and has to run it"""
+        with self._lock:
+            mint = self._minting.get(key)
+            if mint:
+                self.coalesced += 1
+                return mint, False
+            mint = self._minting[key] = _Mint()
+            return mint, True
+
+    def _mint(self, mint, key, provider, dashboard, scope):
+        try:
+            mint.token = provider.mint(dashboard, scope)
+            self._tokens.set(key, mint.token)
+            with self._lock:
+                self.mints += 1
+        except Exception as e:
+            log.warning(f"Could not get a {provider.name} embed token for dashboard {dashboard.id}: {e}")
+            mint.error = e if isinstance(e, TokenError) else TokenError(str(e))
+            with self._lock:
+                self.errors += 1
+        finally:
+            with self._lock:
+                self._minting.pop(key, None)
+            mint.done.set()
+
+    def _background(self):
+        with self._lock:
+            if not self._executor:
+                self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='dashboard-token')
+            return self._executor
+
+    def clear(self):
+        self._tokens.clear()
+        with self._lock:
+            self._reset_counters()
+
+    def stats(self):
+        stats = self._tokens.stats()
+        with self._lock:
+            return {
+                'providers': [provider.name for provider in self.providers],
+                'size': stats['size'],
+                'hits': stats['hits'],
+                'mints': self.mints,
+                'refreshes': self.refreshes,
+                'coalesced': self.coalesced,
+                'errors': self.errors,
+            }
+
+
+broker = TokenBroker()
+
+
+def configure(config):
+    """Sets up the providers listed in ``ckanext.dashboard.tokens.providers``
+    that have credentials configured"""
+    providers = []
+    for name in config.get('ckanext.dashboard.tokens.providers', DEFAULT_PROVIDERS).split():
+        if name not in PROVIDERS:
+            raise ValueError(
+                f"Invalid ckanext.dashboard.tokens.providers: {name}, must be one of {', '.join(PROVIDERS)}"
+            )
+        provider = PROVIDERS[name].from_config(config)
+        if provider:
+            providers.append(provider)
+    broker.providers = providers
+    broker.refresh_ahead = toolkit.asint(
+        config.get('ckanext.dashboard.tokens.refresh_ahead', DEFAULT_REFRESH_AHEAD)
+    )
+    broker.timeout = toolkit.asint(config.get('ckanext.dashboard.tokens.timeout', DEFAULT_MINT_TIMEOUT))
+    broker._tokens.resize(
+        toolkit.asint(config.get('ckanext.dashboard.tokens.cache_size', DEFAULT_TOKEN_CACHE_SIZE)),
+        float('inf'),
+    )
+    broker.clear()
+    if providers:
+        log.debug(f"Dashboard embed token providers: {[provider.name for provider in providers]}")
+
+
+def requires_token(dashboard):
+    return broker.provider_for(dashboard) is not None
+
+
+def get_token(dashboard, user):
+    return broker.get(dashboard, user)
+
+
+def stats():
+    return broker.stats()
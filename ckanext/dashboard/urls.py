@@ -0,0 +1,110 @@
+"""
+Parsing of the dashboard URLs into the identifiers of the BI tools
+"""
+
+from urllib.parse import parse_qs, urlparse
+
+# Columns of DatasetDashboard filled from the URLs, with their length
+URL_FIELDS = {
+    'embed_host': 255,
+    'tableau_site': 255,
+    'tableau_workbook': 255,
+    'tableau_view': 255,
+    'powerbi_group_id': 64,
+    'powerbi_report_id': 64,
+}
+
+# Power BI's "My workspace" has no group id
+POWERBI_PERSONAL_WORKSPACE = 'me'
+
+
+def embed_host(url):
+    """Lower case host name of a URL, or '' if it has none"""
+    try:
+        return (urlparse(url).hostname or '') if url else ''
+    except ValueError:
+        return ''
+
+
+def _segments(parsed):
+    # Tableau Server also uses URLs like https://server/#/site/sales/views/...
+    path = parsed.fragment if parsed.fragment.startswith('/') else parsed.path
+    return [segment for segment in path.split('/') if segment]
+
+
+def tableau_ids(parsed):
+    """(site, workbook, view) of a Tableau view URL, like
+    /t/<site>/views/<workbook>/<view>, /#/site/<site>/views/<workbook>/<view>
+    or /app/profile/<user>/viz/<workbook>/<view> on Tableau Public. The site
+    is '' for the default site and None on Tableau Public."""
+    segments = _segments(parsed)
+    site = None
+    if len(segments) > 1 and segments[0] in ('t', 'site'):
+        site, segments = segments[1], segments[2:]
+    for marker in ('views', 'viz'):
+        if marker in segments:
+            position = segments.index(marker)
+            names = segments[position + 1:position + 3]
+            if not names:
+                break
+            if site is None and marker == 'views' and 'tableau.com' not in (parsed.hostname or ''):
+                site = ''
+            return site, names[0], names[1] if len(names) > 1 else None
+    return None, None, None
+
+
+def powerbi_ids(parsed):
+    """(group id, report id) of a Power BI report URL, either a reportEmbed
+    URL with reportId and groupId or /groups/<group>/reports/<report>"""
+    query = {key.lower(): values[0] for key, values in parse_qs(parsed.query).items()}
+    group_id, report_id = query.get('groupid'), query.get('reportid')
+    segments = _segments(parsed)
+    if not report_id and 'reports' in segments:
+        position = segments.index('reports')
+        report_id = segments[position + 1] if position + 1 < len(segments) else None
+        if 'groups' in segments[:position]:
+            group_id = segments[segments.index('groups') + 1]
+    if group_id and group_id.lower() == POWERBI_PERSONAL_WORKSPACE:
+        group_id = None
+    return (group_id.lower() if group_id else None), (report_id.lower() if report_id else None)
+
+
+TABLEAU_FIELDS = ('tableau_site', 'tableau_workbook', 'tableau_view')
+POWERBI_FIELDS = ('powerbi_group_id', 'powerbi_report_id')
+
+
+def _ids(url):
+    if not url:
+        return {}
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return {}
+    ids = {}
+    site, workbook, view = tableau_ids(parsed)
+    if workbook:
+        ids.update(zip(TABLEAU_FIELDS, (site, workbook, view)))
+    group_id, report_id = powerbi_ids(parsed)
+    if report_id:
+        ids.update(zip(POWERBI_FIELDS, (group_id, report_id)))
+    return ids
+
+
+def identifiers(embeded_url, report_url=None):
+    """Values of the URL_FIELDS for a dashboard.
+
+    The identifiers come from the embed URL. If it has none of a BI tool,
+    like the Power BI "publish to web" links, they come from the report URL.
+    Values too long for their column are left out.
+    """
+    values = dict.fromkeys(URL_FIELDS)
+    values['embed_host'] = embed_host(embeded_url) or None
+    embedded, report = _ids(embeded_url), _ids(report_url)
+    for fields in (TABLEAU_FIELDS, POWERBI_FIELDS):
+        # The workbook or the report is always there when the tool is
+        source = embedded if fields[1] in embedded else report
+        values.update((field, source.get(field)) for field in fields)
+    return {
+        field: value if value is None or len(value) <= URL_FIELDS[field] else None
+        for field, value in values.items()
+    }